@@ -1,7 +1,16 @@
+import logging
+
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackContext
-from bot.states.user_states import USER_STATE, FAVORITES, PREV_MESSAGE
 from bot.handlers.favorites import send_favorites_menu
+from bot.handlers.handle_format import format_favorite_cart
+from bot.states.cart import resolve_cart
+from bot.states.storage import get_storage
+from config import BD_path
+from parser.catalog import get_catalog
+from tracing import span, trace_request
+
+logger = logging.getLogger(__name__)
 
 async def send_main_menu(update: Update, context: CallbackContext, text: str) -> None:
     """Отправка главного меню с кастомным текстом."""
@@ -11,7 +20,7 @@ async def send_main_menu(update: Update, context: CallbackContext, text: str) ->
         [InlineKeyboardButton("📝 Составить рецепт", callback_data='recipe')]  # Добавляем кнопку для рецепта
     ]
 
-    if chat_id in FAVORITES and FAVORITES[chat_id]:
+    if (await get_storage().chat(chat_id)).favorites:
         keyboard.append([InlineKeyboardButton("Просмотреть избранное", callback_data='view_favorites')])
 
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -26,57 +35,75 @@ async def button(update: Update, context: CallbackContext) -> None:
     """Обработка нажатий кнопок."""
     query = update.callback_query
     chat_id = query.message.chat.id
+    storage = get_storage()
     await query.answer()
 
-    if query.data == 'shopping':
-        USER_STATE[chat_id] = 'shopping'
-        await query.edit_message_text("Опишите, что хотите приготовить или введите список продуктов.")
-    elif query.data == 'recipe':
-        USER_STATE[chat_id] = 'recipe'
-        await query.edit_message_text(
-            "Опишите, какое блюдо вы хотите приготовить или введите список продуктов")
-    elif query.data == 'add_to_favorites':
-        USER_STATE[chat_id] = 'naming_cart'
-        await query.edit_message_text("Как вы хотите назвать свою корзину?")
-    elif query.data.startswith('view_cart:'):
-        cart_name = query.data.split(':', 1)[1]
-        favorite_cart = FAVORITES.get(chat_id, {}).get(cart_name, [])
-        total_price = sum(item.get('price', 0) for item in favorite_cart)
-        formatted_cart = PREV_MESSAGE[chat_id]
+    with trace_request(chat_id, action=query.data.split(':', 1)[0]):
+        if query.data == 'shopping':
+            storage.set_state(chat_id, 'shopping')
+            await query.edit_message_text("Опишите, что хотите приготовить или введите список продуктов.")
+        elif query.data == 'recipe':
+            storage.set_state(chat_id, 'recipe')
+            await query.edit_message_text(
+                "Опишите, какое блюдо вы хотите приготовить или введите список продуктов")
+        elif query.data == 'add_to_favorites':
+            storage.set_state(chat_id, 'naming_cart')
+            await query.edit_message_text("Как вы хотите назвать свою корзину?")
+        elif query.data.startswith('view_cart:'):
+            cart_name = query.data.split(':', 1)[1]
+            chat = await storage.chat(chat_id)
+            favorite_cart = chat.favorites.get(cart_name, [])
+            keyboard = [
+                [InlineKeyboardButton("Удалить корзину", callback_data=f"delete_cart:{cart_name}")],
+                [InlineKeyboardButton("Назад", callback_data='view_favorites')]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
 
-        keyboard = [
-            [InlineKeyboardButton("Удалить корзину", callback_data=f"delete_cart:{cart_name}")],
-            [InlineKeyboardButton("Назад", callback_data='view_favorites')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+            # Названия, ссылки и цены берутся из текущего каталога
+            with span("favorites.resolve", items=len(favorite_cart)) as current:
+                try:
+                    snapshot = get_catalog(BD_path).snapshot()
+                except (OSError, ValueError) as e:
+                    current.set(error=str(e))
+                    logger.warning(f"Не удалось загрузить базу продуктов для корзины '{cart_name}': {e}")
+                    snapshot = None
+                if snapshot is not None:
+                    _, products = resolve_cart(favorite_cart, snapshot)
+                    total_price, formatted_cart = format_favorite_cart(favorite_cart, products)
 
-        await query.edit_message_text(
-            f"Содержимое корзины '{cart_name}':\n\n{formatted_cart}\n\nИтоговая стоимость: {total_price} ₽",
-            reply_markup=reply_markup,
-            parse_mode="Markdown"
-        )
-    elif query.data.startswith('delete_cart:'):
-        cart_name = query.data.split(':', 1)[1]
-        if chat_id in FAVORITES and cart_name in FAVORITES[chat_id]:
-            del FAVORITES[chat_id][cart_name]
-        await send_favorites_menu(update, context)
-    elif query.data == 'choose_another_name':
-        USER_STATE[chat_id] = 'naming_cart'
-        await query.edit_message_text("Введите новое имя для корзины.")
-    elif query.data == 'cancel_addition':
-        USER_STATE.pop(chat_id, None)
-        await send_main_menu(update, context, "Могу ли я вам ещё чем-нибудь помочь?")
-    elif query.data == 'back':
-        await send_main_menu(update, context, "Могу ли я вам ещё чем-нибудь помочь?")
-    elif query.data == 'view_favorites':
-        await send_favorites_menu(update, context)
-    elif query.data == 'help':
-        help_text = (
-            "Вот что я могу сделать:\n"
-            "1. 🍎 /shopping Составить корзину - помогу подобрать продукты.\n"
-            "2. 📝 /recipe Составить рецепт - помогу создать рецепт на основе продуктов.\n"
-            "3. /view_favorites Просмотреть избранное - просмотрите сохранённые корзины.\n"
-            "4. ❓ /help - Помощь.\n"
-        )
-        await query.edit_message_text(help_text)
+            if snapshot is None:
+                await query.edit_message_text(
+                    f"Не удалось загрузить базу продуктов, поэтому содержимое корзины '{cart_name}' "
+                    "сейчас недоступно. Попробуйте позже.",
+                    reply_markup=reply_markup
+                )
+            else:
+                await query.edit_message_text(
+                    f"Содержимое корзины '{cart_name}':\n\n{formatted_cart}\n\nИтоговая стоимость: {total_price} ₽",
+                    reply_markup=reply_markup,
+                    parse_mode="Markdown"
+                )
+        elif query.data.startswith('delete_cart:'):
+            cart_name = query.data.split(':', 1)[1]
+            storage.delete_favorite(chat_id, cart_name)
+            await send_favorites_menu(update, context)
+        elif query.data == 'choose_another_name':
+            storage.set_state(chat_id, 'naming_cart')
+            await query.edit_message_text("Введите новое имя для корзины.")
+        elif query.data == 'cancel_addition':
+            storage.set_state(chat_id, None)
+            await send_main_menu(update, context, "Могу ли я вам ещё чем-нибудь помочь?")
+        elif query.data == 'back':
+            await send_main_menu(update, context, "Могу ли я вам ещё чем-нибудь помочь?")
+        elif query.data == 'view_favorites':
+            await send_favorites_menu(update, context)
+        elif query.data == 'help':
+            help_text = (
+                "Вот что я могу сделать:\n"
+                "1. 🍎 /shopping Составить корзину - помогу подобрать продукты.\n"
+                "2. 📝 /recipe Составить рецепт - помогу создать рецепт на основе продуктов.\n"
+                "3. /view_favorites Просмотреть избранное - просмотрите сохранённые корзины.\n"
+                "4. ❓ /help - Помощь.\n"
+            )
+            await query.edit_message_text(help_text)
 
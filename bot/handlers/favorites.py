@@ -1,11 +1,37 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackContext
-from bot.states.user_states import FAVORITES
+from bot.states.cart import cart_changed, resolve_carts
+from bot.states.storage import get_storage
+from config import BD_path
+from parser.catalog import get_catalog
+
+
+def favorite_buttons(favorite_carts):
+    """
+    Кнопки избранных корзин с их текущей стоимостью.
+
+    Все корзины разбираются по текущему снимку каталога одним запросом; корзины, в которых изменились цены
+    или пропали товары, помечаются. Если база продуктов недоступна, показываются только названия.
+    """
+    try:
+        snapshot = get_catalog(BD_path).snapshot()
+    except (OSError, ValueError):
+        return [InlineKeyboardButton(cart_name, callback_data=f"view_cart:{cart_name}")
+                for cart_name in favorite_carts]
+
+    resolved = resolve_carts(list(favorite_carts.values()), snapshot)
+    buttons = []
+    for (cart_name, cart), (_, products) in zip(favorite_carts.items(), resolved):
+        total_price = sum(product['total_price'] for product in products if product)
+        mark = " ⚠️" if cart_changed(cart, products) else ""
+        buttons.append(InlineKeyboardButton(f"{cart_name} — {total_price} ₽{mark}",
+                                            callback_data=f"view_cart:{cart_name}"))
+    return buttons
 
 async def send_favorites_menu(update: Update, context: CallbackContext) -> None:
     """Отправка меню с избранными корзинами."""
     chat_id = update.effective_chat.id
-    favorite_carts = FAVORITES.get(chat_id, {})
+    favorite_carts = (await get_storage().chat(chat_id)).favorites
 
     if not favorite_carts:
         # Если корзин нет, отправляем сообщение и оставляем его на экране
@@ -33,8 +59,7 @@ async def send_favorites_menu(update: Update, context: CallbackContext) -> None:
         return
 
     # Если корзины есть, показываем их
-    keyboard = [[InlineKeyboardButton(cart_name, callback_data=f"view_cart:{cart_name}")]
-                for cart_name in favorite_carts]
+    keyboard = [[button] for button in favorite_buttons(favorite_carts)]
     keyboard.append([InlineKeyboardButton("Назад", callback_data='back')])
 
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -3,7 +3,7 @@ def format_ingredients_list(ingredients, ingredients_list_with_links):
     total_price = 0
     formatted_list = ""
 
-    for i, key in enumerate(ingredients.keys()):
+    for i, key in enumerate(ingredients):
         item = ingredients_list_with_links[i] if i < len(ingredients_list_with_links) else None
         if item:
             name, link, packs_needed, price = item.get('name', 'неизвестно'), item.get('link', '#'), item.get(
@@ -16,6 +16,31 @@ def format_ingredients_list(ingredients, ingredients_list_with_links):
     return total_price, formatted_list
 
 
+def format_favorite_cart(cart, products):
+    """
+    Форматирование сохранённой корзины с актуальными ценами (см. resolve_cart).
+
+    Отмечает товары, цена которых изменилась с момента сохранения, и товары, которых больше нет в продаже.
+    """
+    total_price = 0
+    formatted_list = ""
+
+    for i, (item, product) in enumerate(zip(cart, products)):
+        if product:
+            name, link, price = product.get('name', 'неизвестно'), product.get('link', '#'), product.get('price', 0)
+            formatted_list += f"{i + 1}. [{name}]({link}) - {item.packs_needed} шт, {product['total_price']} ₽"
+            if 'old_price' in product:
+                formatted_list += f" (цена изменилась: {product['old_price']} → {price} ₽ за шт)"
+            formatted_list += "\n"
+            total_price += product['total_price']
+        elif item.product_id:
+            formatted_list += f"{i + 1}. {item.ingredient} - нет в наличии\n"
+        else:
+            formatted_list += f"{i + 1}. {item.ingredient} - не удалось найти\n"
+
+    return total_price, formatted_list
+
+
 def format_recipe_ingredients(ingredients, ingredients_list_with_links):
     """Форматирование списка ингредиентов для рецепта."""
     formatted_list = "*Ваш список продуктов для рецепта:*\n\n"
@@ -1,17 +1,28 @@
+import asyncio
+import logging
+import time
+
 from telegram import Update
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import CallbackContext
 
 from bot.handlers.buttons import send_main_menu
 from bot.handlers.handle_format import format_recipe_ingredients
-from bot.states.user_states import USER_STATE
-from gpt_request import get_ingredients_list, get_preparation_instructions
+from bot.states.storage import get_storage
+from gpt_request import get_ingredients_list_async, stream_preparation_instructions
 from parser.match_product import get_links_from_list
-from config import BD_path
+from config import BD_path, TELEGRAM_EDIT_INTERVAL
+from tracing import span
+
+MAX_MESSAGE_LENGTH = MessageLimit.MAX_TEXT_LENGTH
+
+logger = logging.getLogger(__name__)
 
 
 async def process_recipe(update: Update, context: CallbackContext, text: str, chat_id: int) -> None:
     """Обработка состояния 'recipe'."""
-    result = get_ingredients_list(text)
+    result = await get_ingredients_list_async(text)
 
     if "error" in result:
         await update.message.reply_text(
@@ -19,29 +30,126 @@ async def process_recipe(update: Update, context: CallbackContext, text: str, ch
         return
 
     dish, ingredients = result['dish'], result['ingredients']
-    ingredients_list_with_links = get_links_from_list(ingredients, BD_path)
 
-
-    formatted_list = format_recipe_ingredients(ingredients, ingredients_list_with_links)
+    # Для инструкции нужны только блюдо и ингредиенты: запускаем генерацию сразу, параллельно с подбором продуктов
+    instructions_stream = stream_preparation_instructions(dish, ingredients)
+    first_part = asyncio.create_task(instructions_stream.__anext__())
 
     try:
-        instructions = get_preparation_instructions(dish, ingredients)
-    except ValueError as e:
-        await update.message.reply_text(f"Ошибка при получении инструкции: {e}")
-        return
+        # Подбор продуктов идёт в отдельном потоке, чтобы цикл событий продолжал получать инструкцию
+        ingredients_list_with_links = await asyncio.to_thread(get_links_from_list, ingredients, BD_path)
+        with span("format"):
+            formatted_list = format_recipe_ingredients(ingredients, ingredients_list_with_links)
+
+        # Список продуктов отправляем сразу, инструкцию дописываем в то же сообщение по мере генерации
+        with span("telegram.send"):
+            recipe_message = await update.message.reply_text(
+                f"{formatted_list}\n*Рецепт для {dish}:*\n\nГотовлю инструкцию по приготовлению...",
+                parse_mode="Markdown"
+            )
 
-    final_message = f"{formatted_list}\n*Рецепт для {dish}:*\n\n*Инструкция по приготовлению:*\n\n{instructions}"
-    await update.message.reply_text(final_message, parse_mode="Markdown")
+        header = f"{formatted_list}\n*Рецепт для {dish}:*\n\n*Инструкция по приготовлению:*\n\n"
+        try:
+            with span("gpt.first_chunk"):
+                instructions = await first_part
+            sent_text = await edit_partial_text(recipe_message, header + instructions)
+            last_edit = time.monotonic()
+
+            async for instructions in instructions_stream:
+                # Не чаще одного редактирования в TELEGRAM_EDIT_INTERVAL секунд, чтобы не упираться в лимиты Telegram
+                if time.monotonic() - last_edit >= TELEGRAM_EDIT_INTERVAL:
+                    sent_text = await edit_partial_text(recipe_message, header + instructions) or sent_text
+                    last_edit = time.monotonic()
+        except ValueError as e:
+            await update.message.reply_text(f"Ошибка при получении инструкции: {e}")
+            return
+    finally:
+        # Если подбор продуктов или отправка списка не удались, инструкция уже не нужна: генератор закрывается,
+        # и поток перестаёт читать ответ модели
+        first_part.cancel()
+        await asyncio.gather(first_part, return_exceptions=True)
+        await instructions_stream.aclose()
+
+    await edit_final_text(update, recipe_message, header + instructions, sent_text)
 
     await send_main_menu(update, context, "Могу ли я вам ещё чем-нибудь помочь?")
-    USER_STATE[chat_id] = None
+    get_storage().set_state(chat_id, None)
+
+
+async def edit_partial_text(message, text: str):
+    """
+    Редактирование сообщения недописанной инструкцией.
+
+    Недописанный текст может содержать незакрытую разметку, а Telegram может ограничить частоту
+    редактирований, поэтому ошибки здесь не прерывают генерацию. Возвращает отправленный текст или None.
+    """
+    if len(text) > MAX_MESSAGE_LENGTH:
+        return None
+    with span("telegram.edit", final=False) as current:
+        try:
+            await message.edit_text(text, parse_mode="Markdown")
+        except (BadRequest, RetryAfter) as e:
+            current.set(rejected=type(e).__name__)
+            return None
+    return text
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list:
+    """Делит текст на части не длиннее limit по границам строк (слишком длинная строка режется по limit)."""
+    parts, current = [], ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            parts.append(current)
+            current = ""
+        current += line
+    if current or not parts:
+        parts.append(current)
+    return parts
+
+
+async def send_markdown(send, text: str) -> None:
+    """
+    Отправка или редактирование с разметкой Markdown.
+
+    Если Telegram не принимает разметку (например, незакрытую звёздочку в инструкции), текст отправляется без неё.
+    """
+    try:
+        await send(text, parse_mode="Markdown")
+    except BadRequest as e:
+        logger.warning(f"Telegram не принял разметку, отправляем текст без неё: {e}")
+        try:
+            await send(text)
+        except BadRequest as e:
+            logger.warning(f"Не удалось отправить текст: {e}")
+
+
+async def edit_final_text(update: Update, message, text: str, sent_text):
+    """
+    Последнее редактирование сообщения полной инструкцией.
+
+    Текст длиннее лимита Telegram делится по строкам: начало остаётся в сообщении, остальное отправляется
+    следующими сообщениями. Ошибки Telegram не прерывают обработчик, чтобы пользователь вернулся в главное меню.
+    """
+    first, *rest = split_message(text)
+    with span("telegram.edit", final=True, parts=1 + len(rest)):
+        if first != sent_text:
+            await send_markdown(message.edit_text, first)
+        for part in rest:
+            await send_markdown(update.message.reply_text, part)
+
 
-def fetch_ingredients_list(text: str):
+async def fetch_ingredients_list(text: str):
     """Получение списка ингредиентов."""
     try:
-        ans = get_ingredients_list(text)
+        ans = await get_ingredients_list_async(text)
         return ans["ingredients"]
-    except Exception:
-        print("Ошибка: Не удалось получить корректный JSON после нескольких попыток.")
+    except Exception as e:
+        logger.warning(f"Не удалось получить список ингредиентов: {e}")
         return None
 
@@ -3,35 +3,41 @@ from telegram.ext import CallbackContext
 
 from bot.handlers.handle_format import format_ingredients_list
 from bot.handlers.handle_recipe import fetch_ingredients_list
-from bot.states.user_states import PURCHASE_HISTORY, PREV_MESSAGE, USER_STATE
+from bot.states.cart import compact_cart
+from bot.states.storage import get_storage
 from parser.match_product import get_links_from_list
 from config import BD_path
+from tracing import span
 
 
 async def process_shopping(update: Update, context: CallbackContext, chat_id: int, text: str) -> None:
     """Обработка состояния 'shopping'."""
     processing_message = await update.message.reply_text("Ваш запрос обрабатывается, пожалуйста, подождите...")
 
-    ingredients_list = fetch_ingredients_list(text)
+    ingredients_list = await fetch_ingredients_list(text)
     if not ingredients_list:
         await processing_message.edit_text(
             "Извините, нам не удалось найти подходящие продукты. Пожалуйста, повторите ваш запрос еще раз.")
         return
 
     ingredients_list_with_links = get_links_from_list(ingredients_list, BD_path)
-    context.user_data["last_cart"] = ingredients_list_with_links
+    # Храним только номера товаров и количество упаковок, остальное берётся из каталога при показе
+    last_cart = compact_cart(ingredients_list, ingredients_list_with_links)
+    context.user_data["last_cart"] = last_cart
 
     if not ingredients_list_with_links:
         await processing_message.edit_text(
             "Извините, нам не удалось вам помочь. Пожалуйста, повторите ваш запрос еще раз.")
         return
 
-    total_price, formatted_list = format_ingredients_list(ingredients_list, ingredients_list_with_links)
+    with span("format"):
+        total_price, formatted_list = format_ingredients_list(ingredients_list, ingredients_list_with_links)
 
-    await processing_message.edit_text(
-        f"Ваш список продуктов готов:\n{formatted_list}\n\nИтоговая стоимость: {total_price} ₽",
-        parse_mode="Markdown"
-    )
+    with span("telegram.edit"):
+        await processing_message.edit_text(
+            f"Ваш список продуктов готов:\n{formatted_list}\n\nИтоговая стоимость: {total_price} ₽",
+            parse_mode="Markdown"
+        )
 
     keyboard = [
         [InlineKeyboardButton("Да", callback_data='add_to_favorites')],
@@ -40,6 +46,6 @@ async def process_shopping(update: Update, context: CallbackContext, chat_id: in
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text("Хотите ли вы добавить эту корзину в избранное?", reply_markup=reply_markup)
 
-    PURCHASE_HISTORY.setdefault(chat_id, []).append(ingredients_list_with_links)
-    USER_STATE[chat_id] = 'ask_favorite'
-    PREV_MESSAGE[chat_id] = formatted_list
+    storage = get_storage()
+    storage.add_purchase(chat_id, last_cart)
+    storage.set_state(chat_id, 'ask_favorite')
@@ -5,7 +5,8 @@ from bot.handlers.handle_recipe import process_recipe
 
 from bot.handlers.handle_shopping import process_shopping
 from bot.utils.logger import log
-from bot.states.user_states import USER_STATE
+from bot.states.storage import get_storage
+from tracing import trace_request
 
 
 async def handle_text(update: Update, context: CallbackContext) -> None:
@@ -13,17 +14,18 @@ async def handle_text(update: Update, context: CallbackContext) -> None:
     log(update)
     chat_id = update.effective_chat.id
     text = update.message.text.strip()
-    state = USER_STATE.get(chat_id)
+    state = (await get_storage().chat(chat_id)).state
 
-    if state == 'shopping':
-        await process_shopping(update, context, chat_id, text)
+    with trace_request(chat_id, state=state):
+        if state == 'shopping':
+            await process_shopping(update, context, chat_id, text)
 
-    elif state == 'naming_cart':
-        await process_naming_cart(update, context, chat_id, text)
+        elif state == 'naming_cart':
+            await process_naming_cart(update, context, chat_id, text)
 
-    elif state == 'recipe':
-        await process_recipe(update, context, text, chat_id)
+        elif state == 'recipe':
+            await process_recipe(update, context, text, chat_id)
 
-    else:
-        await update.message.reply_text("Пожалуйста, выберите команду из меню.")
+        else:
+            await update.message.reply_text("Пожалуйста, выберите команду из меню.")
 
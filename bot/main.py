@@ -8,9 +8,21 @@ from bot.handlers.buttons import button
 from bot.handlers.favorites import send_favorites_menu
 from bot.handlers.text_message import handle_text
 from config import TOKEN
+from bot.states.storage import close_storage
+from gpt_request import close_gpt_clients
+from tracing import close_exporter
+from parser.update_bd import schedule_bd_update
+
+
+async def shutdown(application: Application) -> None:
+    """Закрытие соединений с OpenAI, сохранение состояния чатов и файла спанов при остановке бота."""
+    close_gpt_clients()
+    close_storage()
+    close_exporter()
+
 
 def main():
-    application = Application.builder().token(TOKEN).build()
+    application = Application.builder().token(TOKEN).post_shutdown(shutdown).build()
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
@@ -20,6 +32,8 @@ def main():
     application.add_handler(CommandHandler("view_favorites", send_favorites_menu))
     application.add_handler(CommandHandler("help", send_help))
 
+    schedule_bd_update(application)
+
     application.run_polling()
 
 
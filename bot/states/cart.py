@@ -0,0 +1,114 @@
+from parser.catalog import product_id_from_link
+
+
+class CartItem:
+    """
+    Позиция сохранённой корзины: ингредиент, номер товара ВкусВилла, количество упаковок и цена упаковки
+    на момент сохранения.
+
+    Название, ссылка и актуальная цена товара не копируются, а берутся из каталога при показе корзины
+    (см. resolve_carts); сохранённая цена нужна только чтобы показать её изменение. Если товар не был найден,
+    product_id равен 0; у корзин, сохранённых до появления цены, price равен 0. Ссылка и название хранятся,
+    только если номер товара из ссылки получить не удалось: тогда товар ищется в каталоге по названию и ссылке.
+    """
+
+    __slots__ = ("ingredient", "product_id", "packs_needed", "price", "link", "name")
+
+    def __init__(self, ingredient, product_id=0, packs_needed=0, price=0, link="", name=""):
+        self.ingredient = ingredient
+        self.product_id = product_id
+        self.packs_needed = packs_needed
+        self.price = price
+        self.link = link
+        self.name = name
+
+    def __eq__(self, other):
+        return isinstance(other, CartItem) and self.to_list() == other.to_list()
+
+    def __repr__(self):
+        link = f", {self.link!r}, {self.name!r}" if self.link else ""
+        return f"CartItem({self.ingredient!r}, {self.product_id}, {self.packs_needed}, {self.price}{link})"
+
+    def to_list(self):
+        values = [self.ingredient, self.product_id, self.packs_needed, self.price]
+        return values + [self.link, self.name] if self.link else values
+
+    @classmethod
+    def from_list(cls, values):
+        return cls(*values)
+
+
+def compact_cart(ingredients, ingredients_list_with_links):
+    """Сжимает результат подбора продуктов в список CartItem для хранения."""
+    cart = []
+    for i, ingredient in enumerate(ingredients):
+        item = ingredients_list_with_links[i] if i < len(ingredients_list_with_links) else None
+        if item:
+            product_id = product_id_from_link(item.get("link"))
+            cart_item = CartItem(ingredient, product_id, item.get("packs_needed", 0), item.get("price", 0))
+            if not product_id:
+                cart_item.link, cart_item.name = item.get("link") or "", item.get("name", "")
+            cart.append(cart_item)
+        else:
+            cart.append(CartItem(ingredient))
+    return cart
+
+
+def dump_cart(cart):
+    """Корзина в виде, пригодном для JSON."""
+    return [item.to_list() for item in cart]
+
+
+def load_cart(values):
+    return [CartItem.from_list(item) for item in values]
+
+
+def resolve_carts(carts, snapshot):
+    """
+    Подставляет в корзины актуальные данные товаров из снимка каталога.
+
+    Номера строк всех позиций всех корзин ищутся одним обращением к снимку, поэтому разбор списка
+    избранного не делает отдельный поиск на каждый товар.
+
+    :return: Для каждой корзины — названия ингредиентов и список товаров в формате get_links_from_list
+             (пустой словарь для ненайденных товаров и товаров, которых больше нет в каталоге).
+             Если цена упаковки изменилась с момента сохранения, у товара есть ключ old_price.
+    """
+    items = [item for cart in carts for item in cart]
+    rows = snapshot.rows_for_products([item.product_id for item in items])
+    # Товары, в ссылке которых нет номера, ищутся по названию и ссылке
+    by_link = [i for i, item in enumerate(items) if not item.product_id and item.link]
+    if by_link:
+        found = snapshot.rows_for_links([items[i].link for i in by_link], [items[i].name for i in by_link])
+        for i, row in zip(by_link, found):
+            rows[i] = row
+
+    rows = iter(rows)
+    valid = snapshot.table.valid
+    resolved = []
+    for cart in carts:
+        products = []
+        for item in cart:
+            row = next(rows)
+            if row is None or not valid[row]:
+                products.append({})
+                continue
+            product = snapshot.product(row)
+            product["packs_needed"] = item.packs_needed
+            product["total_price"] = product["price"] * item.packs_needed
+            if item.price and item.price != product["price"]:
+                product["old_price"] = item.price
+            products.append(product)
+        resolved.append(([item.ingredient for item in cart], products))
+    return resolved
+
+
+def resolve_cart(cart, snapshot):
+    """Вариант resolve_carts для одной корзины: возвращает названия ингредиентов и список товаров."""
+    return resolve_carts([cart], snapshot)[0]
+
+
+def cart_changed(cart, products):
+    """Изменилась ли цена какого-либо товара корзины или пропал ли товар из каталога с момента сохранения."""
+    return any(((item.product_id or item.link) and not product) or "old_price" in product
+               for item, product in zip(cart, products))
@@ -0,0 +1,246 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import config
+from bot.states.cart import dump_cart, load_cart
+
+logger = logging.getLogger(__name__)
+
+
+class ChatRecord:
+    """Состояние одного чата в памяти: текущий режим и избранные корзины (списки CartItem)."""
+
+    __slots__ = ("chat_id", "state", "favorites")
+
+    def __init__(self, chat_id, state=None, favorites=None):
+        self.chat_id = chat_id
+        self.state = state
+        self.favorites = favorites if favorites is not None else {}
+
+
+class BotStorage:
+    """
+    Хранилище состояния бота в SQLite (режим WAL).
+
+    Чтения обслуживаются из LRU-кэша записей чатов; при промахе запись читается из базы в отдельном
+    потоке (метод chat), поэтому цикл событий не ждёт диск. Изменения сразу применяются к кэшу и
+    копятся в буфере, который фоновый поток сбрасывает в базу одной транзакцией раз в flush_interval
+    секунд или при заполнении. История покупок хранится в базе и обрезается до history_limit корзин на чат.
+    """
+
+    def __init__(self, path, cache_size=1024, flush_interval=1.0, max_pending=100, history_limit=50):
+        self.path = path
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.history_limit = history_limit
+
+        self._cache = OrderedDict()
+        self._pending = []
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS chats (chat_id INTEGER PRIMARY KEY, state TEXT)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS favorites ("
+                "chat_id INTEGER NOT NULL, name TEXT NOT NULL, cart TEXT NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (chat_id, name))"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS purchase_history ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, cart TEXT NOT NULL, "
+                "created_at REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS purchase_history_chat ON purchase_history (chat_id, id)"
+            )
+
+        self._writer = threading.Thread(target=self._write_behind, name="bot-storage", daemon=True)
+        self._writer.start()
+
+    # Чтение
+
+    async def chat(self, chat_id):
+        """Запись чата из кэша; при промахе читается из базы без блокировки цикла событий."""
+        with self._lock:
+            record = self._cache.get(chat_id)
+            if record is not None:
+                self._cache.move_to_end(chat_id)
+                return record
+        return await asyncio.to_thread(self.get_chat, chat_id)
+
+    def get_chat(self, chat_id):
+        """Синхронный вариант chat для кода вне цикла событий."""
+        with self._lock:
+            record = self._cache.get(chat_id)
+            if record is not None:
+                self._cache.move_to_end(chat_id)
+                return record
+
+        while True:
+            with self._db_lock:
+                # Несохранённые изменения сначала попадают в базу, иначе прочитается устаревшая запись
+                self._flush_locked()
+                row = self._connection.execute(
+                    "SELECT state FROM chats WHERE chat_id = ?", (chat_id,)
+                ).fetchone()
+                favorites = {
+                    name: load_cart(json.loads(cart)) for name, cart in self._connection.execute(
+                        "SELECT name, cart FROM favorites WHERE chat_id = ? ORDER BY created_at", (chat_id,)
+                    )
+                }
+                record = ChatRecord(chat_id, row[0] if row else None, favorites)
+
+                # Запись попадает в кэш до освобождения _db_lock: пока он захвачен, фоновый поток не может
+                # сбросить изменения, сделанные во время чтения, и они гарантированно видны в _pending
+                with self._lock:
+                    cached = self._cache.get(chat_id)
+                    if cached is not None:
+                        return cached
+                    # Пока читали базу, для чата появились новые изменения: перечитываем
+                    if any(params[0] == chat_id for _, params in self._pending):
+                        continue
+                    self._cache[chat_id] = record
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+            return record
+
+    def get_purchase_history(self, chat_id):
+        """Сохранённые корзины чата, от старых к новым."""
+        self.flush()
+        with self._db_lock:
+            rows = self._connection.execute(
+                "SELECT cart FROM purchase_history WHERE chat_id = ? ORDER BY id", (chat_id,)
+            ).fetchall()
+        return [load_cart(json.loads(cart)) for cart, in rows]
+
+    # Запись: сразу в кэш, в базу — через буфер
+
+    def set_state(self, chat_id, state):
+        with self._lock:
+            record = self._cache.get(chat_id)
+            if record is not None:
+                record.state = state
+            self._enqueue(
+                "INSERT INTO chats (chat_id, state) VALUES (?, ?) "
+                "ON CONFLICT (chat_id) DO UPDATE SET state = excluded.state",
+                (chat_id, state)
+            )
+
+    def add_favorite(self, chat_id, name, cart):
+        with self._lock:
+            record = self._cache.get(chat_id)
+            if record is not None:
+                record.favorites[name] = cart
+            self._enqueue(
+                "INSERT OR REPLACE INTO favorites (chat_id, name, cart, created_at) VALUES (?, ?, ?, ?)",
+                (chat_id, name, json.dumps(dump_cart(cart), ensure_ascii=False), time.time())
+            )
+
+    def delete_favorite(self, chat_id, name):
+        with self._lock:
+            record = self._cache.get(chat_id)
+            if record is not None:
+                record.favorites.pop(name, None)
+            self._enqueue("DELETE FROM favorites WHERE chat_id = ? AND name = ?", (chat_id, name))
+
+    def add_purchase(self, chat_id, cart):
+        with self._lock:
+            self._enqueue(
+                "INSERT INTO purchase_history (chat_id, cart, created_at) VALUES (?, ?, ?)",
+                (chat_id, json.dumps(dump_cart(cart), ensure_ascii=False), time.time())
+            )
+            # Храним только последние history_limit корзин чата
+            self._enqueue(
+                "DELETE FROM purchase_history WHERE chat_id = ? AND id NOT IN "
+                "(SELECT id FROM purchase_history WHERE chat_id = ? ORDER BY id DESC LIMIT ?)",
+                (chat_id, chat_id, self.history_limit)
+            )
+
+    def _enqueue(self, sql, params):
+        # Вызывается под self._lock вместе с изменением кэша, чтобы чтение из базы не разошлось с кэшем
+        self._pending.append((sql, params))
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+
+    # Сброс буфера
+
+    def flush(self):
+        """Записывает накопленные изменения в базу одной транзакцией."""
+        with self._db_lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        try:
+            with self._connection:
+                for sql, params in pending:
+                    self._connection.execute(sql, params)
+        except sqlite3.Error:
+            # Транзакция откатилась: возвращаем изменения в буфер до следующей попытки
+            with self._lock:
+                self._pending[:0] = pending
+            raise
+
+    def _write_behind(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                logger.exception("Не удалось сохранить состояние бота")
+
+    def close(self):
+        """Сбрасывает буфер и закрывает базу."""
+        self._closed = True
+        self._wakeup.set()
+        self._writer.join()
+        self.flush()
+        with self._db_lock:
+            self._connection.close()
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """
+    Возвращает общее хранилище состояния по настройкам из config.
+
+    Пустой BOT_STORAGE_PATH — хранилище в памяти без сохранения между перезапусками.
+    """
+    global _storage
+    path = config.BOT_STORAGE_PATH or ":memory:"
+    if _storage is None or _storage.path != path:
+        with _storage_lock:
+            if _storage is None or _storage.path != path:
+                _storage = BotStorage(path, config.BOT_STORAGE_CACHE_SIZE, config.BOT_STORAGE_FLUSH_INTERVAL,
+                                      history_limit=config.PURCHASE_HISTORY_LIMIT)
+    return _storage
+
+
+def close_storage():
+    """Сохраняет несброшенные изменения при остановке бота."""
+    global _storage
+    with _storage_lock:
+        if _storage is not None:
+            _storage.close()
+            _storage = None
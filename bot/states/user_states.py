@@ -1,5 +1,2 @@
-USER_STATE = {}
-FAVORITES = {}
-PURCHASE_HISTORY = {}
-PREV_MESSAGE = {}
-MAX_RETRIES = 3
\ No newline at end of file
+# Состояние чатов, избранное и история покупок хранятся в bot.states.storage
+MAX_RETRIES = 3
@@ -3,10 +3,72 @@ HTTPS_PROXY_LOGIN = ""
 HTTPS_PROXY_PASSWORD = ""
 OPENAI_API_KEY = ""
 
+# адрес API OpenAI; пустая строка — официальный API. Для нагрузочных тестов можно указать локальный сервер
+# tests/benchmarks/openai_server.py, например "http://127.0.0.1:8099/v1"
+OPENAI_BASE_URL = ""
+
+# максимальное число одновременных запросов к OpenAI от одного процесса бота
+GPT_MAX_CONCURRENCY = 8
+
+# пул соединений с OpenAI: лимиты соединений, время жизни keep-alive и таймауты в секундах
+GPT_MAX_CONNECTIONS = 20
+GPT_MAX_KEEPALIVE_CONNECTIONS = 10
+GPT_KEEPALIVE_EXPIRY = 60
+GPT_TIMEOUT = 60
+GPT_CONNECT_TIMEOUT = 10
+
+# повторы запросов к OpenAI: наибольшее число попыток, начальная и наибольшая пауза между повторами при
+# временных ошибках (сеть, лимиты, сбои API) и общее время на все попытки одного запроса, секунды
+GPT_RETRY_ATTEMPTS = 5
+GPT_RETRY_BASE_DELAY = 0.5
+GPT_RETRY_MAX_DELAY = 8
+GPT_REQUEST_DEADLINE = 90
+
+# получать порции и ингредиенты одним запросом (False — два последовательных запроса, как раньше)
+GPT_COMBINED_EXTRACTION = True
+
+# определять количество порций по явным числам и длительности в сообщении без запроса к модели
+LOCAL_PORTIONS_PARSER = True
+
+# дисковый кэш ответов модели: путь к файлу SQLite (пустая строка отключает кэш),
+# время жизни записи в секундах и максимальное число записей
+GPT_CACHE_PATH = "gpt_cache.sqlite3"
+GPT_CACHE_TTL = 7 * 24 * 60 * 60
+GPT_CACHE_MAX_ENTRIES = 10000
+
 # бот
 TOKEN = ''
 
+# трассировка этапов обработки запросов: файл JSONL со спанами (пустая строка отключает запись).
+# По умолчанию выключена: файл не ротируется и растёт без ограничений, а каждый спан записывается
+# синхронно (write и flush), в том числе из цикла событий бота. Включать для замеров, например "traces.jsonl"
+TRACE_PATH = ""
+
+# минимальный интервал между редактированиями сообщения при потоковой выдаче инструкции, секунды
+TELEGRAM_EDIT_INTERVAL = 1.5
+
+# хранилище состояния бота (SQLite): путь к файлу (пустая строка — только в памяти), размер кэша чатов,
+# интервал сброса изменений в базу в секундах и сколько последних корзин хранить в истории покупок
+BOT_STORAGE_PATH = "bot_state.sqlite3"
+BOT_STORAGE_CACHE_SIZE = 1024
+BOT_STORAGE_FLUSH_INTERVAL = 1.0
+PURCHASE_HISTORY_LIMIT = 50
+
 BD_path = ""
 
+# парсер: одновременных запросов к сайту, минимальный интервал между запросами (секунды), число повторов
+PARSER_MAX_CONCURRENCY = 4
+PARSER_REQUEST_INTERVAL = 0.2
+PARSER_MAX_RETRIES = 3
+
+# инкрементальное обновление: условные запросы, пропуск неизменившихся страниц и список изменений рядом с базой
+PARSER_INCREMENTAL = True
+
+# нечёткий поиск ингредиентов: минимальное сходство слов по триграммам (0 отключает нечёткий поиск)
+MATCH_FUZZY_THRESHOLD = 0.7
+
+# кэш кандидатов для ингредиентов: сколько разных названий ингредиентов хранить
+MATCH_CACHE_SIZE = 4096
+
 # время обновление бд [часы, минусы]
 UPDATE_BD_TIME = (20, 00)
\ No newline at end of file
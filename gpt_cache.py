@@ -0,0 +1,111 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+import config
+
+# Упоминания количества порций и длительности: "на 4 порции", "на две недели", "на неделю", "6 порций"
+_PORTIONS_PATTERN = re.compile(
+    r"\bна\s+(?:(?:\d+|[а-я]+)\s+){0,2}?(?:порци|персон|человек|гост|дн|день|дня|недел|месяц|сут)[а-я]*"
+    r"|\b\d+\s+(?:порци|персон|человек|гост)[а-я]*"
+)
+_NON_WORD_PATTERN = re.compile(r"[^0-9a-zа-я]+")
+
+
+def normalize_dish_text(text: str) -> str:
+    """
+    Приводит запрос пользователя к ключу кэша: нижний регистр, без количества порций, длительности и знаков.
+
+    "Борщ на 4 порции" и "борщ на две недели" дают одинаковый ключ "борщ": ингредиенты кэшируются
+    на одну порцию, а умножение на количество порций происходит уже после кэша.
+    """
+    text = text.lower().replace("ё", "е")
+    text = _PORTIONS_PATTERN.sub(" ", text)
+    return " ".join(_NON_WORD_PATTERN.sub(" ", text).split())
+
+
+def make_key(kind: str, text: str, model: str, temperature: float, prompt_version: int) -> str:
+    """Ключ кэша: хэш от типа запроса, нормализованного текста, модели, температуры и версии промпта."""
+    raw = json.dumps([kind, normalize_dish_text(text), model, temperature, prompt_version], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class GPTCache:
+    """
+    Дисковый кэш ответов модели в SQLite.
+
+    Записи живут ttl секунд; при превышении max_entries удаляются те, к которым дольше всего не обращались.
+    """
+
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)")
+
+    def get(self, key: str):
+        """Возвращает сохранённое значение или None, если записи нет или она устарела."""
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if now - created_at > self.ttl:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._connection.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def set(self, key: str, value) -> None:
+        """Сохраняет значение и вытесняет самые давно использованные записи сверх лимита."""
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            count = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                self._connection.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY used_at LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+_gpt_cache = None
+_gpt_cache_lock = threading.Lock()
+
+
+def get_gpt_cache():
+    """
+    Возвращает общий кэш ответов по настройкам из config или None, если кэш отключён (GPT_CACHE_PATH пустой).
+    """
+    global _gpt_cache
+    if not config.GPT_CACHE_PATH:
+        return None
+    if _gpt_cache is None or _gpt_cache.path != config.GPT_CACHE_PATH:
+        with _gpt_cache_lock:
+            if _gpt_cache is None or _gpt_cache.path != config.GPT_CACHE_PATH:
+                _gpt_cache = GPTCache(config.GPT_CACHE_PATH, config.GPT_CACHE_TTL, config.GPT_CACHE_MAX_ENTRIES)
+    return _gpt_cache
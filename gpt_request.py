@@ -1,47 +1,212 @@
+import asyncio
+import contextvars
+import importlib.util
 import json
-from openai import OpenAI
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from openai import NOT_GIVEN, OpenAI
 import httpx
 import config
 import logging
+from gpt_cache import get_gpt_cache, make_key
+from gpt_retry import FormatError, call_with_retries, repair_integer, repair_json
+from portions import parse_portions as parse_portions_locally, portion_stats
+from tracing import set_attributes, span, traced
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Модель по умолчанию для всех запросов
+DEFAULT_MODEL = "gpt-4o"
+
+# Версия промптов: увеличивается при их изменении, чтобы не отдавать из кэша ответы на старые промпты
+PROMPT_VERSION = 1
+
+# Пул потоков для запросов к OpenAI из асинхронных обработчиков бота.
+# Размер пула ограничивает число одновременных запросов от одного процесса.
+_gpt_executor = ThreadPoolExecutor(max_workers=config.GPT_MAX_CONCURRENCY, thread_name_prefix="gpt")
+
+# Долгоживущие клиенты OpenAI, по одному на настройку прокси и адрес API
+_gpt_clients = {}
+_gpt_clients_lock = threading.Lock()
+
+# HTTP/2 в httpx доступен только с установленным пакетом h2
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def _proxy_url(proxy_auth: bool = True):
+    """
+    Собирает адрес прокси из настроек. Если прокси не задан, запросы идут напрямую.
+    """
+    if not config.HTTPS_PROXY_IPPORT:
+        return None
+    if proxy_auth:
+        return f"http://{config.HTTPS_PROXY_LOGIN}:{config.HTTPS_PROXY_PASSWORD}@{config.HTTPS_PROXY_IPPORT}"
+    return f"http://{config.HTTPS_PROXY_IPPORT}"
+
+
+def get_gpt_client(proxy_auth: bool = True) -> OpenAI:
+    """
+    Возвращает общий для процесса клиент OpenAI для заданной настройки прокси и адреса API (config.OPENAI_BASE_URL).
+
+    Клиент создаётся один раз и держит открытыми соединения (keep-alive, HTTP/2, если установлен h2),
+    поэтому повторные запросы не тратят время на CONNECT через прокси и TLS-рукопожатие.
+    """
+    proxy_url = _proxy_url(proxy_auth)
+    base_url = config.OPENAI_BASE_URL or None
+    key = (proxy_url, base_url)
+    gpt_client = _gpt_clients.get(key)
+    if gpt_client is None:
+        with _gpt_clients_lock:
+            gpt_client = _gpt_clients.get(key)
+            if gpt_client is None:
+                httpx_client = httpx.Client(
+                    proxy=proxy_url,
+                    http2=_HTTP2_AVAILABLE,
+                    limits=httpx.Limits(
+                        max_connections=config.GPT_MAX_CONNECTIONS,
+                        max_keepalive_connections=config.GPT_MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=config.GPT_KEEPALIVE_EXPIRY
+                    ),
+                    timeout=httpx.Timeout(config.GPT_TIMEOUT, connect=config.GPT_CONNECT_TIMEOUT)
+                )
+                # Повторы с паузами делает gpt_retry, встроенные повторы клиента отключены
+                gpt_client = OpenAI(
+                    api_key=config.OPENAI_API_KEY,
+                    base_url=base_url,
+                    http_client=httpx_client,
+                    max_retries=0
+                )
+                _gpt_clients[key] = gpt_client
+    return gpt_client
+
+
+def close_gpt_clients() -> None:
+    """
+    Закрывает все открытые клиенты OpenAI. Вызывается при остановке бота.
+    """
+    with _gpt_clients_lock:
+        gpt_clients = list(_gpt_clients.values())
+        _gpt_clients.clear()
+    for gpt_client in gpt_clients:
+        gpt_client.close()
+
 
 def ask_gpt_with_proxy(messages: list,
                        max_tokens: int = None, temperature: float = 0.2,
-                       model: str = "gpt-4o",
-                       proxy_auth: bool = True) -> str:
+                       model: str = DEFAULT_MODEL,
+                       proxy_auth: bool = True,
+                       response_format: dict = None,
+                       timeout: float = None) -> str:
     """
     Метод позволяет обратиться к OpenAI GPT через прокси.
     ...
     (оставляем без изменений)
     """
-    proxy_url = f"http://{config.HTTPS_PROXY_IPPORT}"
-    if proxy_auth:
-        proxy_url = f"http://{config.HTTPS_PROXY_LOGIN}:{config.HTTPS_PROXY_PASSWORD}@{config.HTTPS_PROXY_IPPORT}"
-
-    with httpx.Client(proxy=proxy_url) as httpx_client:
-        gpt_client = OpenAI(
-            api_key=config.OPENAI_API_KEY,
-            http_client=httpx_client
-        )
+    gpt_client = get_gpt_client(proxy_auth)
 
+    with span("gpt.request", model=model) as current:
         response = gpt_client.chat.completions.create(
             model=model,
             messages=messages,
             stream=False,
             max_tokens=max_tokens,
+            temperature=temperature,
+            response_format=response_format or NOT_GIVEN,
+            timeout=timeout or NOT_GIVEN
+        )
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        if isinstance(prompt_tokens, int) and isinstance(completion_tokens, int):
+            current.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    return response.choices[0].message.content.strip()
+
+
+def stream_gpt_with_proxy(messages: list,
+                          max_tokens: int = None, temperature: float = 0.2,
+                          model: str = DEFAULT_MODEL,
+                          proxy_auth: bool = True):
+    """
+    Потоковый вариант ask_gpt_with_proxy: по мере генерации отдаёт фрагменты ответа модели.
+    """
+    gpt_client = get_gpt_client(proxy_auth)
+
+    with span("gpt.stream", model=model) as current:
+        stream = gpt_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            max_tokens=max_tokens,
             temperature=temperature
         )
 
-        return response.choices[0].message.content.strip()
+        chunks = 0
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    chunks += 1
+                    yield chunk.choices[0].delta.content
+        finally:
+            current.set(chunks=chunks)
+            stream.close()
+
 
+def get_cached_response(kind: str, text: str, temperature: float):
+    """
+    Возвращает ответ из кэша для запроса вида kind по тексту text или None, если его там нет.
+    """
+    gpt_cache = get_gpt_cache()
+    if gpt_cache is None:
+        return None
+    value = gpt_cache.get(make_key(kind, text, DEFAULT_MODEL, temperature, PROMPT_VERSION))
+    if value is not None:
+        logger.info(f"Ответ для запроса '{text}' ({kind}) взят из кэша")
+    return value
 
+
+def store_cached_response(kind: str, text: str, temperature: float, value) -> None:
+    """
+    Сохраняет ответ в кэш, если кэш включён.
+    """
+    gpt_cache = get_gpt_cache()
+    if gpt_cache is not None:
+        gpt_cache.set(make_key(kind, text, DEFAULT_MODEL, temperature, PROMPT_VERSION), value)
+
+
+@traced("gpt.portions")
 def get_number_of_portions(user_message: str) -> int:
     """
     Определяет количество порций из сообщения пользователя.
+
+    Явные количества («на 4 порции», «на двоих», «на две недели») и сообщения без количества (одна порция)
+    разбираются локально без запроса к модели (config.LOCAL_PORTIONS_PARSER); модель спрашивается,
+    только если количество неоднозначно.
+    """
+    portions = get_local_portions(user_message)
+    if portions is not None:
+        return portions
+    return ask_number_of_portions(user_message)
+
+
+def get_local_portions(user_message: str):
+    """
+    Количество порций по сообщению без запроса к модели или None, если его должна определить модель.
+    """
+    if not config.LOCAL_PORTIONS_PARSER:
+        return None
+    portions = parse_portions_locally(user_message)
+    portion_stats.count(local=portions is not None)
+    set_attributes(local=portions is not None)
+    return portions
+
+
+def ask_number_of_portions(user_message: str) -> int:
+    """
+    Определяет количество порций запросом к модели.
     """
     system_prompt = (
         "Ты профессиональный кулинарный помощник. Пользователь может указать блюдо и длительность приготовления (например, "
@@ -55,22 +220,35 @@ def get_number_of_portions(user_message: str) -> int:
         {"role": "user", "content": user_message}
     ]
 
-    for attempt in range(5):
-        try:
-            response = ask_gpt_with_proxy(messages, temperature=0.0)
-            portions = int(response.strip())
-            if portions > 0:
-                return portions
-            else:
-                raise ValueError("Количество порций должно быть положительным.")
-        except (ValueError, TypeError):
-            messages.append({
-                "role": "user",
-                "content": "Пожалуйста, укажи количество порций как целое число."
-            })
-    raise ValueError("Не удалось определить количество порций после нескольких попыток.")
+    return call_with_retries(
+        ask_gpt_with_proxy, messages, parse_portions,
+        correction="Пожалуйста, укажи количество порций как целое число.",
+        failure_message="Не удалось определить количество порций после нескольких попыток.",
+        repair=repair_integer, temperature=0.0
+    )
 
 
+def parse_portions(response: str) -> int:
+    """
+    Разбирает ответ модели с количеством порций.
+    """
+    portions = int(response.strip())
+    if portions <= 0:
+        raise FormatError("Количество порций должно быть положительным.")
+    return portions
+
+
+def is_valid_ingredients(ingredients) -> bool:
+    """
+    Проверяет, что ингредиенты — словарь вида {"ингредиент": [количество, единица_измерения]}.
+    """
+    return isinstance(ingredients, dict) and all(
+        isinstance(v, list) and len(v) == 2 and isinstance(v[0], (int, float)) for v in
+        ingredients.values()
+    )
+
+
+@traced("gpt.ingredients")
 def get_ingredients_per_portion(user_message: str) -> dict:
     """
     Обрабатывает сообщение пользователя с помощью OpenAI API и возвращает кортеж:
@@ -105,69 +283,161 @@ def get_ingredients_per_portion(user_message: str) -> dict:
         "Помни, что ответ должен быть строго в формате JSON, без лишних пояснений. Подсчитай количества ингредиентов."
     )
 
+    cached = get_cached_response("ingredients", user_message, 0.2)
+    if cached is not None:
+        return cached
+
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_message}
     ]
 
-    for attempt in range(5):
-        try:
-            assistant_message = ask_gpt_with_proxy(messages, temperature=0.2)
-            data = json.loads(assistant_message)
-
-            # Проверка структуры JSON
-            if isinstance(data, dict) and len(data) == 1:
-                dish, ingredients = next(iter(data.items()))
-                if isinstance(ingredients, dict) and all(
-                        isinstance(v, list) and len(v) == 2 and isinstance(v[0], (int, float)) for v in
-                        ingredients.values()
-                ):
-                    return {"dish": dish, "ingredients": ingredients}
-            raise ValueError("JSON имеет некорректную структуру.")
-        except (json.JSONDecodeError, ValueError, TypeError) as e:
-            logger.warning(f"Попытка {attempt + 1}: Некорректный ответ. Ошибка: {e}")
-            messages.append({
-                "role": "user",
-                "content": (
-                    "Ваш предыдущий ответ не соответствует требуемому формату. Пожалуйста, предоставьте ответ строго "
-                    "в формате JSON, где первый ключ — название блюда, а значения — словарь ингредиентов с их количествами и единицами измерения. Ответ без пояснений."
-                )
-            })
-    raise ValueError("Не удалось получить корректный JSON после нескольких попыток.")
+    result = call_with_retries(
+        ask_gpt_with_proxy, messages, parse_ingredients_per_portion,
+        correction=(
+            "Твой ответ не соответствует требуемому формату. Ответь строго JSON-объектом вида "
+            "{\"название_блюда\": {\"ингредиент\": [количество, \"единица_измерения\"]}} без пояснений."
+        ),
+        failure_message="Не удалось получить корректный JSON после нескольких попыток.",
+        repair=repair_json, temperature=0.2
+    )
+    store_cached_response("ingredients", user_message, 0.2, result)
+    return result
 
 
-def get_ingredients_list(user_message: str) -> dict:
+def parse_ingredients_per_portion(response: str) -> dict:
     """
-    Обрабатывает сообщение пользователя и возвращает JSON со списком ингредиентов и их количеством в граммах.
+    Разбирает ответ вида {"блюдо": {"ингредиент": [количество, единица]}}.
     """
-    try:
-        # Этап 1: Определение количества порций
-        portions = get_number_of_portions(user_message)
-        print(f"Количество порций: {portions}")
+    data = json.loads(response)
+    if isinstance(data, dict) and len(data) == 1:
+        dish, ingredients = next(iter(data.items()))
+        if is_valid_ingredients(ingredients):
+            return {"dish": dish, "ingredients": ingredients}
+    raise FormatError("JSON имеет некорректную структуру.")
+
+
+@traced("gpt.dish_with_portions")
+def get_dish_with_portions(user_message: str) -> dict:
+    """
+    Одним запросом к OpenAI определяет название блюда, количество порций и ингредиенты на одну порцию.
+
+    :return: Словарь {"dish": название блюда, "portions": количество порций, "ingredients": ингредиенты на порцию}.
+    """
+    system_prompt = (
+        "Ты профессиональный кулинарный помощник. По сообщению пользователя определи название блюда, количество порций "
+        "и список ингредиентов с точным количеством для ОДНОЙ порции.\n\n"
+        "Особые инструкции:\n"
+        "1. Пользователь может указать длительность (например, \"борщ на две недели\") — переведи её в количество порций. "
+        "Если ни длительность, ни количество порций не указаны, считай, что нужна одна порция.\n"
+        "2. Количество ингредиентов указывай для одной порции, независимо от количества порций в сообщении.\n"
+        "3. Ответ должен быть строго JSON-объектом без пояснений.\n\n"
+        "Структура JSON-ответа, СТРОГО СЛЕДУЙ ЕЙ И ТОЛЬКО ЕЙ:\n"
+        "{\n"
+        "    \"dish\": \"название_блюда\",\n"
+        "    \"portions\": целое_число_порций,\n"
+        "    \"ingredients\": {\n"
+        "        \"ингредиент1\": [количество, единица_измерения],\n"
+        "        ...\n"
+        "    }\n"
+        "}\n\n"
+        "Пример правильного ответа на сообщение \"Борщ на 4 порции\":\n"
+        "{\n"
+        "    \"dish\": \"борщ\",\n"
+        "    \"portions\": 4,\n"
+        "    \"ingredients\": {\n"
+        "        \"картофель\": [200, \"г\"],\n"
+        "        \"лук репчатый\": [100, \"г\"],\n"
+        "        \"свекла\": [150, \"г\"]\n"
+        "    }\n"
+        "}"
+    )
 
-        # Этап 2: Получение ингредиентов и названия блюда
-        result = get_ingredients_per_portion(user_message)
-        print(f"Название блюда: {result['dish']}")
-        print(f"Ингредиенты на одну порцию: {result['ingredients']}")
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_message}
+    ]
 
-        # Этап 3: Умножение на количество порций
-        total_ingredients = {ingredient: [amount[0] * portions, amount[1]] for ingredient, amount in
-                             result['ingredients'].items()}
+    result = call_with_retries(
+        ask_gpt_with_proxy, messages, parse_dish_with_portions,
+        correction=(
+            "Твой ответ не соответствует требуемому формату. Ответь строго JSON-объектом с ключами dish (строка), "
+            "portions (целое положительное число) и ingredients "
+            "({\"ингредиент\": [количество, \"единица_измерения\"]}) без пояснений."
+        ),
+        failure_message="Не удалось получить корректный JSON после нескольких попыток.",
+        repair=repair_json, temperature=0.2, response_format={"type": "json_object"}
+    )
+    # В кэш попадают только ингредиенты на порцию: они не зависят от количества порций
+    store_cached_response("ingredients", user_message, 0.2,
+                          {"dish": result["dish"], "ingredients": result["ingredients"]})
+    return result
 
-        return {"dish": result['dish'], "ingredients": total_ingredients}
 
-    except ValueError as e:
-        print(f"Ошибка: {e}")
-        return {"error": str(e)}
+def parse_dish_with_portions(response: str) -> dict:
+    """
+    Разбирает ответ вида {"dish": блюдо, "portions": порции, "ingredients": ингредиенты на порцию}.
+    """
+    data = json.loads(response)
+    if isinstance(data, dict) and isinstance(data.get("dish"), str):
+        portions = data.get("portions")
+        ingredients = data.get("ingredients")
+        if isinstance(portions, int) and portions > 0 and is_valid_ingredients(ingredients):
+            return {"dish": data["dish"], "portions": portions, "ingredients": ingredients}
+    raise FormatError("JSON имеет некорректную структуру.")
 
 
-def get_preparation_instructions(dish: str, ingredients: dict) -> str:
+def get_ingredients_list(user_message: str, combined: bool = None) -> dict:
     """
-    Генерирует инструкцию по приготовлению блюда на основе названия блюда.
+    Обрабатывает сообщение пользователя и возвращает JSON со списком ингредиентов и их количеством в граммах.
 
-    :param dish: Название блюда.
-    :param ingredients: Словарь с ингредиентами и их количеством.
-    :return: Инструкция по приготовлению.
+    :param combined: Получать порции и ингредиенты одним запросом (по умолчанию config.GPT_COMBINED_EXTRACTION).
+        При False используется прежний способ из двух последовательных запросов.
+    """
+    if combined is None:
+        combined = config.GPT_COMBINED_EXTRACTION
+
+    with span("gpt.extract", combined=combined) as current:
+        try:
+            if combined:
+                result = get_cached_response("ingredients", user_message, 0.2)
+                current.set(cached=result is not None)
+                portions = get_local_portions(user_message)
+                if result is None and portions is None:
+                    # Порции, название блюда и ингредиенты одним запросом
+                    result = get_dish_with_portions(user_message)
+                    portions = result['portions']
+                elif result is None:
+                    # Количество порций известно без модели, у неё спрашиваются только ингредиенты
+                    result = get_ingredients_per_portion(user_message)
+                elif portions is None:
+                    # Ингредиенты на порцию уже известны, осталось определить количество порций
+                    portions = ask_number_of_portions(user_message)
+            else:
+                # Этап 1: Определение количества порций
+                portions = get_number_of_portions(user_message)
+
+                # Этап 2: Получение ингредиентов и названия блюда
+                result = get_ingredients_per_portion(user_message)
+            current.set(portions=portions, ingredients=len(result['ingredients']))
+            logger.info(f"Блюдо: {result['dish']}, порций: {portions}, "
+                        f"ингредиенты на одну порцию: {result['ingredients']}")
+
+            # Этап 3: Умножение на количество порций
+            total_ingredients = {ingredient: [amount[0] * portions, amount[1]] for ingredient, amount in
+                                 result['ingredients'].items()}
+
+            return {"dish": result['dish'], "ingredients": total_ingredients}
+
+        except ValueError as e:
+            current.set(error=str(e))
+            logger.warning(f"Не удалось получить список ингредиентов: {e}")
+            return {"error": str(e)}
+
+
+def get_instructions_messages(dish: str) -> list:
+    """
+    Собирает сообщения для запроса инструкции по приготовлению блюда.
     """
     system_prompt = (
         "Ты профессиональный кулинарный помощник. Твоя задача — предоставить подробную и понятную инструкцию "
@@ -178,25 +448,134 @@ def get_preparation_instructions(dish: str, ingredients: dict) -> str:
 
     user_prompt = system_prompt + "\n\n" + "Предоставь пошаговую инструкцию по приготовлению этого блюда."
 
-    messages = [
+    return [
         {"role": "system", "content": "Ты профессиональный кулинарный помощник."},
         {"role": "user", "content": user_prompt}
     ]
 
-    for attempt in range(5):
+
+@traced("gpt.instructions")
+def get_preparation_instructions(dish: str, ingredients: dict) -> str:
+    """
+    Генерирует инструкцию по приготовлению блюда на основе названия блюда.
+
+    :param dish: Название блюда.
+    :param ingredients: Словарь с ингредиентами и их количеством.
+    :return: Инструкция по приготовлению.
+    """
+    cached = get_cached_response("instructions", dish, 0.3)
+    if cached is not None:
+        return cached
+
+    messages = get_instructions_messages(dish)
+
+    response = call_with_retries(
+        ask_gpt_with_proxy, messages, parse_instructions,
+        correction=(
+            "Пожалуйста, предоставь пошаговую инструкцию по приготовлению блюда без дополнительных комментариев."
+        ),
+        failure_message="Не удалось получить инструкцию по приготовлению после нескольких попыток.",
+        temperature=0.3, max_tokens=1000
+    )
+    store_cached_response("instructions", dish, 0.3, response)
+    return response
+
+
+def parse_instructions(response: str) -> str:
+    """
+    Проверяет, что модель вернула непустую инструкцию.
+    """
+    if not response:
+        raise FormatError("Пустой ответ от модели.")
+    return response
+
+
+async def run_gpt_async(func, *args, **kwargs):
+    """
+    Выполняет синхронную функцию, обращающуюся к OpenAI, в пуле потоков, не блокируя цикл событий бота.
+
+    Функция выполняется в копии текущего контекста, поэтому её спаны относятся к тому же чату и запросу.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_gpt_executor, partial(context.run, func, *args, **kwargs))
+
+
+async def get_ingredients_list_async(user_message: str) -> dict:
+    """
+    Асинхронная версия get_ingredients_list для обработчиков бота.
+    """
+    return await run_gpt_async(get_ingredients_list, user_message)
+
+
+async def get_preparation_instructions_async(dish: str, ingredients: dict) -> str:
+    """
+    Асинхронная версия get_preparation_instructions для обработчиков бота.
+    """
+    return await run_gpt_async(get_preparation_instructions, dish, ingredients)
+
+
+async def stream_preparation_instructions(dish: str, ingredients: dict):
+    """
+    Асинхронно отдаёт инструкцию по приготовлению по мере генерации.
+
+    Каждый элемент — весь текст инструкции, полученный к этому моменту; последний элемент — полная инструкция.
+    Если поток оборвался до первого фрагмента, инструкция запрашивается обычным способом с повторными попытками.
+
+    :raises ValueError: Если инструкцию получить не удалось.
+    """
+    cached = get_cached_response("instructions", dish, 0.3)
+    if cached is not None:
+        yield cached
+        return
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    # Выставляется, когда генератор закрыт или отменён: поток перестаёт читать ответ модели и закрывает его
+    stop = threading.Event()
+
+    def produce():
+        if stop.is_set():
+            return
+        deltas = None
         try:
-            response = ask_gpt_with_proxy(messages, temperature=0.3, max_tokens=1000)
-            if response:
-                return response
-            else:
-                raise ValueError("Пустой ответ от модели.")
+            deltas = stream_gpt_with_proxy(get_instructions_messages(dish), temperature=0.3, max_tokens=1000)
+            for delta in deltas:
+                if stop.is_set():
+                    return
+                loop.call_soon_threadsafe(queue.put_nowait, delta)
+            loop.call_soon_threadsafe(queue.put_nowait, None)
         except Exception as e:
-            logger.warning(f"Попытка {attempt + 1}: Не удалось получить инструкцию по приготовлению. Ошибка: {e}")
-            messages.append({
-                "role": "user",
-                "content": "Пожалуйста, предоставь пошаговую инструкцию по приготовлению блюда без дополнительных комментариев."
-            })
-    raise ValueError("Не удалось получить инструкцию по приготовлению после нескольких попыток.")
+            if not stop.is_set():
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            # Закрытие генератора закрывает ответ модели, соединение не дочитывается до конца
+            if deltas is not None:
+                deltas.close()
+
+    loop.run_in_executor(_gpt_executor, contextvars.copy_context().run, produce)
+
+    text = ""
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                if text:
+                    raise ValueError(f"Генерация инструкции прервалась: {item}")
+                logger.warning(f"Не удалось получить инструкцию потоком, запрашиваем целиком. Ошибка: {item}")
+                break
+            text += item
+            yield text
+    finally:
+        stop.set()
+
+    if not text.strip():
+        yield await get_preparation_instructions_async(dish, ingredients)
+        return
+
+    store_cached_response("instructions", dish, 0.3, text.strip())
 
 
 # Пример использования новой функции
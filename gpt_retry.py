@@ -0,0 +1,158 @@
+import json
+import logging
+import random
+import re
+import time
+
+import httpx
+import openai
+
+import config
+from tracing import set_attributes
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых запрос имеет смысл повторить с паузой: сеть, таймауты, лимиты и сбои на стороне API
+TRANSIENT_ERRORS = (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError,
+                    openai.InternalServerError, httpx.TransportError)
+
+# Ошибки формата ответа модели: ответ исправляется локально или коротким запросом на исправление
+FORMAT_ERRORS = (ValueError, TypeError)
+
+_CODE_FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_INTEGER = re.compile(r"-?\d+")
+
+
+class FormatError(ValueError):
+    """Ответ модели не соответствует ожидаемому формату."""
+
+
+def is_transient(error):
+    """Временная ли ошибка обращения к API (такой запрос повторяется после паузы)."""
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+def backoff_delay(attempt, error=None, base_delay=None, max_delay=None):
+    """
+    Пауза перед повтором номер attempt (с нуля): экспоненциальный рост со случайным разбросом (full jitter).
+
+    Если API прислал заголовок Retry-After, пауза не короче указанной в нём.
+    """
+    base_delay = config.GPT_RETRY_BASE_DELAY if base_delay is None else base_delay
+    max_delay = config.GPT_RETRY_MAX_DELAY if max_delay is None else max_delay
+    delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            delay = max(delay, min(float(retry_after), max_delay))
+        except ValueError:
+            pass
+    return delay
+
+
+def repair_json(text):
+    """
+    Локальное исправление JSON в ответе модели без повторного запроса.
+
+    Убирает обрамление ```json, пояснения до и после объекта, запятые перед закрывающей скобкой
+    и типографские кавычки. Возвращает исправленный текст или None, если получить корректный JSON не удалось.
+    """
+    if not text:
+        return None
+    candidate = _CODE_FENCE.sub("", text)
+    start, end = candidate.find("{"), candidate.rfind("}")
+    if start == -1 or end < start:
+        return None
+    candidate = candidate[start:end + 1]
+    candidate = _TRAILING_COMMA.sub(r"\1", candidate).replace("“", '"').replace("”", '"')
+    for variant in (candidate, candidate.replace("'", '"')):
+        try:
+            json.loads(variant)
+            return variant
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def repair_integer(text):
+    """Первое целое число в ответе модели («4 порции» → «4») или None."""
+    match = _INTEGER.search(text or "")
+    return match.group() if match else None
+
+
+def repair_messages(messages, output, correction):
+    """
+    Сообщения для исправления ответа: исходный запрос пользователя, неверный ответ и короткое указание.
+
+    Длинный системный промпт и предыдущие попытки не пересылаются.
+    """
+    user_message = next((message for message in reversed(messages) if message["role"] == "user"), messages[-1])
+    return [user_message, {"role": "assistant", "content": output}, {"role": "user", "content": correction}]
+
+
+def call_with_retries(ask, messages, parse, correction, failure_message, repair=None, attempts=None, deadline=None,
+                      **request_kwargs):
+    """
+    Запрашивает ответ модели и разбирает его, повторяя запрос при временных ошибках и ошибках формата.
+
+    :param ask: Функция запроса к модели (ask_gpt_with_proxy).
+    :param parse: Разбор ответа; при неверном формате бросает ValueError или TypeError.
+    :param correction: Короткое указание модели, как исправить ответ неверного формата.
+    :param failure_message: Текст ValueError, если корректный ответ получить не удалось.
+    :param repair: Локальное исправление ответа (repair_json, repair_integer), пробуется до повторного запроса.
+    :param attempts: Наибольшее число запросов к модели (по умолчанию config.GPT_RETRY_ATTEMPTS).
+    :param deadline: Общее время на все попытки в секундах (по умолчанию config.GPT_REQUEST_DEADLINE).
+    :raises ValueError: Если попытки или время закончились (причина — последняя ошибка) или API вернул ошибку,
+        которая не исправится повтором (неверный запрос, ключ и т.п.): такой запрос не повторяется.
+    """
+    attempts = config.GPT_RETRY_ATTEMPTS if attempts is None else attempts
+    deadline = config.GPT_REQUEST_DEADLINE if deadline is None else deadline
+    expires = time.monotonic() + deadline
+
+    conversation = messages
+    transient_errors = local_repairs = 0
+    last_error = None
+    for attempt in range(attempts):
+        set_attributes(attempts=attempt + 1)
+        remaining = expires - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            output = ask(conversation, timeout=remaining, **request_kwargs)
+        except TRANSIENT_ERRORS as e:
+            last_error = e
+            transient_errors += 1
+            set_attributes(transient_errors=transient_errors)
+            delay = backoff_delay(attempt, e)
+            logger.warning(f"Попытка {attempt + 1}: ошибка обращения к модели, повтор через {delay:.1f} с. Ошибка: {e}")
+            if attempt + 1 == attempts or time.monotonic() + delay >= expires:
+                break
+            time.sleep(delay)
+            continue
+        except openai.APIError as e:
+            logger.error(f"Попытка {attempt + 1}: ошибка API, запрос не повторяется. Ошибка: {e}")
+            raise ValueError(failure_message) from e
+
+        try:
+            return parse(output)
+        except FORMAT_ERRORS as e:
+            last_error = e
+            logger.warning(f"Попытка {attempt + 1}: Некорректный ответ. Ошибка: {e}")
+
+        repaired = repair(output) if repair is not None else None
+        if repaired is not None and repaired != output:
+            try:
+                value = parse(repaired)
+                local_repairs += 1
+                set_attributes(local_repairs=local_repairs)
+                return value
+            except FORMAT_ERRORS:
+                pass
+
+        # Пустой ответ исправлять нечего: повторяем исходный запрос
+        conversation = repair_messages(messages, output, correction) if output and output.strip() else messages
+
+    raise ValueError(failure_message) from last_error
@@ -0,0 +1,454 @@
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+from array import array
+
+from config import MATCH_FUZZY_THRESHOLD
+from parser.catalog_binary import BinaryProductTable, binary_path
+from parser.normalize import normalize_tokens, trigrams
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+# Словарь для конверсии в граммы
+UNIT_CONVERSION = {
+    "г": 1,
+    "кг": 1000,
+    "мл": 1,  # Примерно, для воды 1 мл = 1 г
+    "л": 1000,
+    "шт": 1  # Если штуки нужно пересчитывать, добавьте дополнительную логику
+}
+
+# Количество, которое подставляется товарам без указанного веса
+DEFAULT_QUANTITY = "1 кг"
+
+# Номер товара на сайте в конце ссылки: .../goods/kartofel-molodoy-101.html
+_PRODUCT_ID_PATTERN = re.compile(r"-(\d+)\.html$")
+
+# Поколения индексов: у каждого построенного индекса свой номер, общий для всех каталогов процесса
+_INDEX_GENERATIONS = itertools.count(1)
+
+# Предлоги, после которых в названии идёт состав или добавка, а не сам товар: «Пельмени из говядины»,
+# «Арахис в сахаре», «Майонез на перепелином яйце»
+DEPENDENT_PREPOSITIONS = {"из", "в", "во", "на", "с", "со", "без"}
+
+
+def convert_to_grams(quantity, unit):
+    # Проверка наличия единицы измерения
+    if unit not in UNIT_CONVERSION:
+        return -1  # Неизвестная единица измерения
+    return quantity * UNIT_CONVERSION[unit]
+
+
+def product_id_from_link(link):
+    """Номер товара ВкусВилла из ссылки или 0, если ссылка его не содержит."""
+    match = _PRODUCT_ID_PATTERN.search(link or "")
+    return int(match.group(1)) if match else 0
+
+
+def parse_quantity(quantity):
+    """
+    Разбирает количество товара вида "500 г" в пару (500, "г").
+
+    :return: Кортеж (количество, единица измерения) или None, если строку разобрать не удалось.
+    """
+    parts = (quantity or DEFAULT_QUANTITY).split()
+    try:
+        return int(parts[0]), parts[1]
+    except (IndexError, ValueError):
+        return None
+
+
+class ProductTable:
+    """
+    Колонки каталога, подготовленные при загрузке базы.
+
+    Количество и единица измерения разбираются, вес переводится в граммы, а цена за грамм считается
+    один раз для каждого товара, поэтому подбор продуктов сравнивает только готовые числа.
+    Товары, которые нельзя сопоставить по весу, помечаются в колонке valid.
+    """
+
+    def __init__(self, database):
+        self.categories = list(database)
+        self.category_ids = array("H")
+        self.names = []
+        self.links = []
+        self.quantities = []
+        self.units = []
+        self.pack_quantities = array("q")
+        self.prices = array("q")
+        self.product_ids = array("q")
+        self.grams = array("d")
+        self.cost_per_gram = array("d")
+        self.valid = bytearray()
+        self.tokens = []
+
+        for category_id, products in enumerate(database.values()):
+            for product in products:
+                self._append(category_id, product)
+
+        self.invalid_count = self.valid.count(0)
+        if self.invalid_count:
+            logger.info(f"Не удалось разобрать количество или цену у {self.invalid_count} товаров из {len(self)}")
+        without_id = self.product_ids.count(0)
+        if without_id:
+            # Такие товары в сохранённых корзинах ищутся по названию и ссылке (см. CatalogSnapshot.rows_for_links)
+            logger.info(f"Нет номера товара в ссылке у {without_id} товаров из {len(self)}")
+
+    def _append(self, category_id, product):
+        name = product.get("name", "")
+        quantity = product.get("quantity") or DEFAULT_QUANTITY
+        price = product.get("price")
+        parsed = parse_quantity(quantity)
+
+        pack_quantity, unit, grams = 0, "", -1
+        if parsed is not None:
+            pack_quantity, unit = parsed
+            grams = convert_to_grams(pack_quantity, unit)
+        valid = isinstance(price, int) and grams > 0
+
+        self.category_ids.append(category_id)
+        self.names.append(name)
+        self.links.append(product.get("link", ""))
+        self.product_ids.append(product_id_from_link(product.get("link")))
+        self.quantities.append(quantity)
+        self.units.append(unit)
+        self.pack_quantities.append(pack_quantity)
+        self.prices.append(price if valid else 0)
+        self.grams.append(grams if valid else 0)
+        self.cost_per_gram.append(price / grams if valid else 0)
+        self.valid.append(valid)
+        self.tokens.append(normalize_tokens(name))
+
+    def __len__(self):
+        return len(self.names)
+
+    def product(self, product_id):
+        """Собирает словарь товара в формате базы продуктов."""
+        return {
+            "name": self.names[product_id],
+            "link": self.links[product_id],
+            "quantity": self.quantities[product_id],
+            "price": self.prices[product_id]
+        }
+
+
+class ProductIndex:
+    """
+    Инвертированный индекс каталога: токен названия продукта → номера продуктов, в названии которых он есть.
+
+    Токены — основы слов с заменой синонимов (см. normalize), поэтому «картофеля» находит «Картофель».
+    Для токенов, которых нет в каталоге (опечатки, непривычные формы), есть индекс символьных триграмм
+    по словарю токенов. Всё строится один раз при загрузке снимка.
+
+    Слова названия после предлогов из DEPENDENT_PREPOSITIONS описывают состав, а не сам товар, поэтому
+    совпадение только с ними весит меньше (см. find).
+
+    generation — уникальный в процессе номер индекса: по нему кэши результатов поиска отличают
+    данные старого снимка каталога от нового.
+    """
+
+    def __init__(self, table, fuzzy_threshold=MATCH_FUZZY_THRESHOLD):
+        self.generation = next(_INDEX_GENERATIONS)
+        self.table = table
+        self.fuzzy_threshold = fuzzy_threshold
+        self.word_counts = array("H")
+        self.postings = {}
+        # Токен → продукты, в названии которых он встречается только после предлога («из говядины»)
+        self.dependent_postings = {}
+        # Первый токен названия каждого продукта: обычно это сам товар
+        self.first_words = []
+
+        for product_id, words in enumerate(table.tokens):
+            self.word_counts.append(len(words))
+            self.first_words.append(words[0] if words else "")
+            head = set(itertools.takewhile(lambda word: word not in DEPENDENT_PREPOSITIONS, words))
+            for word in set(words):
+                self.postings.setdefault(word, []).append(product_id)
+                if word not in head:
+                    self.dependent_postings.setdefault(word, set()).add(product_id)
+
+        self.vocabulary = list(self.postings)
+        self.trigram_counts = array("H", (len(trigrams(word)) for word in self.vocabulary))
+        self.trigram_postings = {}
+        for word_id, word in enumerate(self.vocabulary):
+            for trigram in trigrams(word):
+                self.trigram_postings.setdefault(trigram, []).append(word_id)
+        self._similar = {}
+
+    def similar_tokens(self, token):
+        """
+        Токены каталога, похожие на token по символьным триграммам (коэффициент Дайса не ниже порога).
+
+        Короткие токены не ищутся: у них слишком мало триграмм для осмысленного сравнения.
+        """
+        similar = self._similar.get(token)
+        if similar is not None:
+            return similar
+
+        similar = []
+        token_trigrams = trigrams(token)
+        if len(token) >= 4:
+            overlaps = {}
+            for trigram in token_trigrams:
+                for word_id in self.trigram_postings.get(trigram, ()):
+                    overlaps[word_id] = overlaps.get(word_id, 0) + 1
+            for word_id, overlap in overlaps.items():
+                score = 2 * overlap / (len(token_trigrams) + self.trigram_counts[word_id])
+                if score >= self.fuzzy_threshold:
+                    similar.append(self.vocabulary[word_id])
+        self._similar[token] = similar
+        return similar
+
+    def _matched_tokens(self, token):
+        """Токены каталога, которыми ищется token: он сам или похожие на него, если его в каталоге нет."""
+        if token in self.postings:
+            return [token]
+        return self.similar_tokens(token) if self.fuzzy_threshold else []
+
+    def _posting(self, words):
+        if not words:
+            return None
+        if len(words) == 1:
+            return self.postings[words[0]]
+        return sorted({product_id for word in words for product_id in self.postings[word]})
+
+    def find(self, needed_name):
+        """
+        Возвращает номера продуктов, в названии которых есть все токены needed_name и которые длиннее запроса
+        не более чем на 3 слова, от лучше подходящих к хуже подходящим, при равенстве — в порядке базы.
+
+        Токен, которого нет в каталоге, заменяется похожими по триграммам токенами. Название без значимых
+        токенов (только единицы измерения или знаки) ничему не соответствует. Совпадение с первым словом
+        названия весит больше всего, а совпадение только со словом после предлога («Пельмени из говядины»,
+        «Арахис в сахаре») — меньше всего, поэтому такие товары идут после тех, что называются запросом.
+        """
+        return [product_id for product_id, _ in self._scored(needed_name)]
+
+    def find_best(self, needed_name):
+        """Номера лучше всего подходящих продуктов из find (в порядке базы)."""
+        scored = self._scored(needed_name)
+        if not scored:
+            return []
+        best = scored[0][1]
+        return sorted(product_id for product_id, score in scored if score == best)
+
+    def _scored(self, needed_name):
+        """Пары (номер продукта, вес совпадения) для find, от большего веса к меньшему."""
+        needed_words = normalize_tokens(needed_name)
+        if not needed_words:
+            return []
+        max_words = len(needed_words) + 3
+
+        matched, postings = [], []
+        for word in set(needed_words):
+            words = self._matched_tokens(word)
+            posting = self._posting(words)
+            if posting is None:
+                return []
+            matched.append(words)
+            postings.append(posting)
+
+        # Пересекаем, начиная с самого короткого списка
+        shortest, *rest = sorted(postings, key=len)
+        candidates = set(shortest)
+        for posting in rest:
+            candidates.intersection_update(posting)
+            if not candidates:
+                return []
+        candidates = [product_id for product_id in sorted(candidates) if self.word_counts[product_id] <= max_words]
+
+        # Токен запроса весит 3, если с него начинается название (обычно это сам товар: «Говядина тушеная»),
+        # 2, если он есть в названии до предлога, и 1, если только после предлога
+        scored = []
+        for product_id in candidates:
+            score = 0
+            for words in matched:
+                if self.first_words[product_id] in words:
+                    score += 3
+                elif any(product_id in self.dependent_postings.get(word, ()) for word in words):
+                    score += 1
+                else:
+                    score += 2
+            scored.append((product_id, score))
+        scored.sort(key=lambda item: -item[1])
+        return scored
+
+
+class CatalogSnapshot:
+    """
+    Неизменяемый снимок базы продуктов, загруженный в память.
+
+    Запрос берёт снимок один раз и работает с ним до конца, даже если каталог уже переключился на новый.
+    """
+
+    def __init__(self, table, version=0, stamp=None):
+        self.version = version
+        self.stamp = stamp
+        self.table = table
+        self.index = ProductIndex(table)
+        self._rows_by_product_id = None
+        self._rows_by_link = None
+
+    def product(self, product_id):
+        return self.table.product(product_id)
+
+    def rows_for_products(self, product_ids):
+        """
+        Номера строк снимка для номеров товаров ВкусВилла (None для товаров, которых в снимке нет).
+
+        Словарь номеров строится при первом обращении; товар из нескольких категорий берётся по первой строке.
+        """
+        rows = self._rows_by_product_id
+        if rows is None:
+            rows = {}
+            for row, product_id in enumerate(self.table.product_ids):
+                if product_id:
+                    rows.setdefault(product_id, row)
+            self._rows_by_product_id = rows
+        return [rows.get(product_id) if product_id else None for product_id in product_ids]
+
+    def rows_for_links(self, links, names=None):
+        """
+        Номера строк снимка для товаров, из ссылки которых не удалось получить номер товара
+        (None для товаров, которых в снимке нет). Остальные товары ищутся через rows_for_products.
+
+        В каталоге у таких товаров обычно общая ссылка-заглушка javascript:void(0), поэтому товар ищется
+        по названию вместе со ссылкой. Без названия (корзины, сохранённые до его появления) товар находится
+        только по ссылке, которая не общая для нескольких товаров.
+        """
+        rows = self._rows_by_link
+        if rows is None:
+            rows, shared = {}, set()
+            for row, product_id in enumerate(self.table.product_ids):
+                if not product_id:
+                    link, name = self.table.links[row], self.table.names[row]
+                    if ("", link) in rows:
+                        shared.add(link)
+                    rows[("", link)] = row
+                    if name:
+                        rows.setdefault((name, link), row)
+            for link in shared | {""}:
+                rows.pop(("", link), None)
+            self._rows_by_link = rows
+        names = names or [""] * len(links)
+        return [rows.get((name, link)) for name, link in zip(names, links)]
+
+    def __len__(self):
+        return len(self.table)
+
+
+class Catalog:
+    """
+    Резидентная база продуктов: файл читается один раз, дальше запросы обслуживаются из памяти.
+
+    Если рядом с JSON-файлом лежит не более старый бинарный снимок (см. catalog_binary), колонки
+    открываются из него через mmap без разбора JSON. Изменение файлов определяется по inode, mtime и размеру.
+    Новый снимок загружается в фоновом потоке и подменяет старый одним присваиванием, поэтому запросы
+    во время обновления не ждут загрузки.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.binary_path = binary_path(path)
+        self._snapshot = None
+        self._version = 0
+        self._failed_stamp = None
+        self._load_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._reload_thread = None
+
+    def _stat(self):
+        stamp = _file_stamp(self.path), _file_stamp(self.binary_path)
+        if stamp == (None, None):
+            raise FileNotFoundError(f"База продуктов {self.path} не найдена")
+        return stamp
+
+    def _load_table(self, stamp):
+        json_stamp, binary_stamp = stamp
+        if binary_stamp is not None and (json_stamp is None or binary_stamp[1] >= json_stamp[1]):
+            try:
+                return BinaryProductTable(self.binary_path)
+            except (OSError, ValueError) as e:
+                if json_stamp is None:
+                    raise
+                logger.warning(f"Не удалось открыть бинарный снимок {self.binary_path}, читаем JSON: {e}")
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            return ProductTable(json.load(f))
+
+    def snapshot(self):
+        """Возвращает текущий снимок; если файл изменился, запускает его перезагрузку в фоне."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return self.reload()
+
+        try:
+            stamp = self._stat()
+        except OSError:
+            return snapshot
+
+        if stamp != snapshot.stamp and stamp != self._failed_stamp:
+            self._reload_in_background()
+        return snapshot
+
+    def reload(self):
+        """Синхронно загружает файл, если он изменился, и возвращает актуальный снимок."""
+        with self._load_lock:
+            stamp = self._stat()
+            if self._snapshot is not None and stamp == self._snapshot.stamp:
+                return self._snapshot
+
+            with span("catalog.load") as current:
+                table = self._load_table(stamp)
+
+                self._version += 1
+                snapshot = CatalogSnapshot(table, self._version, stamp)
+                current.set(version=snapshot.version, products=len(snapshot),
+                            binary=isinstance(table, BinaryProductTable))
+            self._snapshot = snapshot
+            logger.info(f"База продуктов {self.path} загружена: версия {snapshot.version}, {len(snapshot)} продуктов")
+            return snapshot
+
+    def _reload_in_background(self):
+        with self._state_lock:
+            if self._reload_thread is not None and self._reload_thread.is_alive():
+                return
+            self._reload_thread = threading.Thread(target=self._safe_reload, name="catalog-reload", daemon=True)
+            self._reload_thread.start()
+
+    def _safe_reload(self):
+        try:
+            self.reload()
+        except (OSError, ValueError) as e:
+            # Файл мог быть записан не до конца: остаёмся на старом снимке до следующего изменения
+            try:
+                self._failed_stamp = self._stat()
+            except OSError:
+                pass
+            logger.warning(f"Не удалось перезагрузить базу продуктов {self.path}: {e}")
+
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+_CATALOGS = {}
+_CATALOGS_LOCK = threading.Lock()
+
+
+def get_catalog(path):
+    """Возвращает общий для процесса каталог для файла базы path."""
+    catalog = _CATALOGS.get(path)
+    if catalog is None:
+        with _CATALOGS_LOCK:
+            catalog = _CATALOGS.setdefault(path, Catalog(path))
+    return catalog
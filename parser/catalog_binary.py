@@ -0,0 +1,162 @@
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+from parser.normalize import NORMALIZE_VERSION
+
+# Заголовок: сигнатура, версия формата, версия нормализации токенов, порядок байт, число товаров,
+# число категорий, размер таблицы строк
+MAGIC = b"VVCATLG\0"
+FORMAT_VERSION = 3
+HEADER = struct.Struct("<8sHHHIIQ")
+BYTE_ORDERS = {"little": 1, "big": 2}
+
+# Числовые колонки в порядке записи: имя и формат array
+NUMERIC_COLUMNS = (
+    ("prices", "q"),
+    ("product_ids", "q"),
+    ("pack_quantities", "q"),
+    ("grams", "d"),
+    ("cost_per_gram", "d"),
+    ("category_ids", "H"),
+    ("valid", "B"),
+)
+
+# Строковые колонки товаров в порядке записи в таблицу строк
+STRING_COLUMNS = ("names", "links", "quantities", "units")
+
+
+def binary_path(path):
+    """Путь к бинарному снимку рядом с JSON-файлом базы."""
+    return os.path.splitext(path)[0] + ".bin"
+
+
+def _padding(size):
+    return b"\0" * (-size % 8)
+
+
+def write_binary_catalog(table, path):
+    """
+    Записывает колонки ProductTable в бинарный снимок.
+
+    Числовые колонки лежат подряд массивами фиксированной ширины, выровненными по 8 байт; строки
+    (названия, ссылки, количества, единицы, нормализованные токены названий, категории) — в общей
+    таблице строк со смещениями.
+    Файл пишется во временный файл с уникальным именем в том же каталоге и подменяется переименованием,
+    поэтому открытые через mmap снимки у читателей остаются целыми, а одновременные записи не портят друг друга.
+    """
+    count = len(table)
+    strings = [value for column in STRING_COLUMNS for value in getattr(table, column)]
+    strings += [" ".join(tokens) for tokens in table.tokens]
+    strings += table.categories
+    encoded = [value.encode("utf-8") for value in strings]
+    offsets = array("Q", [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    blob = b"".join(encoded)
+
+    directory = os.path.dirname(path) or "."
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                     delete=False) as f:
+        tmp_path = f.name
+        try:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, NORMALIZE_VERSION, BYTE_ORDERS[sys.byteorder], count,
+                                len(table.categories), len(blob)))
+            f.write(_padding(HEADER.size))
+            for column, typecode in NUMERIC_COLUMNS:
+                data = array(typecode, getattr(table, column)).tobytes()
+                f.write(data)
+                f.write(_padding(len(data)))
+            f.write(offsets.tobytes())
+            f.write(blob)
+        except BaseException:
+            f.close()
+            os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, path)
+
+
+class StringColumn:
+    """Строковая колонка поверх таблицы строк в mmap: строки декодируются только при обращении."""
+
+    def __init__(self, blob, offsets, start, count):
+        self._blob = blob
+        self._offsets = offsets
+        self._start = start
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        j = self._start + i
+        return str(self._blob[self._offsets[j]:self._offsets[j + 1]], "utf-8")
+
+    def __iter__(self):
+        blob = self._blob
+        offsets = self._offsets[self._start:self._start + self._count + 1].tolist()
+        for begin, end in zip(offsets, offsets[1:]):
+            yield str(blob[begin:end], "utf-8")
+
+
+class BinaryProductTable:
+    """
+    Колонки каталога, открытые из бинарного снимка через mmap без копирования.
+
+    Повторяет интерфейс ProductTable: числовые колонки — memoryview над файлом, строковые — StringColumn.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+
+        magic, version, tokens_version, byte_order, count, categories_count, blob_size = HEADER.unpack_from(view)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} не является бинарным снимком каталога версии {FORMAT_VERSION}")
+        if tokens_version != NORMALIZE_VERSION:
+            raise ValueError(f"{path} записан с другой нормализацией названий")
+        if byte_order != BYTE_ORDERS[sys.byteorder]:
+            raise ValueError(f"{path} записан с другим порядком байт")
+
+        offset = HEADER.size + len(_padding(HEADER.size))
+        for column, typecode in NUMERIC_COLUMNS:
+            size = count * array(typecode).itemsize
+            setattr(self, column, view[offset:offset + size].cast(typecode))
+            offset += size + len(_padding(size))
+
+        # Строковые колонки, затем токены названий и названия категорий
+        strings_count = count * (len(STRING_COLUMNS) + 1) + categories_count
+        offsets_size = (strings_count + 1) * 8
+        offsets = view[offset:offset + offsets_size].cast("Q")
+        blob = view[offset + offsets_size:offset + offsets_size + blob_size]
+        if len(blob) != blob_size:
+            raise ValueError(f"{path} записан не полностью")
+
+        for i, column in enumerate(STRING_COLUMNS):
+            setattr(self, column, StringColumn(blob, offsets, i * count, count))
+        self._tokens = StringColumn(blob, offsets, len(STRING_COLUMNS) * count, count)
+        self.categories = list(StringColumn(blob, offsets, (len(STRING_COLUMNS) + 1) * count, categories_count))
+        self.invalid_count = count - sum(self.valid)
+
+    @property
+    def tokens(self):
+        # Токены названий нормализуются при записи снимка и хранятся через пробел
+        return (tuple(tokens.split()) for tokens in self._tokens)
+
+    def __len__(self):
+        return len(self.prices)
+
+    def product(self, product_id):
+        """Собирает словарь товара в формате базы продуктов."""
+        return {
+            "name": self.names[product_id],
+            "link": self.links[product_id],
+            "quantity": self.quantities[product_id],
+            "price": self.prices[product_id]
+        }
@@ -1,19 +1,27 @@
-import json
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 
+import numpy as np
 
-def convert_to_grams(quantity, unit):
-    # Словарь для конверсии в граммы
-    unit_conversion = {
-        "г": 1,
-        "кг": 1000,
-        "мл": 1,  # Примерно, для воды 1 мл = 1 г
-        "л": 1000,
-        "шт": 1  # Если штуки нужно пересчитывать, добавьте дополнительную логику
-    }
-    # Проверка наличия единицы измерения
-    if unit not in unit_conversion:
-        return -1  # Неизвестная единица измерения
-    return quantity * unit_conversion[unit]
+from config import MATCH_CACHE_SIZE
+from parser.catalog import ProductIndex, ProductTable, convert_to_grams, get_catalog
+from parser.normalize import normalize_tokens
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Наибольший размер матрицы «вес × кандидат» при пакетном подборе
+MAX_BATCH_CELLS = 1_000_000
+
+
+def packs_for_grams(base_needed, base_pack):
+    """Количество упаковок по base_pack грамм, которых хватит на base_needed грамм."""
+    packs_needed = base_needed / base_pack
+
+    # Возвращаем округлённое вверх значение
+    return int(packs_needed) if packs_needed.is_integer() else int(packs_needed) + 1
 
 
 def calculate_packs_needed(quantity_needed, unit_needed, pack_quantity, pack_unit):
@@ -25,11 +33,230 @@ def calculate_packs_needed(quantity_needed, unit_needed, pack_quantity, pack_uni
     if base_needed == -1 or base_pack == -1 or base_pack == 0:
         return -1  # Невозможно сопоставить
 
-    # Считаем количество упаковок
-    packs_needed = base_needed / base_pack
+    return packs_for_grams(base_needed, base_pack)
 
-    # Возвращаем округлённое вверх значение
-    return int(packs_needed) if packs_needed.is_integer() else int(packs_needed) + 1
+
+class CandidateCache:
+    """
+    LRU-кэш кандидатов: токены ингредиента → номера подходящих товаров в порядке ранжирования.
+
+    Каждая запись помечена поколением индекса, по которому она посчитана; после перезагрузки каталога
+    у индекса новое поколение, и старые записи считаются промахами и перезаписываются. Количество
+    упаковок и стоимость зависят от нужного веса и в кэш не попадают.
+    """
+
+    def __init__(self, max_entries=MATCH_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, generation):
+        """Возвращает номера товаров или None, если записи нет или она от другого снимка каталога."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != generation:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, generation, ids):
+        with self._lock:
+            self._entries[key] = (generation, ids)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """Счётчики попаданий и промахов и текущий размер кэша."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+# Общий для процесса кэш кандидатов
+candidate_cache = CandidateCache()
+
+
+class SelectionEngine:
+    """
+    Подбор товаров по колонкам каталога в NumPy.
+
+    Колонки снимка (цены, вес упаковки, цена за грамм, признак valid) оборачиваются в массивы NumPy
+    без копирования, поэтому для каждого ингредиента количество упаковок и итоговая стоимость
+    считаются сразу по всем подходящим товарам одной векторной операцией.
+    """
+
+    def __init__(self, index):
+        table = index.table
+        self.index = index
+        self.table = table
+        self.prices = np.frombuffer(table.prices, dtype=np.int64)
+        self.grams = np.frombuffer(table.grams, dtype=np.float64)
+        self.cost_per_gram = np.frombuffer(table.cost_per_gram, dtype=np.float64)
+        self.valid = np.frombuffer(table.valid, dtype=np.uint8).astype(bool)
+
+    def candidates(self, needed_product):
+        """
+        Номера лучше всего подходящих ингредиенту товаров (ProductIndex.find_best), упорядоченные по цене
+        за грамм, затем по порядку в базе.
+
+        Результат берётся из candidate_cache, если ингредиент с теми же токенами уже искали в этом снимке.
+        """
+        key = normalize_tokens(needed_product)
+        ids = candidate_cache.get(key, self.index.generation)
+        if ids is not None:
+            return ids
+
+        ids = np.asarray(self.index.find_best(needed_product), dtype=np.intp)
+        ids = ids[self.valid[ids]]
+        ids = ids[np.argsort(self.cost_per_gram[ids], kind="stable")]
+        # Массив общий для всех запросов, поэтому защищаем его от изменений
+        ids.flags.writeable = False
+        candidate_cache.set(key, self.index.generation, ids)
+        return ids
+
+    def rank(self, needed_product, base_needed, top_k=1):
+        """
+        Возвращает до top_k лучших товаров для ингредиента весом base_needed грамм.
+
+        Товары сравниваются по итоговой стоимости с учётом округления до целых упаковок, при равной
+        стоимости — по цене за грамм, затем по порядку в базе.
+
+        :return: Список кортежей (номер товара, количество упаковок, итоговая стоимость).
+        """
+        ids = self.candidates(needed_product)
+        if not ids.size:
+            return []
+
+        packs_needed = np.ceil(base_needed / self.grams[ids]).astype(np.int64)
+        total_prices = self.prices[ids] * packs_needed
+        # Устойчивая сортировка сохраняет порядок кандидатов при равной стоимости
+        order = np.argsort(total_prices, kind="stable")[:top_k]
+        return list(zip(ids[order].tolist(), packs_needed[order].tolist(), total_prices[order].tolist()))
+
+    def select_many(self, ids, bases_needed):
+        """
+        Лучший товар из кандидатов ids (в порядке candidates) для каждого веса из bases_needed.
+
+        Количество упаковок и стоимость считаются матрицей «вес × кандидат» за одну операцию.
+
+        :return: Массивы номеров товаров, количества упаковок и итоговой стоимости, по одному на вес.
+        """
+        packs_needed = np.ceil(bases_needed[:, None] / self.grams[ids]).astype(np.int64)
+        total_prices = packs_needed * self.prices[ids]
+        best = total_prices.argmin(axis=1)
+        rows = np.arange(len(bases_needed))
+        return ids[best], packs_needed[rows, best], total_prices[rows, best]
+
+
+@lru_cache(maxsize=2)
+def get_selection_engine(index):
+    """Движок подбора для индекса; создаётся один раз на снимок каталога."""
+    return SelectionEngine(index)
+
+
+def rank_products(products_needed, index, top_k=3):
+    """
+    Подбирает для каждого нужного продукта до top_k товаров с минимальной итоговой стоимостью.
+
+    Ингредиенты подбираются независимо: один и тот же товар может подойти нескольким ингредиентам.
+
+    :param products_needed: Словарь с нужными продуктами и их количеством/единицами измерения.
+    :param index: ProductIndex по базе продуктов.
+    :param top_k: Сколько альтернатив вернуть для каждого продукта.
+    :return: Список списков найденных товаров, от лучшего к худшему (пустой, если продукт не найден).
+    """
+    engine = get_selection_engine(index)
+    table = engine.table
+    result = []
+
+    for needed_product, details in products_needed.items():
+        needed_quantity = details[0]  # Необходимое количество
+        needed_unit = details[1]  # Единица измерения
+
+        # Переводим нужное количество в граммы
+        base_needed = convert_to_grams(needed_quantity, needed_unit)
+        if base_needed == -1:
+            result.append([])
+            continue
+
+        result.append([
+            {
+                **table.product(product_id),
+                "packs_needed": packs_needed,
+                "total_price": total_price,
+                "cost_per_gram": table.cost_per_gram[product_id]
+            }
+            for product_id, packs_needed, total_price in engine.rank(needed_product, base_needed, top_k)
+        ])
+    return result
+
+
+def match_products(products_needed, index):
+    """
+    Подбирает для каждого нужного продукта товар с минимальной итоговой стоимостью.
+
+    :param products_needed: Словарь с нужными продуктами и их количеством/единицами измерения.
+    :param index: ProductIndex по базе продуктов.
+    :return: Список найденных продуктов (пустой словарь, если продукт не найден).
+    """
+    return [alternatives[0] if alternatives else {} for alternatives in rank_products(products_needed, index, 1)]
+
+
+def match_many(carts, index):
+    """
+    Подбирает товары сразу для многих корзин.
+
+    Ингредиенты, одинаковые с точностью до нормализации названия, ищутся в каталоге один раз на все
+    корзины, а упаковки и стоимость для всех их вхождений считаются одной матричной операцией.
+
+    :param carts: Список словарей с нужными продуктами в формате products_needed.
+    :param index: ProductIndex по базе продуктов.
+    :return: Для каждой корзины словарь {"products": список как у match_products, "total_price": сумма}.
+    """
+    engine = get_selection_engine(index)
+    table = engine.table
+    products = [[{} for _ in cart] for cart in carts]
+
+    # Токены ингредиента → название для поиска и вхождения (корзина, позиция, граммы)
+    occurrences = {}
+    for cart_id, cart in enumerate(carts):
+        for position, (needed_product, details) in enumerate(cart.items()):
+            base_needed = convert_to_grams(details[0], details[1])
+            if base_needed == -1:
+                continue
+            key = normalize_tokens(needed_product)
+            occurrences.setdefault(key, (needed_product, []))[1].append((cart_id, position, base_needed))
+
+    for needed_product, entries in occurrences.values():
+        ids = engine.candidates(needed_product)
+        if not ids.size:
+            continue
+
+        bases_needed = np.array([base_needed for _, _, base_needed in entries], dtype=np.float64)
+        # Матрица считается частями, чтобы частые ингредиенты с большим числом кандидатов не занимали много памяти
+        step = max(1, MAX_BATCH_CELLS // ids.size)
+        for start in range(0, len(entries), step):
+            best_ids, packs, totals = engine.select_many(ids, bases_needed[start:start + step])
+            for (cart_id, position, _), product_id, packs_needed, total_price in zip(
+                    entries[start:start + step], best_ids.tolist(), packs.tolist(), totals.tolist()):
+                products[cart_id][position] = {
+                    **table.product(product_id),
+                    "packs_needed": packs_needed,
+                    "total_price": total_price,
+                    "cost_per_gram": table.cost_per_gram[product_id]
+                }
+
+    return [{"products": items, "total_price": sum(item.get("total_price", 0) for item in items)}
+            for items in products]
 
 
 def get_links_from_list(products_needed, json_file):
@@ -40,68 +267,12 @@ def get_links_from_list(products_needed, json_file):
     :param json_file: Имя JSON-файла с базой данных продуктов.
     :return: Словарь с категориями и списками найденных продуктов.
     """
-    with open(json_file, "r", encoding="utf-8") as f:
-        database = json.load(f)
-
-    result = [{} for _ in range(len(products_needed))]
-
-    # Перебираем категории в базе данных
-    for category, products in database.items():
-        for product in products:
-            product_name = product.get("name", "").lower()
-            # Проверяем, содержится ли продукт в списке нужных
-            for i, [needed_product, details] in enumerate(products_needed.items()):
-                needed_name = needed_product.lower()
-                if "помидоры" in needed_product:
-                    needed_name = needed_name.replace("помидоры", "томаты", 1)
-                if "растительное" in needed_product:
-                    needed_name = needed_name.replace("растительное", "подсолнечное", 1)
-                needed_quantity = details[0]  # Необходимое количество
-                needed_unit = details[1]  # Единица измерения
-
-                if len(product_name.split()) - len(needed_name.split()) > 3:
-                    continue
-
-                if all(word in product_name.split() for word in needed_name.split()):
-                    product_price = product["price"]
-
-                    try:
-                        if not product["quantity"]:
-                            product["quantity"] = "1 кг"
-
-                        product_quantity = int(product["quantity"].split()[0])
-                        product_unit = product["quantity"].split()[1]
-                    except:
-                        continue
-
-                    # Переводим количество продукта в граммы
-                    product_weight_in_grams = convert_to_grams(product_quantity, product_unit)
-                    if product_weight_in_grams == -1:
-                        continue
-
-                    # Стоимость за грамм
-                    cost_per_gram = product_price / product_weight_in_grams
-
-                    # Расчёт необходимого количества упаковок
-                    packs_needed = calculate_packs_needed(needed_quantity, needed_unit, product_quantity, product_unit)
-                    if packs_needed == -1:
-                        continue
-
-                    # Общая стоимость для текущего продукта
-                    total_price = product_price * packs_needed
-
-                    # Оптимизация: выбираем продукт с минимальной стоимостью за грамм
-                    if not result[i] or cost_per_gram < result[i].get("cost_per_gram", float('inf')):
-                        if result[i]:
-                            result[i] = {}
-                        result[i] = {
-                            **product,
-                            "packs_needed": packs_needed,
-                            "total_price": total_price,
-                            "cost_per_gram": cost_per_gram
-                        }
-                    break
-    print(*result, sep='\n')
+    snapshot = get_catalog(json_file).snapshot()
+
+    with span("match", ingredients=len(products_needed)) as current:
+        result = match_products(products_needed, snapshot.index)
+        current.set(found=sum(1 for item in result if item), catalog_version=snapshot.version)
+    logger.debug("Подобранные товары: %s", result)
     return result
 
 
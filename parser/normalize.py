@@ -0,0 +1,182 @@
+import re
+from functools import lru_cache
+
+# Версия нормализации: увеличивается при любом изменении правил, чтобы бинарные снимки каталога
+# с токенами, посчитанными по старым правилам, не использовались
+NORMALIZE_VERSION = 2
+
+# Стеммер Портера (Snowball) для русского языка: окончания отрезаются только в области RV
+VOWELS = "аеиоуыэюя"
+
+PERFECTIVE_GERUND = (("в", "вши", "вшись"), ("ив", "ивши", "ившись", "ыв", "ывши", "ывшись"))
+REFLEXIVE = ("ся", "сь")
+ADJECTIVE = ("ее", "ие", "ые", "ое", "ими", "ыми", "ей", "ий", "ый", "ой", "ем", "им", "ым", "ом", "его", "ого",
+             "ему", "ому", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею")
+PARTICIPLE = (("ем", "нн", "вш", "ющ", "щ"), ("ивш", "ывш", "ующ"))
+VERB = (("ла", "на", "ете", "йте", "ли", "й", "л", "ем", "н", "ло", "но", "ет", "ют", "ны", "ть", "ешь", "нно"),
+        ("ила", "ыла", "ена", "ейте", "уйте", "ите", "или", "ыли", "ей", "уй", "ил", "ыл", "им", "ым", "ен", "ило",
+         "ыло", "ено", "ят", "ует", "уют", "ит", "ыт", "ены", "ить", "ыть", "ишь", "ую", "ю"))
+NOUN = ("а", "ев", "ов", "ие", "ье", "е", "иями", "ями", "ами", "еи", "ии", "и", "ией", "ей", "ой", "ий", "й", "иям",
+        "ям", "ием", "ем", "ам", "ом", "о", "у", "ах", "иях", "ях", "ы", "ь", "ию", "ью", "ю", "ия", "ья", "я")
+SUPERLATIVE = ("ейше", "ейш")
+
+# Окончания прилагательных, которых нет у существительных: по ним прилагательное отличается от существительного
+# той же основы. «ом», «ем», «ой», «ей» бывают и у существительных («рисом», «рыбой»), поэтому не учитываются
+ADJECTIVE_ONLY = frozenset(("ее", "ие", "ые", "ое", "ими", "ыми", "ий", "ый", "им", "ым", "его", "ого", "ему", "ому",
+                            "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею"))
+# Основы существительных мужского рода, совпадающие с основой прилагательного: у таких существительных
+# не бывает окончаний «ой» и «ей», поэтому «сырой» — прилагательное, а «сыром» — существительное
+MASCULINE_HOMONYMS = {"сыр"}
+DERIVATIONAL = ("ость", "ост")
+
+# Синонимы: токен слова → токен, под которым оно ищется в каталоге. Применяются и к названиям товаров,
+# и к ингредиентам, поэтому «помидоры черри» и «томаты черри» дают одинаковые токены
+SYNONYMS = {
+    "помидор": "томат",
+    "растительный": "подсолнечный",
+    "картошк": "картофел",
+    "цыпленк": "куриц",
+    "цыплят": "куриц",
+    "яиц": "яйц",
+    "луковиц": "лук",
+}
+
+# Слова-меры из рецептов («зубчик чеснока», «пучок укропа»), которых нет в названиях товаров
+IGNORED_TOKENS = {"зубчик", "пучк", "щепотк", "веточк", "дольк"}
+
+# Беглая гласная: «огурец» → «огурц», как в «огурцы»; короткие основы не трогаются
+_FLEETING_VOWEL = re.compile(r"(?<=[^аеиоуыэюя])[ео](?=[цк]$)")
+_FLEETING_MIN_LENGTH = 5
+
+# Знаки, которые отбрасываются по краям слов
+_PUNCTUATION = ".,;:!?()[]«»\"'-–—%*/"
+_WORD_PATTERN = re.compile(r"\S+")
+
+
+def _regions(word):
+    """Начала областей RV и R2 по правилам Snowball."""
+    rv = len(word)
+    for i, char in enumerate(word):
+        if char in VOWELS:
+            rv = i + 1
+            break
+
+    def next_region(start):
+        for i in range(start + 1, len(word)):
+            if word[i] not in VOWELS and word[i - 1] in VOWELS:
+                return i + 1
+        return len(word)
+
+    return rv, next_region(next_region(0))
+
+
+def _remove_ending(word, rv, endings, preceded=None):
+    """
+    Отрезает самое длинное из окончаний endings, лежащее в области RV.
+
+    Если задан preceded, окончание отрезается только после одной из этих букв (сами буквы остаются).
+    """
+    for ending in sorted(endings, key=len, reverse=True):
+        if word.endswith(ending) and len(word) - len(ending) >= rv:
+            if preceded is None:
+                return word[:-len(ending)]
+            if len(word) - len(ending) - 1 >= rv and word[-len(ending) - 1] in preceded:
+                return word[:-len(ending)]
+    return None
+
+
+def _remove_group(word, rv, groups):
+    # Первая группа окончаний отрезается только после «а» или «я», вторая — всегда; берётся самое длинное
+    candidates = [_remove_ending(word, rv, groups[0], "ая"), _remove_ending(word, rv, groups[1])]
+    candidates = [candidate for candidate in candidates if candidate is not None]
+    return min(candidates, key=len) if candidates else None
+
+
+def _remove_adjectival(word, rv):
+    """Слово без окончания прилагательного (и причастия перед ним) и само окончание или (None, "")."""
+    stripped = _remove_ending(word, rv, ADJECTIVE)
+    if stripped is None:
+        return None, ""
+    ending = word[len(stripped):]
+    # Причастие перед окончанием прилагательного тоже отрезается
+    participle = _remove_group(stripped, rv, PARTICIPLE)
+    return (stripped if participle is None else participle), ending
+
+
+def stem(word):
+    """Основа русского слова по алгоритму Snowball; слова без русских гласных возвращаются как есть."""
+    return _stem(word)[0]
+
+
+@lru_cache(maxsize=65536)
+def _stem(word):
+    """Основа слова и отрезанное окончание прилагательного (пустая строка, если его не было)."""
+    word = word.lower().replace("ё", "е")
+    rv, r2 = _regions(word)
+    if rv >= len(word):
+        return word, ""
+
+    # Шаг 1: деепричастие, иначе возвратная частица и затем прилагательное, глагол или существительное
+    adjective_ending = ""
+    stripped = _remove_group(word, rv, PERFECTIVE_GERUND)
+    if stripped is None:
+        word = _remove_ending(word, rv, REFLEXIVE) or word
+        stripped, adjective_ending = _remove_adjectival(word, rv)
+        if stripped is None:
+            stripped = _remove_group(word, rv, VERB)
+        if stripped is None:
+            stripped = _remove_ending(word, rv, NOUN)
+    if stripped is not None:
+        word = stripped
+
+    # Шаг 2: конечная «и»
+    if word.endswith("и") and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    # Шаг 3: словообразовательный суффикс в области R2
+    stripped = _remove_ending(word, max(rv, r2), DERIVATIONAL)
+    if stripped is not None:
+        word = stripped
+
+    # Шаг 4: «нн» → «н», превосходная степень, мягкий знак
+    stripped = _remove_ending(word, rv, SUPERLATIVE)
+    if stripped is not None:
+        word = stripped
+    if word.endswith("нн") and len(word) - 2 >= rv:
+        word = word[:-1]
+    elif word.endswith("ь") and len(word) - 1 >= rv:
+        word = word[:-1]
+    return word, adjective_ending
+
+
+@lru_cache(maxsize=65536)
+def normalize_word(word):
+    """
+    Токен слова для поиска: основа без знаков по краям с заменой синонимов; пустая строка, если слово не нужно
+    для поиска.
+    """
+    word = word.strip(_PUNCTUATION)
+    if not word:
+        return ""
+    token, ending = _stem(word)
+    if ending in ADJECTIVE_ONLY or (ending in ("ой", "ей") and token in MASCULINE_HOMONYMS):
+        # Прилагательные приводятся к одной форме и не совпадают с существительными той же основы:
+        # «сырой» → «сырый», а не «сыр»; «рисом» и «сыром» остаются существительными
+        token += "ый"
+    elif len(token) >= _FLEETING_MIN_LENGTH:
+        token = _FLEETING_VOWEL.sub("", token)
+    if token in IGNORED_TOKENS:
+        return ""
+    return SYNONYMS.get(token, token)
+
+
+def normalize_tokens(text):
+    """Разбивает название продукта или ингредиента на токены поиска."""
+    tokens = (normalize_word(word) for word in _WORD_PATTERN.findall(text or ""))
+    return tuple(token for token in tokens if token)
+
+
+def trigrams(token):
+    """Множество символьных триграмм токена с границами слова."""
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
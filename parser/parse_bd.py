@@ -1,9 +1,20 @@
-import requests
-from bs4 import BeautifulSoup
+import hashlib
 import json
+import os
 import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 
-from config import BD_path
+from parser.catalog import ProductTable
+from parser.catalog_binary import binary_path, write_binary_catalog
+from config import BD_path, PARSER_MAX_CONCURRENCY, PARSER_REQUEST_INTERVAL, PARSER_MAX_RETRIES, PARSER_INCREMENTAL
 
 # Задаем User-Agent для имитации реального браузера
 HEADERS = {
@@ -12,10 +23,79 @@ HEADERS = {
 
 BASE_URL = "https://vkusvill.ru"
 
+# Ответы, после которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class Fetcher:
+    """
+    Загрузчик страниц для парсера.
+
+    Все запросы идут через одну requests.Session с пулом соединений. Для каждого хоста ограничено
+    число одновременных запросов и минимальный интервал между ними; сетевые ошибки и ответы
+    429/5xx повторяются с экспоненциальной задержкой. Если после последней попытки сайт всё ещё
+    отвечает ошибкой, get бросает requests.HTTPError, чтобы страница с ошибкой не разбиралась как каталог.
+    """
+
+    def __init__(self, max_concurrency=PARSER_MAX_CONCURRENCY, request_interval=PARSER_REQUEST_INTERVAL,
+                 max_retries=PARSER_MAX_RETRIES, backoff=1.0, timeout=30):
+        self.max_concurrency = max_concurrency
+        self.request_interval = request_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=max_concurrency, pool_maxsize=max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._hosts_lock = threading.Lock()
+        self._host_semaphores = {}
+        self._host_next_request = {}
+
+    def _wait_turn(self, host):
+        # Резервируем ближайшее свободное время для запроса к хосту
+        with self._hosts_lock:
+            now = time.monotonic()
+            start = max(now, self._host_next_request.get(host, now))
+            self._host_next_request[host] = start + self.request_interval
+        if start > now:
+            time.sleep(start - now)
+
+    def _semaphore(self, host):
+        with self._hosts_lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.max_concurrency)
+            return self._host_semaphores[host]
+
+    def get(self, url, **kwargs):
+        host = urlsplit(url).netloc
+        kwargs.setdefault("timeout", self.timeout)
+
+        for attempt in range(self.max_retries + 1):
+            with self._semaphore(host):
+                self._wait_turn(host)
+                try:
+                    response = self.session.get(url, **kwargs)
+                except requests.RequestException:
+                    if attempt == self.max_retries:
+                        raise
+                else:
+                    if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                        response.raise_for_status()
+                        return response
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def close(self):
+        self.session.close()
+
 
 # Функция для получения ссылок на категории
-def get_categories():
-    response = requests.get(f"{BASE_URL}/goods/", headers=HEADERS)
+def get_categories(fetcher=None, base_url=BASE_URL):
+    http = fetcher or requests
+    response = http.get(f"{base_url}/goods/", headers=HEADERS)
     soup = BeautifulSoup(response.text, "html.parser")
 
     # Находим блоки с категориями по классу
@@ -23,16 +103,13 @@ def get_categories():
     for link in soup.select(".VVCatalog2020Menu__List a"):
         categories.append({
             "name": link.get_text(strip=True),
-            "url": BASE_URL + link["href"]
+            "url": base_url + link["href"]
         })
     return categories
 
 
-# Функция для получения количества страниц в категории
-def get_total_pages(category_url):
-    response = requests.get(category_url, headers=HEADERS)
-    soup = BeautifulSoup(response.text, "html.parser")
-
+# Количество страниц в категории по блоку пагинации
+def get_total_pages_from_soup(soup):
     # Ищем кнопку последней страницы
     last_page = soup.select(".VV_Pager.js-lk-pager a")
     if len(last_page) > 1:
@@ -41,43 +118,166 @@ def get_total_pages(category_url):
         return 1
 
 
-# Функция для парсинга продуктов на странице категории
-def parse_products_in_category(category_url):
-    total_pages = get_total_pages(category_url)
+# Функция для получения количества страниц в категории
+def get_total_pages(category_url, fetcher=None):
+    http = fetcher or requests
+    response = http.get(category_url, headers=HEADERS)
+    soup = BeautifulSoup(response.text, "html.parser")
+    return get_total_pages_from_soup(soup)
+
+
+# Функция для парсинга карточек товаров на одной странице категории
+def parse_products_from_soup(soup, base_url=BASE_URL):
     products = []
 
-    # Проходим по каждой странице категории
-    for page in range(1, total_pages + 1):
-        page_url = f"{category_url}?PAGEN_1={page}"
-        response = requests.get(page_url, headers=HEADERS)
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # Парсим карточки товаров на странице
-        product_cards = soup.select('.ProductCards__list .ProductCard')
-
-        for card in product_cards:
-            name_element = card.select_one('.ProductCard__link')
-            link = ''
-            if name_element:
-                name = re.sub(r'[^a-zA-Z0-9а-яА-ЯёЁ]', ' ', name_element.get('title').strip())
-                link = BASE_URL + name_element['href']
-            quantity = card.select_one('.ProductCard__weight')
-            if quantity:
-                quantity = re.sub(r'[^a-zA-Z0-9а-яА-ЯёЁ]', ' ', quantity.get_text(strip=True))
-            price = card.select_one('.Price.Price--md.Price--gray.Price--label')
-            if price:
-                price = int(re.sub(r'[^0-9]', '', price.get_text(strip=True)))
-
-            # Добавляем информацию о продукте в список
-            products.append({
-                "name": name,
-                "link": link,
-                "quantity": quantity,
-                "price": price
-            })
+    for card in soup.select('.ProductCards__list .ProductCard'):
+        name_element = card.select_one('.ProductCard__link')
+        name = ''
+        link = ''
+        if name_element:
+            name = re.sub(r'[^a-zA-Z0-9а-яА-ЯёЁ]', ' ', name_element.get('title').strip())
+            link = base_url + name_element['href']
+        quantity = card.select_one('.ProductCard__weight')
+        if quantity:
+            quantity = re.sub(r'[^a-zA-Z0-9а-яА-ЯёЁ]', ' ', quantity.get_text(strip=True))
+        price = card.select_one('.Price.Price--md.Price--gray.Price--label')
+        if price:
+            price = int(re.sub(r'[^0-9]', '', price.get_text(strip=True)))
+
+        # Добавляем информацию о продукте в список
+        products.append({
+            "name": name,
+            "link": link,
+            "quantity": quantity,
+            "price": price
+        })
     return products
 
 
+class PageCache:
+    """
+    Страницы каталога, сохранённые с прошлого обновления, для инкрементального режима.
+
+    Для каждой страницы хранятся ETag/Last-Modified, хэш содержимого и уже разобранные товары.
+    Страница запрашивается условным запросом; при ответе 304 или неизменном содержимом товары
+    берутся из сохранённого состояния без разбора HTML.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pages = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.pages = json.load(f)
+        self.new_pages = {}
+        self.stats = {"not_modified": 0, "unchanged": 0, "parsed": 0}
+        self._lock = threading.Lock()
+
+    def fetch(self, page_url, fetcher, base_url=BASE_URL):
+        entry = self.pages.get(page_url)
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = fetcher.get(page_url, headers=headers)
+        if entry and response.status_code == 304:
+            status = "not_modified"
+        else:
+            content_hash = hashlib.sha256(response.content).hexdigest()
+            if entry and entry["hash"] == content_hash:
+                status = "unchanged"
+            else:
+                status = "parsed"
+                soup = BeautifulSoup(response.text, 'html.parser')
+                entry = {
+                    "products": parse_products_from_soup(soup, base_url),
+                    "total_pages": get_total_pages_from_soup(soup)
+                }
+            entry = {
+                **entry,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "hash": content_hash
+            }
+
+        with self._lock:
+            self.new_pages[page_url] = entry
+            self.stats[status] += 1
+        return entry["products"], entry["total_pages"]
+
+    def restore(self, category_url):
+        """
+        Возвращает состояние страниц категории к прошлому обновлению.
+
+        Вызывается, если категорию не удалось загрузить целиком: её товары остаются прежними,
+        и состояние страниц должно соответствовать им, а не частично загруженным страницам.
+        """
+        prefix = f"{category_url}?"
+        with self._lock:
+            for page_url in [url for url in self.new_pages if url.startswith(prefix)]:
+                del self.new_pages[page_url]
+            for page_url, entry in self.pages.items():
+                if page_url.startswith(prefix):
+                    self.new_pages[page_url] = entry
+
+    def save(self):
+        # Страницы, которых в этот раз не было в каталоге, в состояние не попадают
+        write_json_atomic(self.new_pages, self.path, separators=(",", ":"))
+
+
+# Товары и количество страниц для одной страницы категории
+def parse_page(page_url, fetcher, base_url=BASE_URL, page_cache=None):
+    if page_cache is not None:
+        return page_cache.fetch(page_url, fetcher, base_url)
+
+    response = fetcher.get(page_url)
+    soup = BeautifulSoup(response.text, 'html.parser')
+    return parse_products_from_soup(soup, base_url), get_total_pages_from_soup(soup)
+
+
+# Функция для парсинга продуктов на странице категории
+def parse_products_in_category(category_url, fetcher=None, base_url=BASE_URL, page_cache=None):
+    fetcher = fetcher or Fetcher()
+
+    # Количество страниц берём из первой страницы, без отдельного запроса
+    products, total_pages = parse_page(f"{category_url}?PAGEN_1=1", fetcher, base_url, page_cache)
+    products = list(products)
+
+    # Остальные страницы категории загружаем параллельно, сохраняя их порядок
+    page_urls = [f"{category_url}?PAGEN_1={page}" for page in range(2, total_pages + 1)]
+    with ThreadPoolExecutor(max_workers=fetcher.max_concurrency) as pool:
+        for page_products, _ in pool.map(lambda page_url: parse_page(page_url, fetcher, base_url, page_cache),
+                                         page_urls):
+            products.extend(page_products)
+    return products
+
+
+def product_key(product):
+    return product.get("link"), product.get("name")
+
+
+def diff_catalogs(old_data, new_data):
+    """
+    Сравнивает два снимка базы и возвращает добавленные, удалённые и подешевевшие/подорожавшие товары.
+    """
+    old_products = {product_key(product): product for products in old_data.values() for product in products}
+    new_products = {product_key(product): product for products in new_data.values() for product in products}
+
+    repriced = []
+    for key in old_products.keys() & new_products.keys():
+        old_price, new_price = old_products[key].get("price"), new_products[key].get("price")
+        if old_price != new_price:
+            repriced.append({"name": key[1], "link": key[0], "old_price": old_price, "new_price": new_price})
+
+    return {
+        "added": [product for key, product in new_products.items() if key not in old_products],
+        "removed": [product for key, product in old_products.items() if key not in new_products],
+        "repriced": sorted(repriced, key=lambda item: (item["link"] or "", item["name"] or ""))
+    }
+
+
 # Основная функция для парсинга всех категорий и записи в JSON
 good_category = {
     "Овощи, фрукты, ягоды, зелень",
@@ -100,24 +300,97 @@ good_category = {
 }
 
 
-def parse_product_from_vv():
-    categories = get_categories()
+def parse_product_from_vv(path=BD_path, base_url=BASE_URL, incremental=PARSER_INCREMENTAL):
+    """
+    Парсит каталог и сохраняет его в path.
+
+    В инкрементальном режиме неизменившиеся страницы не разбираются заново (состояние страниц хранится
+    в path + ".state.json"), рядом с базой записывается список изменений path + ".changes.json",
+    а если каталог не изменился, файл базы не перезаписывается (отсутствующий бинарный снимок при этом
+    всё равно создаётся).
+
+    :return: Изменения каталога в инкрементальном режиме, иначе None.
+    """
+    old_data = {}
+    page_cache = None
+    if incremental:
+        page_cache = PageCache(path + ".state.json")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                old_data = json.load(f)
+
+    fetcher = Fetcher()
+    categories = [category for category in get_categories(fetcher, base_url) if category["name"] in good_category]
     data = {}
 
-    for category in categories:
-        if category["name"] not in good_category:
-            continue
-        print(f"Парсим категорию: {category['name']}", end='... ')
-        try:
-            products = parse_products_in_category(category["url"])
-            data[category['name']] = products
-            print(f"обработано {len(products)} продуктов")
-        except:
-            print("Не получилось обработать")
+    # Категории обрабатываются параллельно; общий fetcher ограничивает нагрузку на сайт
+    with ThreadPoolExecutor(max_workers=fetcher.max_concurrency) as pool:
+        futures = [pool.submit(parse_products_in_category, category["url"], fetcher, base_url, page_cache)
+                   for category in categories]
+
+        for category, future in zip(categories, futures):
+            print(f"Парсим категорию: {category['name']}", end='... ')
+            try:
+                products = future.result()
+                data[category['name']] = products
+                print(f"обработано {len(products)} продуктов")
+            except Exception as e:
+                print(f"Не получилось обработать: {e}")
+                # Категорию, которую не удалось обновить, оставляем такой, как была
+                if category['name'] in old_data:
+                    data[category['name']] = old_data[category['name']]
+                if page_cache is not None:
+                    page_cache.restore(category["url"])
+    fetcher.close()
+
+    if not incremental:
+        save_catalog(data, path)
+        return None
+
+    changes = diff_catalogs(old_data, data)
+    if data == old_data:
+        print(f"Каталог не изменился, {path} не перезаписывается")
+        # База могла остаться от версии без бинарного снимка: без него бот читал бы медленный JSON
+        if not os.path.exists(binary_path(path)):
+            write_binary_catalog(ProductTable(data), binary_path(path))
+    else:
+        save_catalog(data, path)
+
+    # Состояние страниц сохраняется только после базы, чтобы оно не опережало записанный файл
+    write_json_atomic(changes, path + ".changes.json", separators=(",", ":"))
+    page_cache.save()
+    print(f"Страниц без изменений: {page_cache.stats['not_modified'] + page_cache.stats['unchanged']}, "
+          f"разобрано заново: {page_cache.stats['parsed']}. Добавлено товаров: {len(changes['added'])}, "
+          f"удалено: {len(changes['removed'])}, изменилась цена: {len(changes['repriced'])}")
+    return changes
+
+
+def write_json_atomic(data, path, **dump_kwargs):
+    """
+    Записывает JSON во временный файл в том же каталоге и подменяет path переименованием.
+
+    Читатели видят либо старый файл, либо новый целиком, но никогда не наполовину записанный.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, **dump_kwargs)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_catalog(data, path):
+    # JSON остаётся для отладки, бот читает колонки из бинарного снимка рядом с ним.
+    # Снимок пишется после JSON: он должен быть не старше JSON, иначе каталог выберет JSON
+    write_json_atomic(data, path, indent=4)
+    write_binary_catalog(ProductTable(data), binary_path(path))
 
-    with open(BD_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    print(f"Все продукты сохранены во {path}")
 
-    print(f"Все продукты сохранены во {BD_path}")
 
-parse_product_from_vv()
\ No newline at end of file
+if __name__ == "__main__":
+    parse_product_from_vv()
@@ -1,11 +1,37 @@
-from apscheduler.schedulers.blocking import BlockingScheduler
-from config import UPDATE_BD_TIME
+import asyncio
+import datetime
+import logging
+
+from telegram.ext import Application, ContextTypes
+
+from config import BD_path, UPDATE_BD_TIME
+from parser.catalog import get_catalog
 from parser.parse_bd import parse_product_from_vv
 
+logger = logging.getLogger(__name__)
+
+
+async def update_bd(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Ночное обновление базы продуктов внутри цикла событий бота.
+
+    Парсинг идёт в отдельном потоке, поэтому обработка сообщений не останавливается. Файлы базы
+    подменяются атомарно, после чего каталог в памяти перечитывается и новые запросы видят обновлённые цены.
+    """
+    try:
+        await asyncio.to_thread(parse_product_from_vv, BD_path)
+    except Exception:
+        logger.exception("Не удалось обновить базу продуктов")
+        return
+    await asyncio.to_thread(get_catalog(BD_path).reload)
 
-def auto_update_bd():
-    scheduler = BlockingScheduler()
 
-    # Планируем задачу
-    scheduler.add_job(parse_product_from_vv, 'cron', hour=UPDATE_BD_TIME[0], minute=UPDATE_BD_TIME[1])
-    scheduler.start()
+def schedule_bd_update(application: Application) -> None:
+    """Планирует ежедневное обновление базы в JobQueue бота на время UPDATE_BD_TIME (местное время)."""
+    local_timezone = datetime.datetime.now().astimezone().tzinfo
+    application.job_queue.run_daily(
+        update_bd,
+        time=datetime.time(hour=UPDATE_BD_TIME[0], minute=UPDATE_BD_TIME[1], tzinfo=local_timezone),
+        name="update_bd",
+        job_kwargs={"max_instances": 1, "coalesce": True}
+    )
@@ -0,0 +1,189 @@
+import re
+import threading
+
+# Числительные словами во всех падежах, которые встречаются после «на» и «для»
+_NUMBER_WORDS = {
+    "один": 1, "одна": 1, "одну": 1, "одного": 1, "одной": 1, "одному": 1,
+    "два": 2, "две": 2, "двух": 2, "двум": 2, "три": 3, "трех": 3, "трем": 3,
+    "четыре": 4, "четырех": 4, "четырем": 4, "восемь": 8, "восьми": 8, "сорок": 40, "сорока": 40,
+    "пятьдесят": 50, "пятидесяти": 50,
+}
+for _value, _word in enumerate(("пять", "шесть", "семь", None, "девять", "десять", "одиннадцать", "двенадцать",
+                                "тринадцать", "четырнадцать", "пятнадцать", "шестнадцать", "семнадцать",
+                                "восемнадцать", "девятнадцать", "двадцать"), start=5):
+    if _word is not None:
+        _NUMBER_WORDS[_word] = _NUMBER_WORDS[_word[:-1] + "и"] = _value
+_NUMBER_WORDS.update({"тридцать": 30, "тридцати": 30})
+
+# Собирательные числительные («на двоих», «для троих») означают количество человек
+_COLLECTIVE = {
+    "двое": 2, "двоих": 2, "трое": 3, "троих": 3, "четверо": 4, "четверых": 4, "пятеро": 5, "пятерых": 5,
+    "шестеро": 6, "шестерых": 6, "семеро": 7, "семерых": 7, "восьмеро": 8, "восьмерых": 8, "девятеро": 9,
+    "девятерых": 9, "десятеро": 10, "десятерых": 10,
+}
+
+# Единицы количества: порции, едоки и длительность в днях (одна порция на день)
+_PORTION_UNITS = ("порци",)
+_PEOPLE_UNITS = ("человек", "чел", "персон", "гост", "едок")
+_DAY_WORDS = {"день", "дня", "дней", "дню", "денек", "денька", "сутки", "суток"}
+_DURATION_UNITS = {"недел": 7, "месяц": 30}
+
+# Неопределённые количества едоков: «для семьи», «на компанию», «для детей» — их оценивает модель
+_VAGUE_PEOPLE = ("семь", "семей", "компани", "дет", "ребят", "друз")
+
+# Слова без количества, которые могут стоять между числом и единицей: «на всю неделю», «2 полных дня»
+_FILLERS = {"всю", "весь", "все", "целую", "целый", "целые", "полных", "полные", "больших", "большие", "небольших"}
+
+_TOKEN_PATTERN = re.compile(r"\d+(?:[.,]\d+)?|[a-zа-я]+")
+
+
+def _is_money(word):
+    # Суммы денег не относятся к количеству порций: «на 1000 рублей на неделю», «на 2 тыс»
+    return word.startswith(("руб", "тыс")) or word in ("р", "к", "k")
+
+
+def _word_number(tokens, i):
+    """Числительное словами с позиции i («двадцать пять» — два слова): (значение, позиция после него)."""
+    value = _NUMBER_WORDS.get(tokens[i])
+    if value is None:
+        return None, i
+    if value >= 20 and value % 10 == 0 and i + 1 < len(tokens):
+        units = _NUMBER_WORDS.get(tokens[i + 1])
+        if units is not None and units < 10:
+            return value + units, i + 2
+    return value, i + 1
+
+
+def _number(tokens, i):
+    """Число цифрами или словами с позиции i: (значение, позиция после него) или (None, i)."""
+    token = tokens[i]
+    if token[0].isdigit():
+        if "." in token or "," in token:
+            return float(token.replace(",", ".")), i + 1
+        # «4-х порций», «2х недель»: окончание после цифр пропускается
+        j = i + 1
+        if j < len(tokens) and tokens[j] in ("х", "x", "ти", "ми", "ух", "ех", "ох"):
+            j += 1
+        return int(token), j
+    if token in ("пару", "пара", "пары"):
+        return 2, i + 1
+    if token in ("полтора", "полторы"):
+        return 1.5, i + 1
+    return _word_number(tokens, i)
+
+
+def _unit(word):
+    """Вид единицы («portions», «people», «days») и множитель или (None, 0)."""
+    if word.startswith(_PORTION_UNITS):
+        return "portions", 1
+    if word.startswith(_PEOPLE_UNITS):
+        return "people", 1
+    if word in _DAY_WORDS:
+        return "days", 1
+    for stem, days in _DURATION_UNITS.items():
+        if word.startswith(stem):
+            return "days", days
+    return None, 0
+
+
+def _skip_fillers(tokens, j):
+    while j < len(tokens) and tokens[j] in _FILLERS:
+        j += 1
+    return j
+
+
+def parse_portions(text: str):
+    """
+    Определяет количество порций из сообщения без обращения к модели.
+
+    Понимает числа цифрами и словами («4 порции», «на шесть человек», «на двоих») и длительность
+    («на неделю» — 7 порций, «на 2 недели» — 14, «на месяц» — 30, одна порция на день). Едоки и длительность
+    перемножаются: «на двоих на 3 дня» — 6 порций.
+
+    Если в сообщении нет ни чисел, ни слов о количестве («борщ»), нужна одна порция.
+
+    Возвращает None, если запрос неоднозначен: несколько разных количеств, порции вместе с длительностью,
+    дробный результат, число без единицы измерения («борщ на 4»), количество в других единицах («на 2 литра»)
+    или едоки без числа («для семьи»). В этих случаях количество порций определяет модель.
+    """
+    tokens = _TOKEN_PATTERN.findall(text.lower().replace("ё", "е"))
+    found = {"portions": set(), "people": set(), "days": set()}
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in _COLLECTIVE:
+            found["people"].add(_COLLECTIVE[token])
+            i += 1
+            continue
+
+        value, j = _number(tokens, i)
+        if value is not None:
+            j = _skip_fillers(tokens, j)
+            kind, factor = _unit(tokens[j]) if j < len(tokens) else (None, 0)
+            if kind is not None:
+                found[kind].add(value * factor)
+                i = j + 1
+                continue
+            if j < len(tokens) and _is_money(tokens[j]):
+                i = j + 1
+                continue
+            # Число без понятной единицы: количество порций определит модель
+            return None
+
+        # Единица без числа: «на неделю», «на всю неделю», «на день»
+        if token in ("на", "в"):
+            j = _skip_fillers(tokens, i + 1)
+            kind, factor = _unit(tokens[j]) if j < len(tokens) else (None, 0)
+            if kind == "days":
+                found["days"].add(factor)
+                i = j + 1
+                continue
+        i += 1
+
+    if any(len(values) > 1 for values in found.values()):
+        return None
+    portions, people, days = (next(iter(found[kind]), None) for kind in ("portions", "people", "days"))
+    if portions is not None and (people is not None or days is not None):
+        return None
+    if portions is not None:
+        result = portions
+    elif people is not None or days is not None:
+        result = (people or 1) * (days or 1)
+    elif any(_unit(token)[0] is not None or token.startswith(_VAGUE_PEOPLE) for token in tokens):
+        # Единица без числа («борщ порциями», «суп дня») или неопределённые едоки
+        return None
+    else:
+        return 1
+    if result != int(result) or result <= 0:
+        return None
+    return int(result)
+
+
+class PortionStats:
+    """Счётчики запросов количества порций: сколько определено без модели и сколько передано модели."""
+
+    def __init__(self):
+        self.local = 0
+        self.model = 0
+        self._lock = threading.Lock()
+
+    def count(self, local: bool):
+        with self._lock:
+            if local:
+                self.local += 1
+            else:
+                self.model += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.local + self.model
+            return {"local": self.local, "model": self.model,
+                    "local_fraction": round(self.local / total, 4) if total else 0.0}
+
+    def clear(self):
+        with self._lock:
+            self.local = self.model = 0
+
+
+# Общие для процесса счётчики
+portion_stats = PortionStats()
@@ -0,0 +1,359 @@
+"""
+Воспроизводимые замеры подбора продуктов и всего конвейера бота.
+
+Запуск из корня репозитория:
+
+    python -m tests.benchmarks.bench --output benchmark_results.json
+    python -m tests.benchmarks.bench --gpt-latency 0.5 --compare old_results.json
+    python -m tests.benchmarks.bench --http --concurrency 200 --gpt-latency 1.0
+
+Замеряются загрузка каталога из JSON и из бинарного снимка (время и пиковая память), время get_links_from_list
+на корпусе блюд из corpus.json при пустом и заполненном кэше кандидатов, match_many на всём корпусе, поиск
+кандидатов по размеченной выборке ингредиентов (tests/fixtures/ingredients_recall.json) и полный
+путь process_shopping/process_recipe с подменённым клиентом OpenAI (fake_openai) или через локальный сервер
+openai_server с заданной задержкой ответа модели и числом одновременных чатов.
+Результаты пишутся в JSON-файл, который можно сравнить с результатами другой версии через --compare.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import ExitStack
+from types import SimpleNamespace
+from unittest import mock
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(os.path.dirname(BENCHMARKS_DIR))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import config  # noqa: E402
+import tracing  # noqa: E402
+from parser.catalog import Catalog, get_catalog  # noqa: E402
+from parser.catalog_binary import binary_path, write_binary_catalog  # noqa: E402
+from parser.match_product import candidate_cache, get_links_from_list, get_selection_engine, match_many  # noqa: E402
+
+try:
+    from tests.benchmarks.fake_openai import CorpusResponder, FakeOpenAI
+    from tests.benchmarks.openai_server import OpenAIStandIn
+except ImportError:
+    from fake_openai import CorpusResponder, FakeOpenAI
+    from openai_server import OpenAIStandIn
+
+CATALOG_PATH = os.path.join(ROOT, "vkusvill_products.json")
+CORPUS_PATH = os.path.join(BENCHMARKS_DIR, "corpus.json")
+LOOKUP_SAMPLE_PATH = os.path.join(BENCHMARKS_DIR, "..", "fixtures", "ingredients_recall.json")
+
+# Версия формата файла результатов: увеличивается при изменении его структуры
+RESULTS_VERSION = 1
+
+
+def load_corpus(path=CORPUS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def corpus_carts(corpus):
+    """Ингредиенты блюд корпуса на все порции, как их возвращает get_ingredients_list."""
+    return [{name: [amount[0] * item["portions"], amount[1]] for name, amount in item["ingredients"].items()}
+            for item in corpus]
+
+
+def timings(seconds):
+    """Сводка замеров: число прогонов, среднее и p50/p95/p99 в миллисекундах."""
+    values = [value * 1000 for value in seconds]
+    return {
+        "runs": len(values),
+        "mean_ms": round(sum(values) / len(values), 3),
+        "p50_ms": round(tracing.percentile(values, 50), 3),
+        "p95_ms": round(tracing.percentile(values, 95), 3),
+        "p99_ms": round(tracing.percentile(values, 99), 3)
+    }
+
+
+def measure(func, repeat):
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - started)
+    return seconds
+
+
+def peak_memory(func):
+    """Пиковый объём памяти, выделенной Python при вызове func, в мегабайтах."""
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 2 ** 20, 2)
+
+
+def bench_catalog(json_path, repeat):
+    """Загрузка каталога: из JSON (с построением индекса) и из бинарного снимка."""
+    bin_path = binary_path(json_path)
+    if os.path.exists(bin_path):
+        os.remove(bin_path)
+
+    def load():
+        return Catalog(json_path).reload()
+
+    results = {"json": {**timings(measure(load, repeat)), "peak_mb": peak_memory(load)}}
+
+    write_binary_catalog(load().table, bin_path)
+    results["binary"] = {**timings(measure(load, repeat)), "peak_mb": peak_memory(load)}
+    results["products"] = len(load())
+    return results
+
+
+def bench_matching(json_path, carts, repeat):
+    """Подбор товаров для корзин корпуса: первый проход с пустым кэшем кандидатов и повторные проходы с кэшем."""
+    snapshot = get_catalog(json_path).reload()
+
+    def run_carts(seconds):
+        for cart in carts:
+            started = time.perf_counter()
+            get_links_from_list(cart, json_path)
+            seconds.append(time.perf_counter() - started)
+
+    cold = []
+    for _ in range(repeat):
+        candidate_cache.clear()
+        get_selection_engine.cache_clear()
+        run_carts(cold)
+
+    warm = []
+    for _ in range(repeat):
+        run_carts(warm)
+
+    ingredients = sum(len(cart) for cart in carts)
+    batched = measure(lambda: match_many(carts, snapshot.index), repeat)
+    return {
+        "carts": len(carts),
+        "ingredients": ingredients,
+        "cold": timings(cold),
+        "warm": timings(warm),
+        "warm_per_ingredient_ms": round(sum(warm) * 1000 / (ingredients * repeat), 4),
+        "match_many": timings(batched),
+        "cache": candidate_cache.stats()
+    }
+
+
+def bench_lookup(json_path, repeat, sample_path=LOOKUP_SAMPLE_PATH):
+    """Поиск кандидатов ProductIndex.find по размеченной выборке ингредиентов (той же, что в тесте полноты)."""
+    index = get_catalog(json_path).reload().index
+    with open(sample_path, encoding="utf-8") as f:
+        ingredients = [item["ingredient"] for item in json.load(f)]
+
+    seconds = measure(lambda: [index.find(ingredient) for ingredient in ingredients], repeat)
+    return {
+        "ingredients": len(ingredients),
+        **timings(seconds),
+        "per_ingredient_ms": round(sum(seconds) * 1000 / (len(ingredients) * repeat), 4)
+    }
+
+
+class FakeMessage:
+    """Сообщение Telegram: запоминает отправленные ответы и последнюю правку."""
+
+    def __init__(self, text=""):
+        self.text = text
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        reply = FakeMessage(text)
+        self.replies.append(reply)
+        return reply
+
+    async def edit_text(self, text, **kwargs):
+        self.text = text
+
+
+def fake_update(chat_id, text):
+    return SimpleNamespace(message=FakeMessage(text), callback_query=None,
+                           effective_chat=SimpleNamespace(id=chat_id))
+
+
+async def run_pipeline(corpus, repeat, concurrency):
+    """Обрабатывает каждое сообщение корпуса в режимах корзины и рецепта, не более concurrency чатов одновременно."""
+    from bot.handlers.handle_recipe import process_recipe
+    from bot.handlers.handle_shopping import process_shopping
+
+    semaphore = asyncio.Semaphore(concurrency)
+    seconds = {"shopping": [], "recipe": []}
+
+    async def run_one(chat_id, kind, text):
+        async with semaphore:
+            update = fake_update(chat_id, text)
+            context = SimpleNamespace(user_data={})
+            started = time.perf_counter()
+            with tracing.trace_request(chat_id, state=kind):
+                if kind == "shopping":
+                    await process_shopping(update, context, chat_id, text)
+                else:
+                    await process_recipe(update, context, text, chat_id)
+            seconds[kind].append(time.perf_counter() - started)
+
+    jobs = [(run * len(corpus) + i + 1, kind, item["message"])
+            for run in range(repeat) for i, item in enumerate(corpus) for kind in ("shopping", "recipe")]
+    started = time.perf_counter()
+    await asyncio.gather(*(run_one(*job) for job in jobs))
+    return seconds, time.perf_counter() - started
+
+
+def bench_pipeline(json_path, corpus, repeat, latency, chunk_latency, workdir, concurrency=1, http=False):
+    """
+    Полный путь обработки сообщения в режимах корзины и рецепта.
+
+    Модель заменяется клиентом fake_openai внутри процесса или, при http=True, локальным сервером openai_server,
+    к которому обращается настоящий клиент OpenAI (с пулом соединений и повторами).
+    """
+    from bot.states.storage import close_storage
+    from gpt_request import close_gpt_clients
+    from portions import portion_stats
+
+    trace_path = os.path.join(workdir, "traces.jsonl")
+    with ExitStack() as stack:
+        if http:
+            server = stack.enter_context(OpenAIStandIn(responder=CorpusResponder(corpus), latency=latency,
+                                                       chunk_latency=chunk_latency))
+            stack.enter_context(mock.patch.object(config, "OPENAI_BASE_URL", server.base_url))
+            stack.enter_context(mock.patch.object(config, "HTTPS_PROXY_IPPORT", ""))
+            stack.enter_context(mock.patch.object(config, "OPENAI_API_KEY", config.OPENAI_API_KEY or "bench"))
+            stack.callback(close_gpt_clients)
+            close_gpt_clients()
+        else:
+            client = FakeOpenAI(corpus, latency, chunk_latency)
+            stack.enter_context(mock.patch("gpt_request.get_gpt_client", return_value=client))
+        for name, value in (("GPT_CACHE_PATH", ""), ("BOT_STORAGE_PATH", ""), ("TRACE_PATH", trace_path)):
+            stack.enter_context(mock.patch.object(config, name, value))
+        stack.enter_context(mock.patch("bot.handlers.handle_shopping.BD_path", json_path))
+        stack.enter_context(mock.patch("bot.handlers.handle_recipe.BD_path", json_path))
+        portion_stats.clear()
+        try:
+            seconds, elapsed = asyncio.run(run_pipeline(corpus, repeat, concurrency))
+        finally:
+            tracing.close_exporter()
+            close_storage()
+        gpt_calls = server.stats()["requests"] if http else client.completions.calls
+
+    stages = tracing.summarize(tracing.load_records(trace_path))["stages"]
+    results = {
+        "transport": "http" if http else "in-process",
+        "concurrency": concurrency,
+        "gpt_latency_s": latency,
+        "gpt_chunk_latency_s": chunk_latency,
+        "gpt_calls": gpt_calls,
+        "portions": portion_stats.stats(),
+        "messages_per_s": round((len(seconds["shopping"]) + len(seconds["recipe"])) / elapsed, 2),
+        "shopping": timings(seconds["shopping"]),
+        "recipe": timings(seconds["recipe"]),
+        "stages": {name: {key: stage[key] for key in ("count", "p50", "p95", "p99")}
+                   for name, stage in sorted(stages.items())}
+    }
+    if http:
+        results["connections"] = server.stats()["connections"]
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(repeat=5, gpt_latency=0.0, gpt_chunk_latency=0.0, catalog_path=CATALOG_PATH,
+                   corpus_path=CORPUS_PATH, concurrency=1, http=False):
+    """Выполняет все замеры и возвращает результаты в виде словаря для записи в JSON."""
+    corpus = load_corpus(corpus_path)
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    try:
+        # Каталог копируется во временный каталог, чтобы лежащий рядом бинарный снимок не влиял на замеры
+        json_path = os.path.join(workdir, "products.json")
+        shutil.copyfile(catalog_path, json_path)
+
+        return {
+            "version": RESULTS_VERSION,
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "repeat": repeat
+            },
+            "catalog": bench_catalog(json_path, repeat),
+            "matching": bench_matching(json_path, corpus_carts(corpus), repeat),
+            "lookup": bench_lookup(json_path, repeat),
+            "pipeline": bench_pipeline(json_path, corpus, repeat, gpt_latency, gpt_chunk_latency, workdir,
+                                       concurrency, http),
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def flatten(results, prefix=""):
+    """Числовые показатели результатов в виде {"matching.warm.p50_ms": 0.4, ...}."""
+    values = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+
+def compare(baseline, results):
+    """Изменение показателей времени и памяти относительно baseline: {показатель: (было, стало, отношение)}."""
+    old, new = flatten(baseline), flatten(results)
+    changes = {}
+    for name, value in new.items():
+        if not name.endswith(("_ms", "_mb")) or name not in old:
+            continue
+        changes[name] = (old[name], value, value / old[name] if old[name] else None)
+    return changes
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arguments.add_argument("--output", default="benchmark_results.json", help="файл для результатов")
+    arguments.add_argument("--repeat", type=int, default=5, help="число прогонов каждого замера")
+    arguments.add_argument("--gpt-latency", type=float, default=0.0, help="задержка ответа модели, секунды")
+    arguments.add_argument("--gpt-chunk-latency", type=float, default=0.0,
+                           help="задержка между фрагментами потоковой инструкции, секунды")
+    arguments.add_argument("--catalog", default=CATALOG_PATH, help="JSON-файл базы продуктов")
+    arguments.add_argument("--concurrency", type=int, default=1, help="сколько чатов обрабатывается одновременно")
+    arguments.add_argument("--http", action="store_true",
+                           help="обращаться к модели через локальный сервер openai_server настоящим клиентом")
+    arguments.add_argument("--compare", help="файл результатов другой версии для сравнения")
+    args = arguments.parse_args()
+
+    results = run_benchmarks(args.repeat, args.gpt_latency, args.gpt_chunk_latency, args.catalog,
+                             concurrency=args.concurrency, http=args.http)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=4)
+    print(f"Результаты записаны в {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        for name, (old, new, ratio) in sorted(compare(baseline, results).items()):
+            change = f"{ratio:.2f}x" if ratio is not None else "—"
+            print(f"{name:<48}{old:>12}{new:>12}{change:>9}")
+
+
+if __name__ == "__main__":
+    main()
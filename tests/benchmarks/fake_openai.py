@@ -0,0 +1,83 @@
+import json
+import time
+from types import SimpleNamespace
+
+
+class CorpusResponder:
+    """
+    Ответы модели по корпусу блюд: по тексту сообщения пользователя находится записанное блюдо.
+
+    Запрос с response_format получает JSON с блюдом, порциями и ингредиентами на порцию, запрос ингредиентов
+    в старом формате — JSON {блюдо: ингредиенты}, запрос числа порций — число, остальные запросы (инструкция) —
+    текст из steps шагов.
+    """
+
+    def __init__(self, corpus, steps=20):
+        self.recipes = {item["message"]: item for item in corpus}
+        self.steps = steps
+
+    def __call__(self, messages, response_format=None):
+        recipe = self.recipes.get(messages[1]["content"]) if len(messages) > 1 else None
+        if recipe is None:
+            return "".join(f"{i + 1}. Шаг приготовления.\n" for i in range(self.steps))
+        if isinstance(response_format, dict):
+            return json.dumps({"dish": recipe["dish"], "portions": recipe["portions"],
+                               "ingredients": recipe["ingredients"]}, ensure_ascii=False)
+        if "JSON" in messages[0]["content"]:
+            return json.dumps({recipe["dish"]: recipe["ingredients"]}, ensure_ascii=False)
+        return str(recipe["portions"])
+
+
+class FakeCompletions:
+    """
+    Заменяет client.chat.completions: отвечает по корпусу (CorpusResponder) с заданной задержкой.
+
+    Потоковый ответ отдаётся по строкам с задержкой chunk_latency между ними.
+    """
+
+    def __init__(self, corpus, latency=0.0, chunk_latency=0.0):
+        self.responder = CorpusResponder(corpus)
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.calls = 0
+
+    def create(self, model, messages, stream=False, response_format=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        content = self.responder(messages, response_format)
+        if stream:
+            return FakeStream(self._stream(content))
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=len(messages[0]["content"]) // 4,
+                                  completion_tokens=len(content) // 4)
+        )
+
+    def _stream(self, content):
+        for line in content.splitlines(keepends=True):
+            time.sleep(self.chunk_latency)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=line))])
+
+
+class FakeStream:
+    """Поток фрагментов с методом close, как у openai.Stream."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    def __iter__(self):
+        return self._chunks
+
+    def close(self):
+        self._chunks.close()
+
+
+class FakeOpenAI:
+    """Минимальный клиент с интерфейсом OpenAI для прогона конвейера бота без сети."""
+
+    def __init__(self, corpus, latency=0.0, chunk_latency=0.0):
+        self.completions = FakeCompletions(corpus, latency, chunk_latency)
+        self.chat = SimpleNamespace(completions=self.completions)
+
+    def close(self):
+        pass
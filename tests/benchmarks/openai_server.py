@@ -0,0 +1,325 @@
+"""
+Локальный сервер с API chat completions OpenAI для нагрузочных тестов без доступа к сети.
+
+Отвечает записанными ответами по хэшу сообщений запроса (обычными и потоковыми), умеет записывать ответы
+настоящего API и добавлять задержку, ошибки и испорченные ответы модели. Бот направляется на сервер
+настройкой config.OPENAI_BASE_URL.
+
+    python -m tests.benchmarks.openai_server --recordings recordings.json --latency 0.5 --error-rate 0.05
+    python -m tests.benchmarks.openai_server --recordings recordings.json --record https://api.openai.com/v1
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+import config
+
+# Версия формата файла записанных ответов
+RECORDINGS_VERSION = 1
+
+_WORD_PATTERN = re.compile(r"\S+\s*|\s+")
+
+
+def prompt_key(messages):
+    """Ключ записанного ответа: хэш сообщений запроса."""
+    raw = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def split_chunks(content, chunks):
+    """Делит ответ не более чем на chunks фрагментов по границам слов для потоковой выдачи."""
+    words = _WORD_PATTERN.findall(content)
+    size = max(1, -(-len(words) // chunks))
+    return ["".join(words[i:i + size]) for i in range(0, len(words), size)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.stand_in.count("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.server.stand_in.stats())
+        else:
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+        try:
+            request = json.loads(body)
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "Invalid JSON body", "type": "invalid_request_error"}})
+            return
+        self.server.stand_in.handle(self, request)
+
+    def _send_json(self, status, data):
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_events(self, events, chunk_latency):
+        # Потоковый ответ — server-sent events в chunked-кодировании, чтобы соединение оставалось открытым
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, event in enumerate(events):
+            if i:
+                time.sleep(chunk_latency)
+            data = f"data: {event}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Очередь соединений рассчитана на сотни одновременных клиентов
+    request_queue_size = 1024
+
+
+class OpenAIStandIn:
+    """
+    Сервер chat completions на локальном порту.
+
+    Ответ на запрос ищется среди записанных по prompt_key; если его нет, он запрашивается у record_url
+    (и записывается) или формируется функцией responder(messages, response_format). Если ответа нет совсем,
+    сервер возвращает 404.
+
+    :param latency: Задержка перед ответом в секундах; jitter — случайная добавка к ней от 0 до jitter.
+    :param chunk_latency: Задержка между фрагментами потокового ответа.
+    :param error_rate: Доля запросов, на которые возвращается ошибка с кодом error_status.
+    :param malformed_rate: Доля ответов модели, которые портятся (обрезаются и предваряются пояснением),
+        чтобы проверить повторные запросы при некорректном формате.
+    """
+
+    def __init__(self, recordings_path=None, responder=None, record_url=None, api_key="", latency=0.0, jitter=0.0,
+                 chunk_latency=0.0, chunks=20, error_rate=0.0, error_status=500, malformed_rate=0.0, seed=0,
+                 host="127.0.0.1", port=0):
+        self.recordings_path = recordings_path
+        self.responder = responder
+        self.record_url = record_url.rstrip("/") if record_url else None
+        self.api_key = api_key
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_latency = chunk_latency
+        self.chunks = chunks
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.malformed_rate = malformed_rate
+
+        self.recordings = self._load_recordings()
+        self._recorded = False
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(("connections", "requests", "streams", "replayed", "recorded", "generated",
+                                     "missing", "errors", "malformed"), 0)
+
+        self._server = _Server((host, port), _Handler)
+        self._server.stand_in = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), name="openai-stand-in",
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Останавливает сервер и сохраняет новые записанные ответы."""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        self.save()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _chance(self, rate):
+        with self._lock:
+            return self._random.random() < rate
+
+    # Записанные ответы
+
+    def _load_recordings(self):
+        if not self.recordings_path or not os.path.exists(self.recordings_path):
+            return {}
+        with open(self.recordings_path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != RECORDINGS_VERSION:
+            raise ValueError(f"{self.recordings_path}: неизвестная версия файла записанных ответов")
+        return data["responses"]
+
+    def save(self):
+        if not self.recordings_path or not self._recorded:
+            return
+        with self._lock:
+            data = {"version": RECORDINGS_VERSION, "responses": dict(self.recordings)}
+        tmp_path = self.recordings_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.recordings_path)
+
+    def _record(self, request):
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        response = httpx.post(f"{self.record_url}/chat/completions", json={**request, "stream": False},
+                              headers=headers, timeout=120)
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+    def _content(self, request):
+        messages = request.get("messages", [])
+        key = prompt_key(messages)
+        with self._lock:
+            content = self.recordings.get(key)
+        if content is not None:
+            self.count("replayed")
+            return content
+        if self.record_url:
+            content = self._record(request)
+            with self._lock:
+                self.recordings[key] = content
+                self._recorded = True
+            self.count("recorded")
+            return content
+        if self.responder is not None:
+            self.count("generated")
+            return self.responder(messages, request.get("response_format"))
+        return None
+
+    # Обработка запроса
+
+    def handle(self, handler, request):
+        self.count("requests")
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+
+        if self._chance(self.error_rate):
+            self.count("errors")
+            handler._send_json(self.error_status, {"error": {"message": "Injected error", "type": "server_error"}})
+            return
+
+        try:
+            content = self._content(request)
+        except httpx.HTTPError as e:
+            handler._send_json(502, {"error": {"message": f"Upstream error: {e}", "type": "server_error"}})
+            return
+        if content is None:
+            self.count("missing")
+            handler._send_json(404, {"error": {"message": "No recorded response for this prompt",
+                                               "type": "invalid_request_error"}})
+            return
+
+        if self._chance(self.malformed_rate):
+            self.count("malformed")
+            content = "Вот ответ: " + content[:len(content) // 2]
+
+        model = request.get("model", "gpt-4o")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        if request.get("stream"):
+            self.count("streams")
+            events = [json.dumps({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}]
+            }, ensure_ascii=False) for chunk in split_chunks(content, self.chunks)]
+            events.append(json.dumps({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+            }))
+            events.append("[DONE]")
+            handler._send_events(events, self.chunk_latency)
+            return
+
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in request.get("messages", [])) // 4
+        completion_tokens = len(content) // 4
+        handler._send_json(200, {
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}
+        })
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arguments.add_argument("--host", default="127.0.0.1")
+    arguments.add_argument("--port", type=int, default=8099)
+    arguments.add_argument("--recordings", help="JSON-файл записанных ответов")
+    arguments.add_argument("--record", metavar="URL", help="записывать отсутствующие ответы этого API")
+    arguments.add_argument("--corpus", help="отвечать на отсутствующие запросы по корпусу блюд (corpus.json)")
+    arguments.add_argument("--latency", type=float, default=0.0, help="задержка ответа, секунды")
+    arguments.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, секунды")
+    arguments.add_argument("--chunk-latency", type=float, default=0.0, help="задержка между фрагментами потока")
+    arguments.add_argument("--error-rate", type=float, default=0.0, help="доля запросов с ошибкой")
+    arguments.add_argument("--error-status", type=int, default=500, help="код ответа с ошибкой")
+    arguments.add_argument("--malformed-rate", type=float, default=0.0, help="доля испорченных ответов модели")
+    arguments.add_argument("--seed", type=int, default=0)
+    args = arguments.parse_args()
+
+    responder = None
+    if args.corpus:
+        try:
+            from tests.benchmarks.fake_openai import CorpusResponder
+        except ImportError:
+            from fake_openai import CorpusResponder
+        with open(args.corpus, encoding="utf-8") as f:
+            responder = CorpusResponder(json.load(f))
+
+    stand_in = OpenAIStandIn(args.recordings, responder, args.record, config.OPENAI_API_KEY, args.latency,
+                             args.jitter, args.chunk_latency, error_rate=args.error_rate,
+                             error_status=args.error_status, malformed_rate=args.malformed_rate, seed=args.seed,
+                             host=args.host, port=args.port)
+    print(f"Сервер запущен: OPENAI_BASE_URL = \"{stand_in.base_url}\"")
+    try:
+        stand_in._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stand_in._server.server_close()
+        stand_in.save()
+        print(f"Статистика: {stand_in.stats()}")
+
+
+if __name__ == "__main__":
+    main()
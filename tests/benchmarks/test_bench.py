@@ -0,0 +1,37 @@
+import os
+
+import pytest
+from bench import CATALOG_PATH, compare, load_corpus, run_benchmarks
+
+
+@pytest.fixture(scope="module")
+def results():
+    if not os.path.exists(CATALOG_PATH):
+        pytest.skip("Нет базы продуктов vkusvill_products.json")
+    return run_benchmarks(repeat=1)
+
+
+def test_results_cover_all_stages(results):
+    corpus = load_corpus()
+
+    assert results["catalog"]["products"] > 0
+    assert results["catalog"]["binary"]["runs"] == 1
+    assert results["matching"]["carts"] == len(corpus)
+    assert results["lookup"]["ingredients"] > 0 and results["lookup"]["per_ingredient_ms"] > 0
+    assert results["pipeline"]["shopping"]["runs"] == len(corpus)
+    assert results["pipeline"]["recipe"]["runs"] == len(corpus)
+    # Явные количества порций в корпусе разбираются без модели
+    assert results["pipeline"]["portions"]["local"] > 0
+    # Спаны конвейера попали в результаты
+    assert {"request", "gpt.extract", "match", "format"} <= set(results["pipeline"]["stages"])
+
+
+def test_compare_reports_time_and_memory_changes(results):
+    warm = {"p50_ms": results["matching"]["warm"]["p50_ms"] * 2}
+    slower = {**results, "matching": {**results["matching"], "warm": warm}}
+
+    changes = compare(results, slower)
+
+    assert changes["matching.warm.p50_ms"][2] == pytest.approx(2)
+    assert "catalog.json.peak_mb" in changes
+    assert "matching.carts" not in changes
@@ -0,0 +1,14 @@
+from unittest.mock import patch
+
+import pytest
+
+import tracing
+
+
+# Запись спанов в тестах отключена: иначе тесты дописывают traces.jsonl в текущий каталог.
+# Тесты трассировки включают её сами, указывая файл во временном каталоге
+@pytest.fixture(autouse=True)
+def no_tracing():
+    with patch('config.TRACE_PATH', ''):
+        yield
+    tracing.close_exporter()
@@ -0,0 +1,112 @@
+from unittest import mock
+
+from AI_product_assistant.bot.states.cart import (CartItem, cart_changed, compact_cart, dump_cart, load_cart,
+                                                  resolve_cart, resolve_carts)
+from AI_product_assistant.parser.catalog import CatalogSnapshot, ProductTable
+
+
+def make_snapshot(price):
+    return CatalogSnapshot(ProductTable({"Овощи": [
+        {"name": "Свекла", "link": "https://vkusvill.ru/goods/svekla-101.html", "quantity": "1 кг", "price": price},
+        {"name": "Морковь", "link": "https://vkusvill.ru/goods/morkov-102.html", "quantity": "", "price": 60},
+    ]}))
+
+
+def test_compact_cart_keeps_ids_and_packs():
+    ingredients = {"свекла": [2, "кг"], "соль": [10, "г"]}
+    matched = [{"name": "Свекла", "link": "https://vkusvill.ru/goods/svekla-101.html", "quantity": "1 кг",
+                "price": 50, "packs_needed": 2, "total_price": 100, "cost_per_gram": 0.05}, {}]
+
+    cart = compact_cart(ingredients, matched)
+
+    assert cart == [CartItem("свекла", 101, 2, 50), CartItem("соль")]
+    assert load_cart(dump_cart(cart)) == cart
+
+
+def test_load_cart_without_saved_price():
+    # Корзины, сохранённые до появления цены в позиции
+    assert load_cart([["свекла", 101, 2]]) == [CartItem("свекла", 101, 2, 0)]
+
+
+def test_resolve_cart_uses_current_prices():
+    cart = [CartItem("свекла", 101, 2), CartItem("соль"), CartItem("капуста", 999, 1)]
+
+    ingredients, products = resolve_cart(cart, make_snapshot(70))
+
+    assert ingredients == ["свекла", "соль", "капуста"]
+    assert products[0] == {"name": "Свекла", "link": "https://vkusvill.ru/goods/svekla-101.html",
+                           "quantity": "1 кг", "price": 70, "packs_needed": 2, "total_price": 140}
+    # Ненайденный товар и товар, которого больше нет в каталоге
+    assert products[1:] == [{}, {}]
+
+
+def test_resolve_cart_marks_price_changes():
+    cart = [CartItem("свекла", 101, 2, 50), CartItem("морковь", 102, 1, 60), CartItem("лук", 103, 1, 30)]
+
+    _, products = resolve_cart(cart, make_snapshot(70))
+
+    assert products[0]["old_price"] == 50
+    assert "old_price" not in products[1]
+    assert products[2] == {}
+    assert cart_changed(cart, products)
+    assert not cart_changed(cart[1:2], products[1:2])
+
+
+def test_resolve_carts_looks_up_rows_once():
+    snapshot = make_snapshot(70)
+    carts = [[CartItem("свекла", 101, 1, 70)], [CartItem("морковь", 102, 3, 60), CartItem("соль")], []]
+
+    with mock.patch.object(snapshot, "rows_for_products", wraps=snapshot.rows_for_products) as lookup:
+        resolved = resolve_carts(carts, snapshot)
+
+    lookup.assert_called_once_with([101, 102, 0])
+    assert resolved == [resolve_cart(cart, snapshot) for cart in carts]
+    assert [sum(product["total_price"] for product in products if product) for _, products in resolved] == [70, 180, 0]
+
+
+def test_product_without_id_is_found_by_link():
+    snapshot = CatalogSnapshot(ProductTable({"Специи": [
+        {"name": "Соль морская", "link": "https://vkusvill.ru/goods/sol-morskaya.html", "quantity": "500 г",
+         "price": 90},
+        {"name": "Перец черный", "link": "https://vkusvill.ru/goods/perets-301.html", "quantity": "50 г", "price": 120},
+        {"name": "Соль йодированная", "link": "https://vkusvill.rujavascript:void(0)", "quantity": "1 кг", "price": 40},
+        {"name": "Соль каменная", "link": "https://vkusvill.rujavascript:void(0)", "quantity": "1 кг", "price": 30},
+    ]}))
+    matched = [{"name": "Соль морская", "link": "https://vkusvill.ru/goods/sol-morskaya.html", "quantity": "500 г",
+                "price": 90, "packs_needed": 1}]
+
+    cart = load_cart(dump_cart(compact_cart({"соль": [10, "г"]}, matched)))
+
+    # Номера товара в ссылке нет: ссылка сохраняется, и товар находится по ней, а не показывается ненайденным
+    assert cart == [CartItem("соль", 0, 1, 90, "https://vkusvill.ru/goods/sol-morskaya.html", "Соль морская")]
+    _, products = resolve_cart(cart, snapshot)
+    assert products[0]["name"] == "Соль морская" and products[0]["total_price"] == 90
+    assert not cart_changed(cart, products)
+
+    # Без названия (корзина сохранена до его появления) ссылка-заглушка, общая для нескольких товаров,
+    # товар не определяет
+    stub = CartItem("соль", 0, 1, 40, "https://vkusvill.rujavascript:void(0)")
+    assert resolve_cart([stub], snapshot)[1] == [{}]
+
+    # Если товара с такой ссылкой больше нет, корзина помечается как изменившаяся
+    _, products = resolve_cart(cart, make_snapshot(70))
+    assert products == [{}]
+    assert cart_changed(cart, products)
+
+
+def test_product_with_stub_link_is_found_by_name():
+    stub_link = "https://vkusvill.rujavascript:void(0)"
+    snapshot = CatalogSnapshot(ProductTable({"Вино": [
+        {"name": "Вино красное сухое", "link": stub_link, "quantity": "750 мл", "price": 900},
+        {"name": "Вино белое полусладкое", "link": stub_link, "quantity": "750 мл", "price": 700},
+    ]}))
+    matched = [{"name": "Вино белое полусладкое", "link": stub_link, "quantity": "750 мл", "price": 700,
+                "packs_needed": 1}]
+
+    cart = load_cart(dump_cart(compact_cart({"белое вино": [200, "мл"]}, matched)))
+
+    # У всех товаров без номера общая ссылка-заглушка: товар находится по названию вместе с ней
+    assert cart == [CartItem("белое вино", 0, 1, 700, stub_link, "Вино белое полусладкое")]
+    _, products = resolve_cart(cart, snapshot)
+    assert products[0]["name"] == "Вино белое полусладкое" and products[0]["total_price"] == 700
+    assert not cart_changed(cart, products)
@@ -1,12 +1,28 @@
+import asyncio
+import threading
 import pytest
 from unittest import mock
 from telegram import Update
 from telegram import CallbackQuery
+from telegram.error import BadRequest
 from unittest.mock import MagicMock, AsyncMock
 from AI_product_assistant.bot.handlers.buttons import button
 from AI_product_assistant.bot.handlers.favorites import send_favorites_menu
-from AI_product_assistant.bot.states.user_states import FAVORITES
+from AI_product_assistant.bot.states.cart import CartItem
+from AI_product_assistant.bot.states.storage import BotStorage
+from AI_product_assistant.parser.catalog import CatalogSnapshot, ProductTable
 from AI_product_assistant.bot.handlers.buttons import send_main_menu
+from AI_product_assistant.bot.handlers.handle_recipe import process_recipe
+
+
+@pytest.fixture(autouse=True)
+def storage():
+    # Состояние чатов хранится в памяти, чтобы тесты не создавали файл базы
+    storage = BotStorage(":memory:")
+    with mock.patch('config.BOT_STORAGE_PATH', ''), \
+            mock.patch('AI_product_assistant.bot.handlers.favorites.get_storage', return_value=storage):
+        yield storage
+    storage.close()
 
 
 @pytest.mark.asyncio
@@ -55,6 +71,7 @@ async def test_button_view_favorites():
     query = MagicMock(CallbackQuery)
     query.data = 'view_favorites'
     query.message.chat.id = 12345
+    update.effective_chat.id = 12345
     query.edit_message_text = AsyncMock()
     query.answer = AsyncMock()
 
@@ -69,6 +86,7 @@ async def test_button_delete_cart():
     query = MagicMock(CallbackQuery)
     query.data = 'delete_cart:cart1'
     query.message.chat.id = 12345
+    update.effective_chat.id = 12345
     query.edit_message_text = AsyncMock()
     query.answer = AsyncMock()
 
@@ -78,24 +96,254 @@ async def test_button_delete_cart():
 
 
 @pytest.mark.asyncio
-async def test_send_favorites_menu_with_items():
+async def test_send_favorites_menu_with_items(storage):
     update = MagicMock(Update)
     update.effective_chat.id = 12345
     update.callback_query = None
     update.message.reply_text = AsyncMock()
 
-    FAVORITES[12345] = {'cart1': ['item1', 'item2']}
+    storage.add_favorite(12345, 'cart1', [CartItem('картофель', 101, 2)])
 
     await send_favorites_menu(update, mock.MagicMock())
 
+    assert update.message.reply_text.await_args.args[0] == "Ваши избранные корзины:"
+
+
+def make_catalog():
+    catalog = MagicMock()
+    catalog.snapshot.return_value = CatalogSnapshot(ProductTable({"Овощи": [
+        {"name": "Картофель", "link": "https://vkusvill.ru/goods/kartofel-101.html", "quantity": "1 кг",
+         "price": 90},
+    ]}))
+    return catalog
+
 
 @pytest.mark.asyncio
-async def test_send_favorites_menu_empty():
-    FAVORITES.clear()
+async def test_send_favorites_menu_shows_current_totals(storage):
+    update = MagicMock(Update)
+    update.effective_chat.id = 12345
+    update.callback_query = None
+    update.message.reply_text = AsyncMock()
+
+    storage.add_favorite(12345, 'cart1', [CartItem('картофель', 101, 2, 90)])
+    storage.add_favorite(12345, 'cart2', [CartItem('картофель', 101, 1, 80), CartItem('свекла', 102, 1, 50)])
+
+    with mock.patch('AI_product_assistant.bot.handlers.favorites.get_catalog', return_value=make_catalog()):
+        await send_favorites_menu(update, mock.MagicMock())
+
+    keyboard = update.message.reply_text.await_args.kwargs['reply_markup'].inline_keyboard
+    assert [row[0].text for row in keyboard] == ["cart1 — 180 ₽", "cart2 — 90 ₽ ⚠️", "Назад"]
+
+
+@pytest.mark.asyncio
+async def test_button_view_cart_reprices_items(storage):
+    update = MagicMock(Update)
+    query = MagicMock(CallbackQuery)
+    query.data = 'view_cart:cart1'
+    query.message.chat.id = 12345
+    query.edit_message_text = AsyncMock()
+    query.answer = AsyncMock()
+    update.callback_query = query
+
+    storage.add_favorite(12345, 'cart1', [CartItem('картофель', 101, 2, 80), CartItem('свекла', 102, 1, 50),
+                                          CartItem('соль')])
+
+    buttons = 'AI_product_assistant.bot.handlers.buttons'
+    with mock.patch(f'{buttons}.get_storage', return_value=storage), \
+            mock.patch(f'{buttons}.get_catalog', return_value=make_catalog()):
+        await button(update, mock.MagicMock())
+
+    text = query.edit_message_text.await_args.args[0]
+    assert "1. [Картофель](https://vkusvill.ru/goods/kartofel-101.html) - 2 шт, 180 ₽ " \
+           "(цена изменилась: 80 → 90 ₽ за шт)" in text
+    assert "2. свекла - нет в наличии" in text
+    assert "3. соль - не удалось найти" in text
+    assert text.endswith("Итоговая стоимость: 180 ₽")
+
+
+@pytest.mark.asyncio
+async def test_button_view_cart_without_catalog(storage):
+    update = MagicMock(Update)
+    query = MagicMock(CallbackQuery)
+    query.data = 'view_cart:cart1'
+    query.message.chat.id = 12345
+    query.edit_message_text = AsyncMock()
+    query.answer = AsyncMock()
+    update.callback_query = query
+
+    storage.add_favorite(12345, 'cart1', [CartItem('картофель', 101, 2, 80)])
+
+    buttons = 'AI_product_assistant.bot.handlers.buttons'
+    with mock.patch(f'{buttons}.get_storage', return_value=storage), \
+            mock.patch(f'{buttons}.get_catalog', side_effect=FileNotFoundError("vkusvill_products.json")):
+        await button(update, mock.MagicMock())
+
+    # Без базы продуктов обработчик не падает, а сообщает, что корзина сейчас недоступна
+    text = query.edit_message_text.await_args.args[0]
+    assert text.startswith("Не удалось загрузить базу продуктов")
+    keyboard = query.edit_message_text.await_args.kwargs['reply_markup'].inline_keyboard
+    assert [row[0].text for row in keyboard] == ["Удалить корзину", "Назад"]
 
+
+@pytest.mark.asyncio
+async def test_send_favorites_menu_empty():
     update = MagicMock(Update)
     update.effective_chat.id = 12345
     update.callback_query = None
     update.message.reply_text = AsyncMock()
 
-    await send_favorites_menu(update, mock.MagicMock())
\ No newline at end of file
+    await send_favorites_menu(update, mock.MagicMock())
+
+@pytest.mark.asyncio
+async def test_process_recipe_sends_list_before_instructions():
+    update = MagicMock(Update)
+    recipe_message = MagicMock()
+    recipe_message.edit_text = AsyncMock()
+    update.message.reply_text = AsyncMock(return_value=recipe_message)
+    update.callback_query = None
+    update.effective_chat.id = 12345
+
+    instructions_ready = asyncio.Event()
+
+    async def slow_instructions(dish, ingredients):
+        await instructions_ready.wait()
+        yield "1. Нарежьте"
+        yield "1. Нарежьте картофель."
+
+    handle_recipe = 'AI_product_assistant.bot.handlers.handle_recipe'
+    with mock.patch(f'{handle_recipe}.get_ingredients_list_async',
+                    AsyncMock(return_value={"dish": "борщ", "ingredients": {"картофель": [800, "г"]}})), \
+            mock.patch(f'{handle_recipe}.stream_preparation_instructions', slow_instructions), \
+            mock.patch(f'{handle_recipe}.get_links_from_list', return_value=[{}]), \
+            mock.patch(f'{handle_recipe}.send_main_menu', AsyncMock()):
+        task = asyncio.create_task(process_recipe(update, mock.MagicMock(), "Борщ", 12345))
+        await asyncio.sleep(0.01)
+
+        # Список продуктов уже отправлен, инструкция ещё готовится
+        update.message.reply_text.assert_awaited_once()
+        recipe_message.edit_text.assert_not_awaited()
+
+        instructions_ready.set()
+        await task
+
+    # Первый фрагмент показывается сразу, полный текст — последним редактированием
+    assert recipe_message.edit_text.await_args_list[0].args[0].endswith("1. Нарежьте")
+    assert recipe_message.edit_text.await_args.args[0].endswith("1. Нарежьте картофель.")
+
+
+def recipe_update():
+    update = MagicMock(Update)
+    recipe_message = MagicMock()
+    recipe_message.edit_text = AsyncMock()
+    update.message.reply_text = AsyncMock(return_value=recipe_message)
+    update.callback_query = None
+    update.effective_chat.id = 12345
+    return update, recipe_message
+
+
+def patch_recipe(instructions, links=None):
+    handle_recipe = 'AI_product_assistant.bot.handlers.handle_recipe'
+    links_patch = mock.patch(f'{handle_recipe}.get_links_from_list', **(links or {"return_value": [{}]}))
+    return (
+        mock.patch(f'{handle_recipe}.get_ingredients_list_async',
+                   AsyncMock(return_value={"dish": "борщ", "ingredients": {"картофель": [800, "г"]}})),
+        mock.patch(f'{handle_recipe}.stream_preparation_instructions', instructions),
+        links_patch,
+        mock.patch(f'{handle_recipe}.send_main_menu', AsyncMock())
+    )
+
+
+@pytest.mark.asyncio
+async def test_process_recipe_long_instruction_is_split(storage):
+    update, recipe_message = recipe_update()
+    steps = "".join(f"{i}. Помешивайте борщ и следите за огнём.\n" for i in range(1, 301))
+
+    async def long_instructions(dish, ingredients):
+        yield steps
+
+    storage.set_state(12345, 'recipe')
+    patches = patch_recipe(long_instructions)
+    with patches[0], patches[1], patches[2], patches[3] as main_menu, \
+            mock.patch('AI_product_assistant.bot.handlers.handle_recipe.get_storage', return_value=storage):
+        await process_recipe(update, mock.MagicMock(), "Борщ", 12345)
+
+    # Начало инструкции остаётся в сообщении, продолжение приходит следующими сообщениями
+    edited = recipe_message.edit_text.await_args.args[0]
+    continuation = [call.args[0] for call in update.message.reply_text.await_args_list[1:]]
+    assert len(edited) <= 4096 and continuation
+    assert all(len(part) <= 4096 for part in continuation)
+    assert (edited + "".join(continuation)).endswith(steps)
+    main_menu.assert_awaited_once()
+    assert (await storage.chat(12345)).state is None
+
+
+@pytest.mark.asyncio
+async def test_process_recipe_final_edit_without_markdown(storage):
+    update, recipe_message = recipe_update()
+
+    async def instructions(dish, ingredients):
+        yield "1. Нарежьте"
+        yield "1. Нарежьте *картофель."
+
+    # Незакрытая звёздочка: Telegram отклоняет разметку, текст отправляется без неё
+    async def edit_text(text, parse_mode=None):
+        if parse_mode and text.endswith("*картофель."):
+            raise BadRequest("Can't parse entities")
+
+    recipe_message.edit_text = AsyncMock(side_effect=edit_text)
+    patches = patch_recipe(instructions)
+    with patches[0], patches[1], patches[2], patches[3] as main_menu, \
+            mock.patch('AI_product_assistant.bot.handlers.handle_recipe.TELEGRAM_EDIT_INTERVAL', 60):
+        await process_recipe(update, mock.MagicMock(), "Борщ", 12345)
+
+    assert recipe_message.edit_text.await_args.kwargs == {}
+    assert recipe_message.edit_text.await_args.args[0].endswith("*картофель.")
+    main_menu.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_process_recipe_matches_products_off_event_loop(storage):
+    update, _ = recipe_update()
+    first_chunk = threading.Event()
+    overlapped = []
+
+    async def instructions(dish, ingredients):
+        first_chunk.set()
+        yield "1. Нарежьте картофель."
+
+    # Подбор продуктов ждёт начала инструкции: если он блокирует цикл событий, инструкция не начнётся
+    def get_links_from_list(ingredients, path):
+        overlapped.append(first_chunk.wait(timeout=1))
+        return [{}]
+
+    patches = patch_recipe(instructions, {"side_effect": get_links_from_list})
+    with patches[0], patches[1], patches[2], patches[3], \
+            mock.patch('AI_product_assistant.bot.handlers.handle_recipe.format_recipe_ingredients', return_value=""), \
+            mock.patch('AI_product_assistant.bot.handlers.handle_recipe.get_storage', return_value=storage):
+        await process_recipe(update, mock.MagicMock(), "Борщ", 12345)
+
+    assert overlapped == [True]
+
+
+@pytest.mark.asyncio
+async def test_process_recipe_cancels_instructions_on_error():
+    update, _ = recipe_update()
+
+    closed = []
+
+    async def endless_instructions(dish, ingredients):
+        try:
+            await asyncio.sleep(60)
+            yield "1. Нарежьте"
+        finally:
+            closed.append(True)
+
+    patches = patch_recipe(endless_instructions, {"side_effect": FileNotFoundError("vkusvill_products.json")})
+    with patches[0], patches[1], patches[2], patches[3]:
+        with pytest.raises(FileNotFoundError):
+            await process_recipe(update, mock.MagicMock(), "Борщ", 12345)
+        await asyncio.sleep(0.01)
+
+    # Генерация инструкции не продолжается в фоне после ошибки подбора продуктов
+    assert [task for task in asyncio.all_tasks() if task is not asyncio.current_task()] == []
+    assert closed == [True]
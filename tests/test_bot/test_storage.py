@@ -0,0 +1,102 @@
+import threading
+from unittest import mock
+
+import pytest
+from AI_product_assistant.bot.states import storage as storage_module
+from AI_product_assistant.bot.states.cart import CartItem, dump_cart
+from AI_product_assistant.bot.states.storage import BotStorage
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "bot_state.sqlite3")
+
+
+@pytest.mark.asyncio
+async def test_state_survives_restart(db_path):
+    storage = BotStorage(db_path)
+    storage.set_state(1, 'shopping')
+    storage.add_favorite(1, 'борщ', [CartItem('свекла', 101, 2, 50), CartItem('соль')])
+    storage.add_favorite(1, 'суп', [])
+    storage.delete_favorite(1, 'суп')
+    storage.close()
+
+    storage = BotStorage(db_path)
+    chat = await storage.chat(1)
+
+    assert chat.state == 'shopping'
+    assert list(chat.favorites) == ['борщ']
+    assert dump_cart(chat.favorites['борщ']) == [['свекла', 101, 2, 50], ['соль', 0, 0, 0]]
+    assert (await storage.chat(2)).favorites == {}
+    storage.close()
+
+
+@pytest.mark.asyncio
+async def test_writes_are_visible_before_flush(db_path):
+    storage = BotStorage(db_path, flush_interval=60)
+
+    # Запись ещё не в кэше: изменение ждёт в буфере и попадает в базу перед чтением
+    storage.set_state(1, 'recipe')
+    assert (await storage.chat(1)).state == 'recipe'
+
+    # Запись в кэше: изменение видно сразу
+    storage.add_favorite(1, 'корзина', [])
+    assert 'корзина' in (await storage.chat(1)).favorites
+    storage.close()
+
+
+def test_purchase_history_is_limited(db_path):
+    storage = BotStorage(db_path, history_limit=3)
+    for i in range(5):
+        storage.add_purchase(1, [CartItem(f"товар {i}", i, 1)])
+    storage.add_purchase(2, [])
+
+    assert [cart[0].product_id for cart in storage.get_purchase_history(1)] == [2, 3, 4]
+    assert storage.get_purchase_history(2) == [[]]
+    storage.close()
+
+
+def test_cache_is_bounded(db_path):
+    storage = BotStorage(db_path, cache_size=2)
+    for chat_id in range(3):
+        storage.get_chat(chat_id)
+
+    assert list(storage._cache) == [1, 2]
+    storage.close()
+
+
+def test_write_during_read_is_not_lost(db_path):
+    storage = BotStorage(db_path, flush_interval=60)
+    storage.add_favorite(1, 'борщ', [CartItem('свекла', 101, 2, 50)])
+    storage.close()
+
+    storage = BotStorage(db_path, flush_interval=60)
+    flushes = []
+    load_cart = storage_module.load_cart
+
+    def load_cart_with_concurrent_write(data):
+        # Пока запись чата читается из базы, другой обработчик меняет режим, а фоновый поток пытается
+        # сбросить буфер: изменение не должно потеряться, а устаревшая запись — попасть в кэш
+        if not flushes:
+            storage.set_state(1, 'recipe')
+            flushes.append(threading.Thread(target=storage.flush))
+            flushes[0].start()
+        return load_cart(data)
+
+    chat_record = storage_module.ChatRecord
+
+    def chat_record_after_flush(*args):
+        # Даём фоновому сбросу шанс выполниться между чтением базы и записью в кэш
+        if len(flushes) == 1:
+            flushes.append(None)
+            flushes[0].join(0.2)
+        return chat_record(*args)
+
+    with mock.patch.object(storage_module, 'load_cart', load_cart_with_concurrent_write), \
+            mock.patch.object(storage_module, 'ChatRecord', chat_record_after_flush):
+        chat = storage.get_chat(1)
+    flushes[0].join()
+
+    assert chat.state == 'recipe'
+    assert storage.get_chat(1).state == 'recipe'
+    storage.close()
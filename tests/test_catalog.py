@@ -0,0 +1,137 @@
+import json
+import os
+import pytest
+import threading
+from parser.catalog import Catalog, ProductTable, get_catalog
+from parser.catalog_binary import BinaryProductTable, binary_path, write_binary_catalog
+
+
+def write_database(path, products, mtime_ns):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"Овощи": products}, f, ensure_ascii=False)
+    # Явно двигаем mtime, чтобы изменение было видно даже на грубых файловых системах
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "products.json"
+    write_database(path, [{"name": "Картофель", "link": "", "quantity": "1 кг", "price": 100}], 1_000_000_000)
+    return str(path)
+
+
+def test_snapshot_is_loaded_once(db_path):
+    catalog = Catalog(db_path)
+
+    first = catalog.snapshot()
+    second = catalog.snapshot()
+
+    assert first is second
+    assert first.version == 1
+    assert len(first) == 1
+
+
+def test_reload_swaps_snapshot(db_path):
+    catalog = Catalog(db_path)
+    old = catalog.snapshot()
+
+    write_database(db_path, [
+        {"name": "Картофель", "link": "", "quantity": "1 кг", "price": 90},
+        {"name": "Морковь", "link": "", "quantity": "1 кг", "price": 60}
+    ], 2_000_000_000)
+    new = catalog.reload()
+
+    assert new.version == 2
+    assert len(new) == 2
+    # Старый снимок не меняется у тех, кто его уже взял
+    assert old.product(0)["price"] == 100
+    assert old.index.find("морковь") == []
+
+
+def test_background_reload_after_change(db_path):
+    catalog = Catalog(db_path)
+    old = catalog.snapshot()
+
+    write_database(db_path, [{"name": "Морковь", "link": "", "quantity": "1 кг", "price": 60}], 2_000_000_000)
+
+    # Пока новый снимок грузится, запрос получает старый
+    assert catalog.snapshot() is old
+    catalog._reload_thread.join()
+    assert catalog.snapshot().index.find("морковь") == [0]
+
+
+def test_broken_file_keeps_old_snapshot(db_path):
+    catalog = Catalog(db_path)
+    old = catalog.snapshot()
+
+    with open(db_path, "w", encoding="utf-8") as f:
+        f.write('{"Овощи": [')
+    os.utime(db_path, ns=(3_000_000_000, 3_000_000_000))
+
+    catalog.snapshot()
+    catalog._reload_thread.join()
+    assert catalog.snapshot() is old
+
+
+def test_get_catalog_is_shared(db_path):
+    assert get_catalog(db_path) is get_catalog(db_path)
+
+
+def test_binary_snapshot_matches_json(tmp_path):
+    database = {
+        "Овощи": [
+            {"name": "Картофель молодой", "link": "https://vkusvill.ru/goods/kartofel-1.html", "quantity": "1 кг",
+             "price": 120},
+            {"name": "Манго Египет", "link": "https://vkusvill.ru/goods/mango-2.html", "quantity": "", "price": 465}
+        ],
+        "Масла": [
+            {"name": "Томаты черри", "link": "", "quantity": "250 уп", "price": 200}
+        ]
+    }
+    table = ProductTable(database)
+    path = str(tmp_path / "products.bin")
+    write_binary_catalog(table, path)
+
+    binary = BinaryProductTable(path)
+
+    assert len(binary) == 3
+    assert binary.categories == ["Овощи", "Масла"]
+    assert [binary.product(i) for i in range(3)] == [table.product(i) for i in range(3)]
+    assert list(binary.cost_per_gram) == list(table.cost_per_gram)
+    assert list(binary.valid) == [1, 1, 0]
+    assert list(binary.tokens) == table.tokens
+
+
+def test_concurrent_binary_writes(db_path, tmp_path):
+    with open(db_path, encoding="utf-8") as f:
+        table = ProductTable(json.load(f))
+    path = str(tmp_path / "products.bin")
+
+    # Два процесса обновления пишут снимок одновременно: у каждого свой временный файл
+    writers = [threading.Thread(target=write_binary_catalog, args=(table, path)) for _ in range(4)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+
+    assert len(BinaryProductTable(path)) == len(table)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_catalog_prefers_fresh_binary(db_path):
+    with open(db_path, encoding="utf-8") as f:
+        table = ProductTable(json.load(f))
+    write_binary_catalog(table, binary_path(db_path))
+
+    snapshot = Catalog(db_path).snapshot()
+
+    assert isinstance(snapshot.table, BinaryProductTable)
+    assert snapshot.index.find("картофель") == [0]
+
+    # JSON новее снимка — читается JSON
+    write_database(db_path, [{"name": "Морковь", "link": "", "quantity": "1 кг", "price": 60}],
+                   os.stat(binary_path(db_path)).st_mtime_ns + 1_000_000_000)
+    snapshot = Catalog(db_path).snapshot()
+
+    assert isinstance(snapshot.table, ProductTable)
+    assert snapshot.index.find("морковь") == [0]
@@ -1,12 +1,41 @@
 import pytest
 from unittest.mock import patch, MagicMock
+import asyncio
 import json
+import httpx
+import openai
+import threading
+import time
 from gpt_request import (
     get_number_of_portions,
     get_ingredients_per_portion,
     get_ingredients_list,
-    get_preparation_instructions
+    get_dish_with_portions,
+    get_preparation_instructions,
+    get_preparation_instructions_async,
+    stream_preparation_instructions,
+    get_gpt_client,
+    close_gpt_clients
 )
+from portions import portion_stats
+
+
+# Кэш ответов в тестах по умолчанию отключён, чтобы тесты не влияли друг на друга
+@pytest.fixture(autouse=True)
+def no_gpt_cache():
+    with patch('gpt_request.config.GPT_CACHE_PATH', ''):
+        yield
+
+
+# Повторы после временных ошибок в тестах выполняются без пауз
+@pytest.fixture(autouse=True)
+def no_retry_delay():
+    with patch('gpt_retry.config.GPT_RETRY_BASE_DELAY', 0):
+        yield
+
+
+def connection_error():
+    return openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
 
 
 # Фикстура для мока ответа от OpenAI API
@@ -16,8 +45,22 @@ def mock_ask_gpt_with_proxy():
         yield mock
 
 
+# Фикстура для прежнего способа: порции и ингредиенты двумя отдельными запросами
+@pytest.fixture
+def two_call_extraction():
+    with patch('gpt_request.config.GPT_COMBINED_EXTRACTION', False):
+        yield
+
+
+# Фикстура для определения количества порций только моделью, без локального разбора
+@pytest.fixture
+def model_portions():
+    with patch('gpt_request.config.LOCAL_PORTIONS_PARSER', False):
+        yield
+
+
 # Тест функции get_number_of_portions
-def test_get_number_of_portions_success(mock_ask_gpt_with_proxy):
+def test_get_number_of_portions_success(mock_ask_gpt_with_proxy, model_portions):
     # Настройка мока для успешного ответа
     mock_ask_gpt_with_proxy.return_value = "4"
 
@@ -28,7 +71,7 @@ def test_get_number_of_portions_success(mock_ask_gpt_with_proxy):
     mock_ask_gpt_with_proxy.assert_called()
 
 
-def test_get_number_of_portions_invalid_response(mock_ask_gpt_with_proxy):
+def test_get_number_of_portions_invalid_response(mock_ask_gpt_with_proxy, model_portions):
     # Настройка мока для некорректного ответа
     mock_ask_gpt_with_proxy.side_effect = ["invalid", "0", "-1", "2"]
 
@@ -39,7 +82,7 @@ def test_get_number_of_portions_invalid_response(mock_ask_gpt_with_proxy):
     assert mock_ask_gpt_with_proxy.call_count == 4
 
 
-def test_get_number_of_portions_failure(mock_ask_gpt_with_proxy):
+def test_get_number_of_portions_failure(mock_ask_gpt_with_proxy, model_portions):
     # Настройка мока для постоянных некорректных ответов
     mock_ask_gpt_with_proxy.side_effect = ["invalid", "0", "-1", "NaN", "None"]
 
@@ -113,7 +156,7 @@ def test_get_ingredients_per_portion_failure(mock_ask_gpt_with_proxy):
 
 
 # Тест функции get_ingredients_list
-def test_get_ingredients_list_success(mock_ask_gpt_with_proxy):
+def test_get_ingredients_list_success(mock_ask_gpt_with_proxy, two_call_extraction, model_portions):
     # Настройка мока для функций get_number_of_portions и get_ingredients_per_portion
     # Предполагаем, что вызов ask_gpt_with_proxy сначала для get_number_of_portions, затем для get_ingredients_per_portion
     mock_ask_gpt_with_proxy.side_effect = ["4", json.dumps({
@@ -138,7 +181,7 @@ def test_get_ingredients_list_success(mock_ask_gpt_with_proxy):
     assert mock_ask_gpt_with_proxy.call_count == 2
 
 
-def test_get_ingredients_list_failure_in_portions(mock_ask_gpt_with_proxy):
+def test_get_ingredients_list_failure_in_portions(mock_ask_gpt_with_proxy, two_call_extraction, model_portions):
     # Настройка мока для get_number_of_portions, чтобы вызвать ошибку
     mock_ask_gpt_with_proxy.side_effect = ["invalid", "0", "-1", "NaN", "None"]
 
@@ -150,7 +193,7 @@ def test_get_ingredients_list_failure_in_portions(mock_ask_gpt_with_proxy):
     assert mock_ask_gpt_with_proxy.call_count == 5
 
 
-def test_get_ingredients_list_failure_in_ingredients(mock_ask_gpt_with_proxy):
+def test_get_ingredients_list_failure_in_ingredients(mock_ask_gpt_with_proxy, two_call_extraction, model_portions):
     # Настройка мока: правильный portions, некорректные ingredients
     mock_ask_gpt_with_proxy.side_effect = [
         "4",
@@ -178,6 +221,97 @@ def test_get_ingredients_list_failure_in_ingredients(mock_ask_gpt_with_proxy):
     assert mock_ask_gpt_with_proxy.call_count == 3
 
 
+# Тест получения порций и ингредиентов одним запросом
+def test_get_ingredients_list_combined(mock_ask_gpt_with_proxy, model_portions):
+    mock_ask_gpt_with_proxy.return_value = json.dumps({
+        "dish": "борщ",
+        "portions": 4,
+        "ingredients": {
+            "картофель": [200, "г"],
+            "свекла": [150, "г"]
+        }
+    })
+
+    result = get_ingredients_list("Борщ на 4 порции", combined=True)
+
+    assert result == {
+        "dish": "борщ",
+        "ingredients": {
+            "картофель": [800, "г"],  # 200 * 4
+            "свекла": [600, "г"]  # 150 * 4
+        }
+    }
+    assert mock_ask_gpt_with_proxy.call_count == 1
+    assert mock_ask_gpt_with_proxy.call_args.kwargs["response_format"] == {"type": "json_object"}
+
+
+def test_get_ingredients_list_combined_local_portions(mock_ask_gpt_with_proxy):
+    mock_ask_gpt_with_proxy.return_value = json.dumps({"борщ": {"картофель": [200, "г"]}})
+
+    result = get_ingredients_list("Борщ на 4 порции", combined=True)
+
+    # Количество порций определено без модели: у неё спрашиваются только ингредиенты на порцию
+    assert result == {"dish": "борщ", "ingredients": {"картофель": [800, "г"]}}
+    assert mock_ask_gpt_with_proxy.call_count == 1
+    assert "response_format" not in mock_ask_gpt_with_proxy.call_args.kwargs
+
+
+def test_get_dish_with_portions_invalid_structure(mock_ask_gpt_with_proxy):
+    # Старый формат ответа и нулевое количество порций не проходят проверку
+    mock_ask_gpt_with_proxy.side_effect = [
+        json.dumps({"борщ": {"картофель": [200, "г"]}}),
+        json.dumps({"dish": "борщ", "portions": 0, "ingredients": {"картофель": [200, "г"]}}),
+        json.dumps({"dish": "борщ", "portions": 2, "ingredients": {"картофель": [200, "г"]}})
+    ]
+
+    result = get_dish_with_portions("Борщ на 2 порции")
+
+    assert result == {"dish": "борщ", "portions": 2, "ingredients": {"картофель": [200, "г"]}}
+    assert mock_ask_gpt_with_proxy.call_count == 3
+
+
+def test_get_ingredients_list_combined_failure(mock_ask_gpt_with_proxy, model_portions):
+    mock_ask_gpt_with_proxy.side_effect = ["invalid", "{}", "[]", "null", "{\"dish\": 1}"]
+
+    result = get_ingredients_list("Борщ на 4 порции", combined=True)
+
+    assert result == {"error": "Не удалось получить корректный JSON после нескольких попыток."}
+    assert mock_ask_gpt_with_proxy.call_count == 5
+
+
+# Ингредиенты на порцию берутся из кэша для того же блюда с другим количеством порций
+def test_get_ingredients_list_cached(mock_ask_gpt_with_proxy, tmp_path):
+    mock_ask_gpt_with_proxy.return_value = json.dumps({"борщ": {"картофель": [200, "г"]}})
+
+    with patch('gpt_request.config.GPT_CACHE_PATH', str(tmp_path / "cache.sqlite3")):
+        first = get_ingredients_list("Борщ на 4 порции", combined=True)
+        second = get_ingredients_list("борщ на две недели", combined=True)
+        third = get_ingredients_list("Борщ", combined=True)
+
+    assert first == {"dish": "борщ", "ingredients": {"картофель": [800, "г"]}}
+    assert second == {"dish": "борщ", "ingredients": {"картофель": [2800, "г"]}}
+    # Количество не указано — одна порция
+    assert third == {"dish": "борщ", "ingredients": {"картофель": [200, "г"]}}
+    # Ингредиенты берутся из кэша, а количество порций определяется без модели
+    assert mock_ask_gpt_with_proxy.call_count == 1
+
+
+def test_get_ingredients_list_cached_model_portions(mock_ask_gpt_with_proxy, tmp_path, model_portions):
+    mock_ask_gpt_with_proxy.side_effect = [
+        json.dumps({"dish": "борщ", "portions": 4, "ingredients": {"картофель": [200, "г"]}}),
+        "3"
+    ]
+
+    with patch('gpt_request.config.GPT_CACHE_PATH', str(tmp_path / "cache.sqlite3")):
+        first = get_ingredients_list("Борщ на 4 порции", combined=True)
+        second = get_ingredients_list("Борщ", combined=True)
+
+    assert first == {"dish": "борщ", "ingredients": {"картофель": [800, "г"]}}
+    assert second == {"dish": "борщ", "ingredients": {"картофель": [600, "г"]}}
+    # Ингредиенты берутся из кэша, у модели спрашивается только количество порций
+    assert mock_ask_gpt_with_proxy.call_count == 2
+
+
 # Тест функции get_preparation_instructions
 def test_get_preparation_instructions_success(mock_ask_gpt_with_proxy):
     # Настройка мока для успешного ответа
@@ -214,8 +348,8 @@ def test_get_preparation_instructions_empty_response(mock_ask_gpt_with_proxy):
 
 
 def test_get_preparation_instructions_failure(mock_ask_gpt_with_proxy):
-    # Настройка мока для постоянных ошибок
-    mock_ask_gpt_with_proxy.side_effect = Exception("API Error")
+    # Настройка мока для постоянных ошибок соединения
+    mock_ask_gpt_with_proxy.side_effect = connection_error()
 
     dish = "борщ"
     ingredients = {
@@ -229,8 +363,84 @@ def test_get_preparation_instructions_failure(mock_ask_gpt_with_proxy):
     assert mock_ask_gpt_with_proxy.call_count == 5
 
 
+def test_non_transient_error_is_not_retried(mock_ask_gpt_with_proxy):
+    # Ошибка в самом запросе не исправится повтором
+    response = httpx.Response(400, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+    mock_ask_gpt_with_proxy.side_effect = openai.BadRequestError("Bad request", response=response, body=None)
+
+    with pytest.raises(ValueError, match="Не удалось получить инструкцию") as error:
+        get_preparation_instructions("борщ", {})
+    assert isinstance(error.value.__cause__, openai.BadRequestError)
+    assert mock_ask_gpt_with_proxy.call_count == 1
+
+
+def test_transient_error_then_success(mock_ask_gpt_with_proxy, model_portions):
+    mock_ask_gpt_with_proxy.side_effect = [connection_error(), "4"]
+
+    assert get_number_of_portions("Борщ на 4 порции") == 4
+    # После ошибки соединения повторяется тот же запрос
+    assert mock_ask_gpt_with_proxy.call_args_list[0].args == mock_ask_gpt_with_proxy.call_args_list[1].args
+
+
+def test_deadline_stops_retries(mock_ask_gpt_with_proxy, model_portions):
+    mock_ask_gpt_with_proxy.side_effect = connection_error()
+
+    with patch('gpt_retry.config.GPT_REQUEST_DEADLINE', 0.5), patch('gpt_retry.config.GPT_RETRY_BASE_DELAY', 10), \
+            patch('gpt_retry.random.uniform', return_value=10):
+        with pytest.raises(ValueError) as error:
+            get_number_of_portions("Борщ")
+    # Пауза перед повтором не укладывается в отведённое время
+    assert mock_ask_gpt_with_proxy.call_count == 1
+    assert isinstance(error.value.__cause__, openai.APIConnectionError)
+
+
+def test_local_json_repair_avoids_new_request(mock_ask_gpt_with_proxy):
+    mock_ask_gpt_with_proxy.return_value = (
+        'Вот ваш ответ:\n```json\n{"dish": "борщ", "portions": 2, "ingredients": {"картофель": [200, "г"],}}\n```'
+    )
+
+    result = get_dish_with_portions("Борщ на 2 порции")
+
+    assert result == {"dish": "борщ", "portions": 2, "ingredients": {"картофель": [200, "г"]}}
+    assert mock_ask_gpt_with_proxy.call_count == 1
+
+
+def test_repair_prompt_is_short(mock_ask_gpt_with_proxy, model_portions):
+    mock_ask_gpt_with_proxy.side_effect = ["Порций будет много", "6"]
+
+    assert get_number_of_portions("Борщ на 6 порций") == 6
+
+    first = mock_ask_gpt_with_proxy.call_args_list[0].args[0]
+    repair = mock_ask_gpt_with_proxy.call_args_list[1].args[0]
+    # Повторный запрос не пересылает системный промпт: только запрос, неверный ответ и указание
+    assert first[0]["role"] == "system"
+    assert [message["role"] for message in repair] == ["user", "assistant", "user"]
+    assert repair[0]["content"] == "Борщ на 6 порций"
+    assert repair[1]["content"] == "Порций будет много"
+
+
+def test_get_number_of_portions_local(mock_ask_gpt_with_proxy):
+    portion_stats.clear()
+
+    assert get_number_of_portions("Борщ на 4 порции") == 4
+    assert get_number_of_portions("Паста карбонара на двоих") == 2
+    assert get_number_of_portions("борщ на две недели") == 14
+    mock_ask_gpt_with_proxy.assert_not_called()
+    assert portion_stats.stats() == {"local": 3, "model": 0, "local_fraction": 1.0}
+
+
+def test_get_number_of_portions_ambiguous_falls_back(mock_ask_gpt_with_proxy):
+    portion_stats.clear()
+    mock_ask_gpt_with_proxy.return_value = "4"
+
+    assert get_number_of_portions("Борщ на 3-4 порции") == 4
+    assert get_number_of_portions("Суп на 4 порции") == 4
+    assert mock_ask_gpt_with_proxy.call_count == 1
+    assert portion_stats.stats() == {"local": 1, "model": 1, "local_fraction": 0.5}
+
+
 # Дополнительные тесты для проверки интеграции
-def test_full_flow_success(mock_ask_gpt_with_proxy):
+def test_full_flow_success(mock_ask_gpt_with_proxy, two_call_extraction, model_portions):
     # Настройка мока для последовательных вызовов:
     # 1. get_number_of_portions: "4"
     # 2. get_ingredients_per_portion: корректный JSON
@@ -263,4 +473,82 @@ def test_full_flow_success(mock_ask_gpt_with_proxy):
     # Получение инструкций
     instructions = get_preparation_instructions(ingredients_list["dish"], ingredients_list["ingredients"])
     assert instructions == "1. Нарежьте картофель.\n2. Варите свеклу."
-    assert mock_ask_gpt_with_proxy.call_count == 3
\ No newline at end of file
+    assert mock_ask_gpt_with_proxy.call_count == 3
+
+
+# Асинхронные обёртки не блокируют цикл событий
+@pytest.mark.asyncio
+async def test_get_preparation_instructions_async_runs_in_pool(mock_ask_gpt_with_proxy):
+    threads = []
+
+    def slow_answer(*args, **kwargs):
+        threads.append(threading.current_thread().name)
+        time.sleep(0.2)
+        return "1. Нарежьте картофель."
+
+    mock_ask_gpt_with_proxy.side_effect = slow_answer
+
+    started = time.monotonic()
+    results = await asyncio.gather(*(get_preparation_instructions_async("борщ", {}) for _ in range(4)))
+
+    assert results == ["1. Нарежьте картофель."] * 4
+    assert all(name.startswith("gpt") for name in threads)
+    # Четыре запроса выполняются параллельно, а не друг за другом
+    assert time.monotonic() - started < 0.6
+
+
+# Клиент OpenAI переиспользуется между запросами
+def test_get_gpt_client_is_reused():
+    with patch('gpt_request.config.HTTPS_PROXY_IPPORT', ''), patch('gpt_request.config.OPENAI_API_KEY', 'test'):
+        first = get_gpt_client()
+        second = get_gpt_client()
+
+        assert first is second
+
+        close_gpt_clients()
+        assert get_gpt_client() is not first
+        close_gpt_clients()
+
+
+
+# Потоковая генерация инструкции
+@pytest.mark.asyncio
+async def test_stream_preparation_instructions():
+    with patch('gpt_request.stream_gpt_with_proxy', return_value=(delta for delta in ["1. Нарежьте", " картофель."])):
+        parts = [part async for part in stream_preparation_instructions("борщ", {})]
+
+    assert parts == ["1. Нарежьте", "1. Нарежьте картофель."]
+
+
+@pytest.mark.asyncio
+async def test_closed_stream_stops_reading_response():
+    read = []
+    closed = threading.Event()
+
+    def endless_stream(messages, **kwargs):
+        try:
+            for i in range(1000):
+                read.append(i)
+                yield f"{i}. Помешивайте. "
+                time.sleep(0.001)
+        finally:
+            closed.set()
+
+    with patch('gpt_request.stream_gpt_with_proxy', endless_stream):
+        instructions = stream_preparation_instructions("борщ", {})
+        assert await instructions.__anext__() == "0. Помешивайте. "
+        await instructions.aclose()
+        # Ответ модели закрывается, не дочитываясь до конца
+        assert await asyncio.to_thread(closed.wait, 1)
+
+    assert len(read) < 1000
+
+
+@pytest.mark.asyncio
+async def test_stream_preparation_instructions_fallback(mock_ask_gpt_with_proxy):
+    # Поток оборвался до первого фрагмента — инструкция запрашивается целиком
+    mock_ask_gpt_with_proxy.return_value = "1. Нарежьте картофель."
+    with patch('gpt_request.stream_gpt_with_proxy', side_effect=Exception("API Error")):
+        parts = [part async for part in stream_preparation_instructions("борщ", {})]
+
+    assert parts == ["1. Нарежьте картофель."]
@@ -0,0 +1,59 @@
+import pytest
+from unittest.mock import patch
+from gpt_cache import GPTCache, make_key, normalize_dish_text
+
+
+@pytest.fixture
+def cache(tmp_path):
+    gpt_cache = GPTCache(str(tmp_path / "cache.sqlite3"), ttl=60, max_entries=2)
+    yield gpt_cache
+    gpt_cache.close()
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Борщ на 4 порции", "борщ"),
+    ("борщ на две недели", "борщ"),
+    ("Плов на неделю!", "плов"),
+    ("салат оливье, 6 порций", "салат оливье"),
+    ("Суп с курицей на 10 человек", "суп с курицей"),
+    ("Ёжики", "ежики"),
+])
+def test_normalize_dish_text(text, expected):
+    assert normalize_dish_text(text) == expected
+
+
+def test_make_key_depends_on_model_and_prompt():
+    key = make_key("ingredients", "борщ", "gpt-4o", 0.2, 1)
+
+    assert key == make_key("ingredients", "Борщ на 4 порции", "gpt-4o", 0.2, 1)
+    assert key != make_key("ingredients", "борщ", "gpt-4o-mini", 0.2, 1)
+    assert key != make_key("ingredients", "борщ", "gpt-4o", 0.2, 2)
+    assert key != make_key("instructions", "борщ", "gpt-4o", 0.2, 1)
+
+
+def test_cache_get_set(cache):
+    cache.set("borsch", {"dish": "борщ"})
+
+    assert cache.get("borsch") == {"dish": "борщ"}
+    assert cache.get("plov") is None
+
+
+def test_cache_ttl(cache):
+    cache.set("borsch", {"dish": "борщ"})
+
+    with patch("gpt_cache.time.time", return_value=10 ** 12):
+        assert cache.get("borsch") is None
+    assert len(cache) == 0
+
+
+def test_cache_evicts_least_recently_used(cache):
+    with patch("gpt_cache.time.time", side_effect=[1, 2, 3, 4, 5, 6]):
+        cache.set("borsch", 1)
+        cache.set("plov", 2)
+        # Обращение к борщу делает плов самой старой записью
+        assert cache.get("borsch") == 1
+        cache.set("salad", 3)
+
+        assert len(cache) == 2
+        assert cache.get("plov") is None
+        assert cache.get("borsch") == 1
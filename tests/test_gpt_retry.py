@@ -0,0 +1,63 @@
+import json
+from unittest.mock import patch
+
+import httpx
+import openai
+import pytest
+
+from gpt_retry import backoff_delay, call_with_retries, is_transient, repair_integer, repair_json
+
+
+def status_error(error_class, status, headers=None):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return error_class("Ошибка", response=httpx.Response(status, headers=headers, request=request), body=None)
+
+
+def test_transient_errors():
+    assert is_transient(openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com")))
+    assert is_transient(status_error(openai.RateLimitError, 429))
+    assert is_transient(status_error(openai.InternalServerError, 503))
+    assert not is_transient(status_error(openai.BadRequestError, 400))
+    assert not is_transient(ValueError("Некорректный ответ"))
+
+
+def test_backoff_grows_and_is_capped():
+    with patch('gpt_retry.random.uniform', side_effect=lambda low, high: high):
+        delays = [backoff_delay(attempt, base_delay=0.5, max_delay=4) for attempt in range(6)]
+
+    assert delays == [0.5, 1, 2, 4, 4, 4]
+
+
+def test_backoff_respects_retry_after():
+    error = status_error(openai.RateLimitError, 429, {"retry-after": "3"})
+
+    with patch('gpt_retry.random.uniform', return_value=0.1):
+        assert backoff_delay(0, error, base_delay=0.5, max_delay=8) == 3
+        # Слишком долгое ожидание ограничивается наибольшей паузой
+        assert backoff_delay(0, error, base_delay=0.5, max_delay=2) == 2
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('```json\n{"борщ": {"свекла": [150, "г"]}}\n```', {"борщ": {"свекла": [150, "г"]}}),
+    ('Ответ: {"dish": "борщ", "portions": 2,} Приятного аппетита!', {"dish": "борщ", "portions": 2}),
+    ("{'dish': 'борщ'}", {"dish": "борщ"}),
+])
+def test_repair_json(text, expected):
+    assert json.loads(repair_json(text)) == expected
+
+
+def test_repair_json_gives_up():
+    assert repair_json("Не знаю") is None
+    assert repair_json('{"dish": "борщ", "portions": }') is None
+    assert repair_integer("Получится 4 порции") == "4"
+    assert repair_integer("много") is None
+
+
+def test_call_with_retries_gives_up_after_attempts():
+    answers = iter(["нет", "нет", "нет"])
+
+    def ask(messages, **kwargs):
+        return next(answers)
+
+    with pytest.raises(ValueError, match="Не получилось"):
+        call_with_retries(ask, [{"role": "user", "content": "сколько?"}], int, "Число!", "Не получилось", attempts=3)
@@ -0,0 +1,216 @@
+import pytest
+from unittest.mock import patch
+
+from parser.match_product import ProductIndex, ProductTable, CandidateCache, candidate_cache, match_many, \
+    match_products, rank_products, calculate_packs_needed
+
+
+# Небольшая база в формате vkusvill_products.json
+@pytest.fixture
+def database():
+    return {
+        "Овощи": [
+            {"name": "Картофель молодой", "link": "https://vkusvill.ru/goods/kartofel-1.html",
+             "quantity": "1 кг", "price": 120},
+            {"name": "Картофель мытый отборный", "link": "https://vkusvill.ru/goods/kartofel-2.html",
+             "quantity": "500 г", "price": 50},
+            {"name": "Лук репчатый", "link": "https://vkusvill.ru/goods/luk-3.html",
+             "quantity": "", "price": 80},
+            {"name": "Чипсы картофель лук сметана со вкусом зелени", "link": "https://vkusvill.ru/goods/chipsy-4.html",
+             "quantity": "100 г", "price": 90},
+        ],
+        "Масла": [
+            {"name": "Масло подсолнечное", "link": "https://vkusvill.ru/goods/maslo-5.html",
+             "quantity": "1 л", "price": 150},
+            {"name": "Томаты черри", "link": "https://vkusvill.ru/goods/tomaty-6.html",
+             "quantity": "250 уп", "price": 200},
+        ]
+    }
+
+
+def test_index_find_intersects_words(database):
+    index = ProductIndex(ProductTable(database))
+
+    assert index.find("картофель") == [0, 1]
+    assert index.find("лук репчатый") == [2]
+    assert index.find("картофель сладкий") == []
+
+
+def test_index_find_ranks_dependent_words_last():
+    index = ProductIndex(ProductTable({"Мясо": [
+        {"name": "Пельмени из говядины", "link": "", "quantity": "500 г", "price": 300},
+        {"name": "Мякоть говядины", "link": "", "quantity": "500 г", "price": 600},
+        {"name": "Говядина тушеная", "link": "", "quantity": "325 г", "price": 400},
+    ]}))
+
+    # Название начинается с ингредиента — лучше всего, ингредиент только после «из» — хуже всего
+    assert index.find("говядина") == [2, 1, 0]
+    assert index.find_best("говядина") == [2]
+    # Самые дешёвые пельмени не выбираются вместо говядины
+    assert match_products({"говядина": [500, "г"]}, index)[0]["name"] == "Говядина тушеная"
+
+
+def test_index_find_without_meaningful_words(database):
+    index = ProductIndex(ProductTable(database))
+
+    # Только единица измерения или знаки: подходить не должен ни один товар, а не весь каталог
+    assert index.find("щепотка") == []
+    assert index.find("...") == []
+    assert match_products({"щепотка": [1, "шт"]}, index) == [{}]
+
+
+def test_index_find_skips_long_names(database):
+    index = ProductIndex(ProductTable(database))
+
+    # В названии чипсов на 6 слов больше, чем в запросе
+    assert index.find("лук") == [2]
+
+
+def test_index_find_inflections_and_typos(database):
+    index = ProductIndex(ProductTable(database))
+
+    assert index.find("картофеля") == [0, 1]
+    assert index.find("лука репчатого") == [2]
+    # Опечатка находится по триграммам, если нечёткий поиск включён
+    assert index.find("картофил") == [0, 1]
+    assert ProductIndex(ProductTable(database), fuzzy_threshold=0).find("картофил") == []
+
+
+def test_match_products_cheapest_per_gram(database):
+    index = ProductIndex(ProductTable(database))
+    result = match_products({"картофель": [1200, "г"]}, index)
+
+    assert result[0]["name"] == "Картофель мытый отборный"
+    assert result[0]["packs_needed"] == 3
+    assert result[0]["total_price"] == 150
+    assert result[0]["cost_per_gram"] == 0.1
+
+
+def test_match_products_synonyms_and_defaults(database):
+    index = ProductIndex(ProductTable(database))
+    result = match_products({"растительное масло": [100, "мл"], "лук репчатый": [300, "г"]}, index)
+
+    assert result[0]["name"] == "Масло подсолнечное"
+    # Пустое количество считается за 1 кг
+    assert result[1]["quantity"] == "1 кг"
+    assert result[1]["packs_needed"] == 1
+
+
+def test_match_products_not_found(database):
+    index = ProductIndex(ProductTable(database))
+    result = match_products({"помидоры": [300, "г"], "свекла": [1, "кг"]}, index)
+
+    # У томатов неизвестная единица измерения, свеклы нет в базе
+    assert result == [{}, {}]
+
+
+def test_match_products_product_shared(database):
+    index = ProductIndex(ProductTable(database))
+    result = match_products({"картофель": [1, "кг"], "картофель мытый": [500, "г"]}, index)
+
+    # Один товар может подойти нескольким ингредиентам
+    assert result[0]["name"] == "Картофель мытый отборный"
+    assert result[1]["name"] == "Картофель мытый отборный"
+    assert result[1]["packs_needed"] == 1
+
+
+def test_match_products_cheapest_total_price():
+    index = ProductIndex(ProductTable({"Овощи": [
+        {"name": "Картофель мешок", "link": "", "quantity": "5 кг", "price": 400},
+        {"name": "Картофель мытый", "link": "", "quantity": "500 г", "price": 50},
+    ]}))
+    result = match_products({"картофель": [1200, "г"]}, index)
+
+    # Мешок дешевле за грамм, но целая упаковка обходится дороже трёх маленьких
+    assert result[0]["name"] == "Картофель мытый"
+    assert result[0]["total_price"] == 150
+
+
+def test_rank_products_top_k(database):
+    index = ProductIndex(ProductTable(database))
+    result = rank_products({"картофель": [1200, "г"], "свекла": [1, "кг"]}, index, top_k=3)
+
+    assert [(item["name"], item["total_price"]) for item in result[0]] == [
+        ("Картофель мытый отборный", 150), ("Картофель молодой", 240)
+    ]
+    assert result[1] == []
+
+
+def test_match_many_same_as_single_carts(database):
+    index = ProductIndex(ProductTable(database))
+    carts = [
+        {"картофель": [1200, "г"], "лук репчатый": [300, "г"]},
+        {"картофеля": [300, "г"], "свекла": [1, "кг"], "масло": [2, "ст"]},
+        {},
+    ]
+
+    result = match_many(carts, index)
+
+    assert [cart["products"] for cart in result] == [match_products(cart, index) for cart in carts]
+    assert [cart["total_price"] for cart in result] == [150 + 80, 50, 0]
+
+
+def test_match_many_resolves_ingredient_once(database):
+    index = ProductIndex(ProductTable(database))
+    carts = [{"Картофель": [1, "кг"]}, {"картофеля": [500, "г"]}, {"картофель": [2, "кг"], "лук": [1, "кг"]}]
+
+    with patch.object(index, "find_best", wraps=index.find_best) as find:
+        match_many(carts, index)
+
+    # «Картофель», «картофеля» и «картофель» нормализуются одинаково
+    assert find.call_count == 2
+
+
+def test_candidate_cache_hits_and_new_snapshot(database):
+    candidate_cache.clear()
+    index = ProductIndex(ProductTable(database))
+
+    match_products({"картофель": [1, "кг"]}, index)
+    # Другая форма слова и другое количество — тот же список кандидатов
+    result = match_products({"Картофеля": [500, "г"]}, index)
+
+    assert result[0]["total_price"] == 50
+    assert candidate_cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+    # Записи старого снимка не используются для нового
+    new_index = ProductIndex(ProductTable({"Овощи": [
+        {"name": "Картофель", "link": "", "quantity": "1 кг", "price": 70}
+    ]}))
+    result = match_products({"картофель": [1, "кг"]}, new_index)
+
+    assert result[0]["total_price"] == 70
+    assert candidate_cache.stats() == {"hits": 1, "misses": 2, "size": 1}
+
+
+def test_candidate_cache_evicts_least_recently_used():
+    cache = CandidateCache(max_entries=2)
+    cache.set(("лук",), 1, [1])
+    cache.set(("сол",), 1, [2])
+    cache.get(("лук",), 1)
+    cache.set(("морков",), 1, [3])
+
+    assert cache.get(("сол",), 1) is None
+    assert cache.get(("лук",), 1) == [1]
+    assert cache.get(("лук",), 2) is None
+
+
+def test_calculate_packs_needed():
+    assert calculate_packs_needed(1, "кг", 500, "г") == 2
+    assert calculate_packs_needed(1200, "мл", 1, "л") == 2
+    assert calculate_packs_needed(1, "ст", 1, "л") == -1
+
+
+def test_product_table_columns(database):
+    table = ProductTable(database)
+
+    assert len(table) == 6
+    assert table.grams[1] == 500
+    assert table.cost_per_gram[1] == 0.1
+    # Пустое количество заменяется на 1 кг один раз при загрузке
+    assert table.quantities[2] == "1 кг"
+    assert table.grams[2] == 1000
+    # Неизвестная единица измерения помечается сразу
+    assert table.valid[5] == 0
+    assert table.invalid_count == 1
+    assert table.product(4) == {"name": "Масло подсолнечное", "link": "https://vkusvill.ru/goods/maslo-5.html",
+                                "quantity": "1 л", "price": 150}
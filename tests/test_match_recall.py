@@ -0,0 +1,58 @@
+import json
+import os
+import re
+
+import pytest
+from parser.catalog import ProductIndex, ProductTable
+from parser.match_product import match_products
+
+TESTS_DIR = os.path.dirname(__file__)
+CATALOG_PATH = os.path.join(TESTS_DIR, "..", "vkusvill_products.json")
+SAMPLE_PATH = os.path.join(TESTS_DIR, "fixtures", "ingredients_recall.json")
+
+# Доля ингредиентов из размеченной выборки, для которых среди кандидатов есть подходящий товар.
+# Точное совпадение слов без нормализации давало 0.69
+MIN_RECALL = 0.95
+
+
+@pytest.fixture(scope="module")
+def index():
+    if not os.path.exists(CATALOG_PATH):
+        pytest.skip("Нет базы продуктов vkusvill_products.json")
+    with open(CATALOG_PATH, encoding="utf-8") as f:
+        return ProductIndex(ProductTable(json.load(f)))
+
+
+@pytest.fixture(scope="module")
+def sample():
+    with open(SAMPLE_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_recall_on_labeled_sample(index, sample):
+    misses = []
+    for item in sample:
+        expected = re.compile(item["expected"])
+        candidates = index.find(item["ingredient"])
+        if not any(expected.search(index.table.names[i].lower().replace("ё", "е")) for i in candidates):
+            misses.append(item["ingredient"])
+
+    # Время поиска замеряется в tests/benchmarks/bench.py (раздел lookup)
+    recall = 1 - len(misses) / len(sample)
+    assert recall >= MIN_RECALL, f"Полнота {recall:.3f}, не найдены: {misses}"
+
+
+@pytest.mark.parametrize("ingredient, amount, expected", [
+    ("говядина", [500, "г"], "говядина"),
+    ("говядина", [2100, "г"], "говядина"),
+    ("сахар", [70, "г"], "сахар"),
+    ("сахар", [1, "кг"], "сахар"),
+    ("яйца", [3, "шт"], "яйц"),
+    ("яйца", [200, "г"], "яйц"),
+])
+def test_selected_product_is_named_by_ingredient(index, ingredient, amount, expected):
+    # Товары, где ингредиент только в составе («Пельмени из говядины», «Арахис в сахаре»,
+    # «Майонез на перепелином яйце»), не выбираются вместо самого продукта
+    product = match_products({ingredient: amount}, index)[0]
+
+    assert product["name"].lower().startswith(expected)
@@ -0,0 +1,29 @@
+from parser.normalize import normalize_tokens, stem, trigrams
+
+
+def test_stem_inflections():
+    assert stem("картофель") == stem("картофеля") == "картофел"
+    assert stem("яйца") == stem("яйцо") == stem("яйцами") == "яйц"
+    assert stem("свёкла") == "свекл"
+
+
+def test_normalize_tokens():
+    # Синонимы, беглая гласная и знаки по краям слов
+    assert normalize_tokens("Помидоры (черри)") == normalize_tokens("томаты черри")
+    assert normalize_tokens("огурец") == normalize_tokens("огурцы")
+    assert normalize_tokens("растительное масло") == ("подсолнечный", "масл")
+    # Слова-меры из рецептов пропускаются
+    assert normalize_tokens("зубчик чеснока") == normalize_tokens("чеснок")
+
+
+def test_adjective_does_not_match_noun():
+    assert normalize_tokens("сыр") != normalize_tokens("сырой")
+    assert normalize_tokens("сырое") == normalize_tokens("сырая") == normalize_tokens("сырой")
+    # Творительный падеж существительного — не прилагательное
+    assert normalize_tokens("рисом") == normalize_tokens("рис")
+    assert normalize_tokens("сыром") == normalize_tokens("сыр") != normalize_tokens("сырой")
+    assert normalize_tokens("горошком") == normalize_tokens("горошек")
+
+
+def test_trigrams():
+    assert trigrams("лук") == {" лу", "лук", "ук "}
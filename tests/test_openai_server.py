@@ -0,0 +1,114 @@
+import asyncio
+import json
+from contextlib import ExitStack
+from unittest.mock import patch
+
+import openai
+import pytest
+
+from gpt_request import close_gpt_clients, get_dish_with_portions, get_ingredients_list, stream_preparation_instructions
+from tests.benchmarks.bench import load_corpus
+from tests.benchmarks.fake_openai import CorpusResponder
+from tests.benchmarks.openai_server import OpenAIStandIn, prompt_key, split_chunks
+
+BORSCHT = "Борщ на 7 порций"
+
+
+@pytest.fixture
+def serve():
+    """Запускает локальный сервер и направляет на него клиент OpenAI (последний запущенный сервер)."""
+    with ExitStack() as stack:
+        for name, value in (("HTTPS_PROXY_IPPORT", ""), ("OPENAI_API_KEY", "test"), ("GPT_CACHE_PATH", "")):
+            stack.enter_context(patch(f'gpt_request.config.{name}', value))
+
+        def start(**kwargs):
+            stand_in = stack.enter_context(OpenAIStandIn(**kwargs))
+            stack.enter_context(patch('gpt_request.config.OPENAI_BASE_URL', stand_in.base_url))
+            close_gpt_clients()
+            return stand_in
+
+        stack.callback(close_gpt_clients)
+        yield start
+
+
+@pytest.fixture(scope="module")
+def responder():
+    return CorpusResponder(load_corpus())
+
+
+def test_requests_reuse_one_connection(serve, responder):
+    stand_in = serve(responder=responder)
+
+    first = get_ingredients_list(BORSCHT)
+    second = get_ingredients_list(BORSCHT)
+
+    assert first == second
+    assert first["dish"] == "борщ"
+    assert first["ingredients"]["свекла"] == [2100, "г"]
+    stats = stand_in.stats()
+    assert stats["requests"] == 2
+    # Клиент держит соединение открытым между запросами
+    assert stats["connections"] == 1
+
+
+def test_streaming_response(serve, responder):
+    stand_in = serve(responder=responder)
+
+    async def collect():
+        return [part async for part in stream_preparation_instructions("борщ", {})]
+
+    parts = asyncio.run(collect())
+
+    assert len(parts) > 1
+    assert parts[-1] == responder([{"content": ""}, {"content": "инструкция"}])
+    assert stand_in.stats()["streams"] == 1
+
+
+def test_malformed_responses_trigger_retries(serve, responder):
+    stand_in = serve(responder=responder, malformed_rate=1.0)
+
+    with pytest.raises(ValueError):
+        get_dish_with_portions(BORSCHT)
+
+    assert stand_in.stats()["malformed"] == 5
+
+
+def test_injected_errors(serve, responder):
+    stand_in = serve(responder=responder, error_rate=1.0, error_status=400)
+
+    with pytest.raises(ValueError) as error:
+        get_dish_with_portions(BORSCHT)
+
+    assert isinstance(error.value.__cause__, openai.BadRequestError)
+
+    assert stand_in.stats()["errors"] == 1
+
+
+def test_record_and_replay(serve, responder, tmp_path):
+    recordings = str(tmp_path / "recordings.json")
+    upstream = serve(responder=responder)
+    recorder = serve(record_url=upstream.base_url, recordings_path=recordings)
+
+    recorded = get_ingredients_list(BORSCHT)
+    recorder.stop()
+
+    with open(recordings, encoding="utf-8") as f:
+        responses = json.load(f)["responses"]
+    assert len(responses) == 1 and upstream.stats()["requests"] == 1
+
+    # Записанный ответ отдаётся без обращения к исходному API, незаписанный запрос получает 404
+    replay = serve(recordings_path=recordings)
+    assert get_ingredients_list(BORSCHT) == recorded
+    assert replay.stats()["replayed"] == 1 and upstream.stats()["requests"] == 1
+    with pytest.raises(ValueError) as error:
+        get_dish_with_portions("Плов на неделю")
+    assert isinstance(error.value.__cause__, openai.NotFoundError)
+
+
+def test_prompt_key_and_chunks():
+    assert prompt_key([{"role": "user", "content": "борщ"}]) == prompt_key([{"content": "борщ", "role": "user"}])
+    assert prompt_key([{"role": "user", "content": "борщ"}]) != prompt_key([{"role": "user", "content": "щи"}])
+
+    chunks = split_chunks("1. Нарежьте картофель.\n2. Варите 20 минут.\n", 3)
+    assert len(chunks) == 3
+    assert "".join(chunks) == "1. Нарежьте картофель.\n2. Варите 20 минут.\n"
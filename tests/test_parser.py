@@ -1,6 +1,20 @@
+import functools
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
 import unittest
-from unittest.mock import patch, MagicMock
-from parser.parse_bd import get_categories, get_total_pages, parse_product_from_vv
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from unittest.mock import ANY, patch, MagicMock
+import requests
+from parser.catalog_binary import BinaryProductTable, binary_path
+from parser.parse_bd import BASE_URL, Fetcher, get_categories, get_total_pages, parse_product_from_vv, write_json_atomic
+from parser.update_bd import update_bd
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "vkusvill")
 
 
 class TestGetCategories(unittest.TestCase):
@@ -127,16 +141,217 @@ class TestParseProductFromVV(unittest.TestCase):
             {"name": "Product1", "price": 100, "quantity": "500 г"}
         ]
 
-        # Глобальные переменные
-        global good_category, BD_path
-        good_category = ["Напитки"]
-        BD_path = "test_db.json"
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "products.json")
+
+            # Вызов тестируемой функции
+            parse_product_from_vv(path, incremental=False)
 
-        # Вызов тестируемой функции
-        parse_product_from_vv()
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
 
         # Проверяем, что get_categories был вызван
         mock_get_categories.assert_called_once()
 
-        # Проверяем, что parse_products_in_category был вызван с правильным аргументом
-        mock_parse_products.assert_called_once_with("https://example.com/Напитки")
+        # Проверяем, что parse_products_in_category был вызван для категории с общим загрузчиком страниц
+        mock_parse_products.assert_called_once_with("https://example.com/Напитки", ANY, BASE_URL, None)
+        self.assertEqual(data, {"Напитки": mock_parse_products.return_value})
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Локальная замена сайта: отдаёт сохранённые HTML-страницы из tests/fixtures/vkusvill с ETag."""
+    fixtures_dir = FIXTURES_DIR
+    flaky_requests = 0
+    # Пути, на которые сайт всегда отвечает 503
+    throttled = ()
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/unavailable" or url.path in self.throttled:
+            self.send_response(503)
+            self.end_headers()
+            return
+        if url.path == "/flaky":
+            # Первый запрос завершается ошибкой сервера, повторный — успешно
+            FixtureHandler.flaky_requests += 1
+            self.send_response(503 if FixtureHandler.flaky_requests == 1 else 200)
+            self.end_headers()
+            return
+
+        name = url.path.strip("/").replace("/", "_")
+        page = parse_qs(url.query).get("PAGEN_1")
+        if page:
+            name += f"_{page[0]}"
+        path = os.path.join(self.fixtures_dir, f"{name}.html")
+        if not os.path.exists(path):
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        with open(path, "rb") as f:
+            body = f.read()
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestParseWithLocalServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_parse_product_from_vv(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "products.json")
+            parse_product_from_vv(path, self.base_url, incremental=False)
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+
+        # Категории не из списка пропускаются, страницы категории идут по порядку
+        self.assertEqual(data, {
+            "Овощи, фрукты, ягоды, зелень": [
+                {"name": "Картофель молодой", "link": f"{self.base_url}/goods/kartofel-molodoy-101.html",
+                 "quantity": "1 кг", "price": 120},
+                {"name": "Манго Египет", "link": f"{self.base_url}/goods/mango-egipet-102.html",
+                 "quantity": None, "price": 465},
+                {"name": "Лук репчатый", "link": f"{self.base_url}/goods/luk-repchatyy-103.html",
+                 "quantity": "500 г", "price": 1080}
+            ],
+            "Сыры": [
+                {"name": "Сыр  Российский   45 ", "link": f"{self.base_url}/goods/syr-rossiyskiy-201.html",
+                 "quantity": "200 г", "price": 250}
+            ]
+        })
+
+    def test_fetcher_retries_server_errors(self):
+        fetcher = Fetcher(request_interval=0, backoff=0)
+        response = fetcher.get(f"{self.base_url}/flaky")
+        fetcher.close()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(FixtureHandler.flaky_requests, 2)
+
+    def test_fetcher_raises_after_last_retry(self):
+        fetcher = Fetcher(request_interval=0, max_retries=1, backoff=0)
+        with self.assertRaises(requests.HTTPError):
+            fetcher.get(f"{self.base_url}/unavailable")
+        fetcher.close()
+
+    def test_throttled_category_keeps_old_products(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "products.json")
+            fetcher = functools.partial(Fetcher, request_interval=0, max_retries=1, backoff=0)
+
+            with patch("parser.parse_bd.Fetcher", fetcher):
+                parse_product_from_vv(path, self.base_url, incremental=True)
+                with open(path + ".state.json", encoding="utf-8") as f:
+                    state = json.load(f)
+
+                with patch.object(FixtureHandler, "throttled", ("/goods/syry/",)):
+                    changes = parse_product_from_vv(path, self.base_url, incremental=True)
+
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            with open(path + ".state.json", encoding="utf-8") as f:
+                new_state = json.load(f)
+
+        # Ответ 503 не разбирается как пустая страница: сыры и состояние их страниц остаются прежними
+        self.assertEqual(changes, {"added": [], "removed": [], "repriced": []})
+        self.assertEqual(len(data["Сыры"]), 1)
+        self.assertEqual(new_state, state)
+
+    def test_incremental_refresh(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fixtures_dir = os.path.join(tmp_dir, "site")
+            shutil.copytree(FIXTURES_DIR, fixtures_dir)
+            path = os.path.join(tmp_dir, "products.json")
+
+            with patch.object(FixtureHandler, "fixtures_dir", fixtures_dir):
+                first = parse_product_from_vv(path, self.base_url, incremental=True)
+                first_mtime = os.stat(path).st_mtime_ns
+
+                # Повторный запуск: все страницы отвечают 304, база не перезаписывается
+                unchanged = parse_product_from_vv(path, self.base_url, incremental=True)
+                self.assertEqual(os.stat(path).st_mtime_ns, first_mtime)
+
+                # База от версии без бинарного снимка: снимок создаётся, хотя каталог не изменился
+                os.remove(binary_path(path))
+                parse_product_from_vv(path, self.base_url, incremental=True)
+                self.assertEqual(os.stat(path).st_mtime_ns, first_mtime)
+                self.assertEqual(len(BinaryProductTable(binary_path(path))), 4)
+
+                # Меняется цена лука на второй странице овощей
+                page_path = os.path.join(fixtures_dir, "goods_ovoshchi-frukty-yagody-zelen_2.html")
+                with open(page_path, encoding="utf-8") as f:
+                    page = f.read()
+                with open(page_path, "w", encoding="utf-8") as f:
+                    f.write(page.replace("1 080 ₽", "990 ₽"))
+                changed = parse_product_from_vv(path, self.base_url, incremental=True)
+
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            with open(path + ".changes.json", encoding="utf-8") as f:
+                changes_file = json.load(f)
+
+        self.assertEqual(len(first["added"]), 4)
+        self.assertEqual(unchanged, {"added": [], "removed": [], "repriced": []})
+        self.assertEqual(changed["repriced"], [{
+            "name": "Лук репчатый", "link": f"{self.base_url}/goods/luk-repchatyy-103.html",
+            "old_price": 1080, "new_price": 990
+        }])
+        self.assertEqual(changes_file, changed)
+        self.assertEqual(data["Овощи, фрукты, ягоды, зелень"][2]["price"], 990)
+
+
+class TestAtomicWrite(unittest.TestCase):
+    def test_failed_write_keeps_old_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "products.json")
+            write_json_atomic({"Овощи": []}, path)
+
+            # Несериализуемое значение: запись падает посередине, старый файл остаётся целым
+            with self.assertRaises(TypeError):
+                write_json_atomic({"Овощи": [object()]}, path)
+
+            with open(path, encoding="utf-8") as f:
+                self.assertEqual(json.load(f), {"Овощи": []})
+            self.assertEqual(os.listdir(tmp_dir), ["products.json"])
+
+
+class TestUpdateBD(unittest.IsolatedAsyncioTestCase):
+    @patch("parser.update_bd.get_catalog")
+    @patch("parser.update_bd.parse_product_from_vv")
+    async def test_update_reloads_catalog(self, mock_parse, mock_get_catalog):
+        await update_bd(MagicMock())
+
+        mock_parse.assert_called_once()
+        mock_get_catalog.return_value.reload.assert_called_once_with()
+
+    @patch("parser.update_bd.get_catalog")
+    @patch("parser.update_bd.parse_product_from_vv", side_effect=ConnectionError)
+    async def test_failed_update_keeps_catalog(self, mock_parse, mock_get_catalog):
+        with self.assertLogs("parser.update_bd", level="ERROR") as logs:
+            await update_bd(MagicMock())
+
+        mock_get_catalog.return_value.reload.assert_not_called()
+        # Ошибка фоновой задачи попадает в лог вместе с трассировкой
+        self.assertIn("ConnectionError", logs.output[0])
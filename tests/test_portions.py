@@ -0,0 +1,41 @@
+import pytest
+
+from portions import parse_portions
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Борщ на 4 порции", 4),
+    ("Оливье на 6 человек", 6),
+    ("Сырники на 4-х человек", 4),
+    ("Паста карбонара на двоих", 2),
+    ("Куриный суп на пять порций", 5),
+    ("Плов на двадцать пять гостей", 25),
+    ("Плов на неделю", 7),
+    ("Борщ на всю неделю", 7),
+    ("борщ на две недели", 14),
+    ("Овсяная каша на завтрак на 2 недели", 14),
+    ("Суп на месяц", 30),
+    ("Гречка на пару дней", 2),
+    ("Котлеты на троих на 3 дня", 9),
+    ("Собери корзину на 1000 рублей на неделю", 7),
+    ("Борщ", 1),
+    ("Паста с грибами и сливочным соусом", 1),
+])
+def test_parse_portions(text, expected):
+    assert parse_portions(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "Борщ для семьи",
+    "Пицца для детей",
+    "Борщ на 4",
+    "Борщ на 2 литра",
+    "Шарлотка на 8 кусочков",
+    "Борщ на 3-4 порции",
+    "Борщ на 4 или 6 порций",
+    "Борщ на 4 порции на неделю",
+    "Борщ на полторы недели",
+])
+def test_parse_portions_ambiguous(text):
+    # Количество неоднозначно: его определяет модель
+    assert parse_portions(text) is None
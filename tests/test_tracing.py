@@ -0,0 +1,120 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import tracing
+from gpt_request import get_number_of_portions, run_gpt_async
+from tracing import load_records, percentile, span, summarize, trace_request
+
+
+@pytest.fixture
+def trace_path(tmp_path):
+    path = str(tmp_path / "traces.jsonl")
+    with patch('tracing.config.TRACE_PATH', path), patch('gpt_request.config.GPT_CACHE_PATH', ''):
+        yield path
+    tracing.close_exporter()
+
+
+def read(path):
+    tracing.close_exporter()
+    return {record["name"]: record for record in load_records(path)}
+
+
+def test_spans_are_nested_and_bound_to_request(trace_path):
+    with trace_request(42, state="shopping"):
+        with span("match", ingredients=3) as current:
+            current.set(found=2)
+    with span("catalog.load"):
+        pass
+
+    records = read(trace_path)
+
+    request, match = records["request"], records["match"]
+    assert request["chat_id"] == 42 and request["attributes"] == {"state": "shopping"}
+    assert match["request_id"] == request["request_id"]
+    assert match["parent_id"] == request["span_id"]
+    assert match["attributes"] == {"ingredients": 3, "found": 2}
+    # Спан вне запроса не получает его номер
+    assert records["catalog.load"]["request_id"] is None
+
+
+def test_span_records_errors(trace_path):
+    with pytest.raises(ValueError):
+        with span("gpt.request"):
+            raise ValueError("нет ответа")
+
+    record = read(trace_path)["gpt.request"]
+    assert record["status"] == "error"
+    assert record["attributes"]["error"] == "ValueError"
+
+
+def gpt_response(content, prompt_tokens, completion_tokens):
+    response = MagicMock()
+    response.choices[0].message.content = content
+    response.usage.prompt_tokens = prompt_tokens
+    response.usage.completion_tokens = completion_tokens
+    return response
+
+
+def test_request_context_reaches_gpt_threads(trace_path):
+    client = MagicMock()
+    client.chat.completions.create.side_effect = [gpt_response("четыре", 100, 2), gpt_response("4", 120, 1)]
+
+    async def handle():
+        with trace_request(7):
+            return await run_gpt_async(get_number_of_portions, "борщ для семьи")
+
+    with patch('gpt_request.get_gpt_client', return_value=client):
+        assert asyncio.run(handle()) == 4
+
+    records = load_records(trace_path)
+    tracing.close_exporter()
+    by_name = {}
+    for record in records:
+        by_name.setdefault(record["name"], []).append(record)
+
+    request_id = by_name["request"][0]["request_id"]
+    portions = by_name["gpt.portions"][0]
+    # Спаны из пула потоков относятся к тому же запросу и вложены в спан этапа
+    assert portions["request_id"] == request_id and portions["chat_id"] == 7
+    assert portions["attributes"]["attempts"] == 2
+    assert [(r["attributes"]["prompt_tokens"], r["parent_id"]) for r in by_name["gpt.request"]] == \
+           [(100, portions["span_id"]), (120, portions["span_id"])]
+    assert summarize(records)["retried_fraction"] == 1.0
+
+
+def test_percentile():
+    values = list(range(1, 101))
+
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([3.0], 99) == 3.0
+    assert percentile([], 50) is None
+
+
+def test_summarize_stages_and_retries():
+    records = []
+    for i in range(10):
+        request_id = f"r{i}"
+        records.append({"name": "request", "duration_ms": 100 + i, "status": "ok", "request_id": request_id,
+                        "attributes": {}})
+        # Каждому пятому запросу понадобилась повторная попытка
+        records.append({"name": "gpt.extract", "duration_ms": 50 + i, "status": "ok" if i else "error",
+                        "request_id": request_id, "attributes": {"attempts": 2 if i % 5 == 0 else 1}})
+
+    summary = summarize(records)
+
+    assert summary["requests"] == 10
+    assert summary["retried_fraction"] == 0.2
+    assert summary["stages"]["request"] == {"count": 10, "error_rate": 0.0, "p50": 104, "p95": 109, "p99": 109}
+    assert summary["stages"]["gpt.extract"]["error_rate"] == 0.1
+
+
+def test_tracing_can_be_disabled():
+    with patch('tracing.config.TRACE_PATH', ''):
+        with trace_request(1):
+            with span("match"):
+                pass
+        assert tracing.get_exporter() is None
@@ -0,0 +1,229 @@
+import contextvars
+import functools
+import json
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import config
+
+# Контекст трассировки: чат и запрос, к которым относятся спаны, и текущий открытый спан.
+# Переменные контекста наследуются задачами asyncio, а в пул потоков передаются через copy_context
+# (см. gpt_request.run_gpt_async)
+_chat_id = contextvars.ContextVar("trace_chat_id", default=None)
+_request_id = contextvars.ContextVar("trace_request_id", default=None)
+_current_span = contextvars.ContextVar("trace_current_span", default=None)
+
+
+class Span:
+    """Открытый этап обработки запроса: имя, родительский спан, время начала и атрибуты."""
+
+    __slots__ = ("name", "span_id", "parent_id", "started_at", "attributes")
+
+    def __init__(self, name, parent_id=None, attributes=None):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.started_at = time.time()
+        self.attributes = attributes or {}
+
+    def set(self, **attributes):
+        """Добавляет атрибуты спана (количество токенов, попыток, найденных товаров и т.п.)."""
+        self.attributes.update(attributes)
+
+
+class JsonlExporter:
+    """
+    Дописывает завершённые спаны в файл JSONL: одна строка — один спан.
+
+    Запись синхронная и без ротации: файл растёт, пока его не удалят, поэтому трассировка включается
+    только на время замеров.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    """
+    Возвращает общий экспортёр спанов по настройкам из config или None, если трассировка отключена
+    (TRACE_PATH пустой).
+    """
+    global _exporter
+    if not config.TRACE_PATH:
+        return None
+    if _exporter is None or _exporter.path != config.TRACE_PATH:
+        with _exporter_lock:
+            if _exporter is None or _exporter.path != config.TRACE_PATH:
+                if _exporter is not None:
+                    _exporter.close()
+                _exporter = JsonlExporter(config.TRACE_PATH)
+    return _exporter
+
+
+def close_exporter():
+    """Закрывает файл спанов при остановке бота."""
+    global _exporter
+    with _exporter_lock:
+        if _exporter is not None:
+            _exporter.close()
+            _exporter = None
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Замеряет этап обработки запроса и записывает его в файл спанов.
+
+    Спан привязывается к текущему чату и запросу (см. trace_request) и к объемлющему спану. Исключение внутри
+    помечает спан статусом error и пробрасывается дальше.
+    """
+    parent = _current_span.get()
+    current = Span(name, parent.span_id if parent else None, attributes)
+    token = _current_span.set(current)
+    status = "ok"
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        status = "error"
+        current.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        _current_span.reset(token)
+        exporter = get_exporter()
+        if exporter is not None:
+            exporter.export({
+                "ts": current.started_at,
+                "name": name,
+                "duration_ms": round(duration_ms, 3),
+                "status": status,
+                "request_id": _request_id.get(),
+                "chat_id": _chat_id.get(),
+                "span_id": current.span_id,
+                "parent_id": current.parent_id,
+                "attributes": current.attributes
+            })
+
+
+@contextmanager
+def trace_request(chat_id, **attributes):
+    """Корневой спан обработки одного сообщения или нажатия кнопки: задаёт чат и новый номер запроса."""
+    chat_token = _chat_id.set(chat_id)
+    request_token = _request_id.set(uuid.uuid4().hex[:16])
+    try:
+        with span("request", **attributes) as current:
+            yield current
+    finally:
+        _request_id.reset(request_token)
+        _chat_id.reset(chat_token)
+
+
+def traced(name):
+    """Декоратор: выполняет функцию внутри спана name."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def set_attributes(**attributes):
+    """Добавляет атрибуты текущему спану; вне спана ничего не делает."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+# Разбор файла спанов
+
+def load_records(path):
+    """Читает спаны из файла JSONL, пропуская недописанные строки."""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def percentile(values, q):
+    """Перцентиль q (0–100) по методу ближайшего ранга."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(records):
+    """
+    Сводка по спанам: для каждого этапа — число спанов, доля ошибок и p50/p95/p99 длительности в мс,
+    а также доля запросов, в которых хотя бы один запрос к модели понадобилось повторить.
+    """
+    durations = {}
+    errors = {}
+    requests = set()
+    retried = set()
+    for record in records:
+        name = record["name"]
+        durations.setdefault(name, []).append(record["duration_ms"])
+        errors[name] = errors.get(name, 0) + (record["status"] == "error")
+        request_id = record.get("request_id")
+        if request_id is None:
+            continue
+        if name == "request":
+            requests.add(request_id)
+        if record.get("attributes", {}).get("attempts", 1) > 1:
+            retried.add(request_id)
+
+    stages = {
+        name: {
+            "count": len(values),
+            "error_rate": errors[name] / len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99)
+        }
+        for name, values in durations.items()
+    }
+    return {
+        "stages": stages,
+        "requests": len(requests),
+        "retried_fraction": len(retried & requests) / len(requests) if requests else 0.0
+    }
+
+
+if __name__ == "__main__":
+    summary = summarize(load_records(sys.argv[1] if len(sys.argv) > 1 else config.TRACE_PATH or "traces.jsonl"))
+    print(f"{'этап':<24}{'кол-во':>8}{'ошибки':>9}{'p50, мс':>11}{'p95, мс':>11}{'p99, мс':>11}")
+    for name, stage in sorted(summary["stages"].items()):
+        print(f"{name:<24}{stage['count']:>8}{stage['error_rate']:>9.1%}"
+              f"{stage['p50']:>11.1f}{stage['p95']:>11.1f}{stage['p99']:>11.1f}")
+    print(f"Запросов: {summary['requests']}, с повторными обращениями к модели: {summary['retried_fraction']:.1%}")